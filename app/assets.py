@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.assets
+~~~~~~~~~~
+
+The asset fingerprinting for spa-base.
+
+The `flask build` commands copy each asset they build to a name that carries a
+hash of its content (`css/app.css` to `css/app.3f2a9c1b4d.css`), and record
+the mapping in a manifest in htdocs (ASSETS_MANIFEST):
+
+    {"css/app.css": "css/app.3f2a9c1b4d.css", ...}
+
+Templates link to assets with `asset_url`, which looks names up in the
+manifest:
+
+    <link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
+
+Since a changed asset gets a new name, fingerprinted assets can be cached
+forever (see `app.middleware.StaticFilesMiddleware`). Names that aren't in the
+manifest (before anything is built) link to the file itself.
+
+Each fingerprinted copy of a text asset is also written gzipped (and with
+brotli, when it is installed) next to it, for `StaticFilesMiddleware` to serve
+to clients that accept it, rather than compressing it on every request.
+
+A build keeps the previous copy of each asset (the one in the manifest it
+replaces), since processes that haven't been restarted yet still link to it;
+older copies (and their compressed files) are removed.
+
+The service worker (htdocs/service-worker.js) is generated from
+assets/js/service-worker.js with the same manifest: it precaches every asset
+in it, and its cache version is a hash of the manifest, so clients drop their
+old cache whenever an asset changes.
+"""
+
+from glob import glob
+import gzip
+import hashlib
+import json
+import os
+from os import path
+import re
+import shutil
+
+from jinja2 import Template
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}(\.\w+)$')
+COMPRESSIBLE = frozenset(['.css', '.html', '.js', '.json', '.svg', '.txt',
+                          '.xml'])
+COMPRESSED = ('.br', '.gz')
+SERVICE_WORKER_SOURCE = 'assets/js/service-worker.js'
+SERVICE_WORKER = 'service-worker.js'
+
+
+class AssetManifest(object):
+    """The mapping of asset names to their fingerprinted names, read once from
+    `filename` (or whenever it changes, with `reload`)."""
+
+    def __init__(self, filename, reload=False):
+        self.filename = filename
+        self.reload = reload
+        self.mtime = None
+        self.assets = None
+
+    def __getitem__(self, name):
+        return self.load().get(name, name)
+
+    def load(self):
+        if self.assets is None or self.reload and self._changed():
+            self.assets = read_manifest(self.filename)
+            self.mtime = self._mtime()
+        return self.assets
+
+    def url(self, name):
+        """Returns the url of the asset `name` (relative to htdocs)."""
+        return '/' + self[name.lstrip('/')]
+
+    def _changed(self):
+        return self._mtime() != self.mtime
+
+    def _mtime(self):
+        try:
+            return os.stat(self.filename).st_mtime
+        except FileNotFoundError:
+            return None
+
+
+def init_app(app):
+    manifest = AssetManifest(path.join(app.static_folder,
+                                       app.config['ASSETS_MANIFEST']),
+                             reload=app.debug)
+    app.extensions['asset_manifest'] = manifest
+    app.add_template_global(manifest.url, 'asset_url')
+
+
+def content_hash(filename, length=10):
+    """Returns the first `length` hex digits of the hash of a file."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as asset:
+        for chunk in iter(lambda: asset.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def fingerprint(root, name, previous=None):
+    """Copies the asset `name` (relative to `root`) to its fingerprinted name
+    and returns the new name. Its other fingerprinted copies are removed, but
+    for the `previous` one."""
+    base, extension = path.splitext(name)
+    hashed = '{}.{}{}'.format(base, content_hash(path.join(root, name)),
+                              extension)
+    keep = {path.basename(name), path.basename(hashed),
+            path.basename(previous or name)}
+    directory = path.dirname(path.join(root, name))
+    for filename in os.listdir(directory):
+        copy = uncompressed(filename)
+        if copy not in keep and unfingerprinted(copy) == path.basename(name):
+            os.remove(path.join(directory, filename))
+    shutil.copy2(path.join(root, name), path.join(root, hashed))
+    if extension in COMPRESSIBLE:
+        precompress(path.join(root, hashed))
+    return hashed
+
+
+def precompress(filename):
+    """Writes `filename` gzipped (and with brotli, when it is installed) to
+    `filename.gz` (and `.br`), unless that doesn't make it any smaller."""
+    with open(filename, 'rb') as asset:
+        content = asset.read()
+    variants = {'.gz': gzip.compress(content, 9)}
+    if brotli:
+        variants['.br'] = brotli.compress(content)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            with open(filename + suffix + '.tmp', 'wb') as output:
+                output.write(compressed)
+            os.replace(filename + suffix + '.tmp', filename + suffix)
+
+
+def uncompressed(name):
+    """Returns `name` without a `.gz` or `.br` suffix."""
+    base, extension = path.splitext(name)
+    return base if extension in COMPRESSED else name
+
+
+def unfingerprinted(name):
+    """Returns `name` without its content hash (if it has one)."""
+    return FINGERPRINTED.sub(r'\1', name)
+
+
+def read_manifest(filename):
+    try:
+        with open(filename) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def update_manifest(root, manifest, patterns):
+    """Fingerprints the assets matching `patterns` (relative to `root`) and
+    adds them to the `manifest` file. Returns the updated mapping."""
+    filename = path.join(root, manifest)
+    assets = read_manifest(filename)
+    for pattern in patterns:
+        for asset in sorted(glob(path.join(root, pattern))):
+            name = path.relpath(asset, root).replace(path.sep, '/')
+            if name != unfingerprinted(name):
+                continue
+            assets[name] = fingerprint(root, name, assets.get(name)) \
+                .replace(path.sep, '/')
+    # Drop assets that no longer exist.
+    assets = {name: hashed for name, hashed in assets.items()
+              if path.exists(path.join(root, name)) and
+              path.exists(path.join(root, hashed))}
+    _write(filename, json.dumps(assets, indent=4, sort_keys=True) + '\n')
+    return assets
+
+
+def manifest_version(assets):
+    """Returns a version that changes whenever an asset does."""
+    return hashlib.sha1(json.dumps(assets, sort_keys=True).encode('utf-8')) \
+        .hexdigest()[:10]
+
+
+def build_service_worker(root, assets, source=SERVICE_WORKER_SOURCE):
+    """Writes the service worker to `root`, precaching `assets`."""
+    with open(source) as template:
+        service_worker = Template(template.read(), keep_trailing_newline=True)
+    _write(path.join(root, SERVICE_WORKER), service_worker.render(
+        version=manifest_version(assets),
+        assets=['/' + hashed for name, hashed in sorted(assets.items())]))
+
+
+def _write(filename, content):
+    """Atomically replaces `filename`, so it is never served half written."""
+    with open(filename + '.tmp', 'w') as output:
+        output.write(content)
+    os.replace(filename + '.tmp', filename)
@@ -62,7 +62,7 @@ class RegistrationForm(BaseForm):
     submit = SubmitField('Register')
 
     def validate_email(self, email):
-        duplicate_email = Email.query.filter_by(email=email.data, verified=True).first()
+        duplicate_email = Email.find_verified(email.data)
         if duplicate_email is not None:
             raise ValidationError('A user with this email has already ' + \
                 'registered. Did you forget your password?')
@@ -9,7 +9,7 @@ The auth login manager for spa-base.
 
 from flask_login import LoginManager
 
-from app.models import User
+from app.models import load_user as load_cached_user
 
 
 login = LoginManager()
@@ -24,4 +24,4 @@ login.needs_refresh_message = (
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return load_cached_user(int(id))
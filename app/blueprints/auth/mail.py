@@ -7,30 +7,68 @@ app.blueprints.auth.email
 The auth routes for spa-base.
 """
 
-from flask import current_app, render_template
-from app.mail import send_mail
+from flask import current_app
+from sqlalchemy import and_
+from app.mail_templates import MailTemplate
+from app.models import db, Email, User
+from app.outbox import enqueue_mail
+
+
+EMAIL_VERIFICATION = MailTemplate('auth/email/email_verification')
+PASSWORD_RESET = MailTemplate('auth/email/password_reset')
+EMAIL_NOT_FOUND = MailTemplate('auth/email/email_not_found', static=True)
 
 
 def send_email_verification_mail(user, email):
-    token = email.verification_token
-    send_mail('[SPA-Base] Please Verify Your Email',
-              sender=current_app.config['SERVER_EMAIL'], recipients=[str(email)],
-              text_body=render_template('auth/email/email_verification.txt',
-                                        user=user, token=token),
-              html_body=render_template('auth/email/email_verification.html',
-                                        user=user, token=token))
+    text_body, html_body = EMAIL_VERIFICATION.render(
+        user=user, token=email.verification_token)
+    enqueue_mail('[SPA-Base] Please Verify Your Email',
+                 sender=current_app.config['SERVER_EMAIL'], recipients=[str(email)],
+                 text_body=text_body, html_body=html_body)
+
+def send_email_verification_reminders(users):
+    """Sends each of `users` a new link to verify their (primary) email,
+    rendering all of the mail at once."""
+    emails = [user.email for user in users]
+    bodies = EMAIL_VERIFICATION.render_many(
+        {'user': user, 'token': token}
+        for user, token in zip(users, Email.verification_tokens(emails)))
+    for email, (text_body, html_body) in zip(emails, bodies):
+        enqueue_mail('[SPA-Base] Please Verify Your Email',
+                     sender=current_app.config['SERVER_EMAIL'],
+                     recipients=[str(email)], text_body=text_body,
+                     html_body=html_body)
+
+def send_unverified_email_reminders(chunk_size=1000):
+    """Sends a verification reminder to every active user whose primary email
+    isn't verified, committing each chunk of users. Returns the count."""
+    primary_email = User.primary_email
+    count = after_id = 0
+    while True:
+        users = User.query \
+            .join(Email, and_(Email.user_id == User.id,
+                              Email.email == primary_email)) \
+            .filter(User.active == True, Email.verified == False,
+                    User.id > after_id) \
+            .order_by(User.id) \
+            .limit(chunk_size) \
+            .all()
+        if not users:
+            return count
+        send_email_verification_reminders(users)
+        db.session.commit()
+        count += len(users)
+        after_id = users[-1].id
 
 def send_password_reset_mail(user):
-    token = user.password_reset_token
-    send_mail('[SPA-Base] Reset Your Password',
-              sender=current_app.config['SERVER_EMAIL'], recipients=[str(user.email)],
-              text_body=render_template('auth/email/password_reset.txt',
-                                        user=user, token=token),
-              html_body=render_template('auth/email/password_reset.html',
-                                        user=user, token=token))
+    text_body, html_body = PASSWORD_RESET.render(
+        user=user, token=user.password_reset_token)
+    enqueue_mail('[SPA-Base] Reset Your Password',
+                 sender=current_app.config['SERVER_EMAIL'], recipients=[str(user.email)],
+                 text_body=text_body, html_body=html_body)
 
 def send_email_not_found_mail(email):
-    send_mail('[SPA-Base] Email Not Registered',
-              sender=current_app.config['SERVER_EMAIL'], recipients=[email],
-              text_body=render_template('auth/email/email_not_found.txt'),
-              html_body=render_template('auth/email/email_not_found.html'))
+    text_body, html_body = EMAIL_NOT_FOUND.render()
+    enqueue_mail('[SPA-Base] Email Not Registered',
+                 sender=current_app.config['SERVER_EMAIL'], recipients=[email],
+                 text_body=text_body, html_body=html_body)
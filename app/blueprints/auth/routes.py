@@ -18,10 +18,11 @@ from flask import (
 )
 from flask_login import current_user, login_user, logout_user
 import secrets
-from werkzeug.security import check_password_hash
 from werkzeug.urls import url_parse
 
-from app.models import db, Email, User
+from app.models import db, DuplicateEmailError, Email, User
+from app.passwords import hasher
+from app.ratelimit import by_email, by_ip, by_user, rate_limit
 from .forms import (
     ChangeEmailForm,
     LoginForm,
@@ -41,23 +42,22 @@ blueprint = Blueprint('auth', __name__, template_folder='templates')
 
 def authenticate(user, password):
     """A special authenticate function that helps to prevent timing attacks to
-    guess user accounts."""
-    fake_hash = 'pbkdf2:sha256:50000$' + secrets.token_hex(8) + '$' \
-                + secrets.token_hex(63)
-    fake_password = secrets.token_hex(13)
+    guess user accounts. An unknown user's password is checked against a
+    decoy hash made under the current hash policy."""
     if user is None:
-        check_password_hash(fake_hash, fake_password)
-        return False
+        return hasher.check_decoy(secrets.token_hex(13))
     return user.check_password(password)
 
 
 @blueprint.route('/login/', methods=['GET', 'POST'])
+@rate_limit('RATELIMIT_AUTH_PER_IP', by_ip)
+@rate_limit('RATELIMIT_AUTH_PER_ACCOUNT', by_email)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter(Email.email==form.email.data).first()
+        user = User.find_by_email(form.email.data)
         if not authenticate(user, form.password.data):
             flash('Invalid email address or password')
             return render_template('auth/login.html', title='Login', form=form)
@@ -78,14 +78,16 @@ def logout():
 
 
 @blueprint.route('/request_password_reset', methods=['GET', 'POST'])
+@rate_limit('RATELIMIT_MAIL_PER_IP', by_ip)
+@rate_limit('RATELIMIT_MAIL_PER_ACCOUNT', by_email)
 def request_password_reset():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     form = RequestPasswordResetForm()
     if form.validate_on_submit():
-        email = Email.query.filter_by(email=form.email.data).first()
-        if email:
-            send_password_reset_mail(email.user)
+        user = User.find_by_email(form.email.data)
+        if user:
+            send_password_reset_mail(user)
         else:
             send_email_not_found_mail(form.email.data)
         flash('Check your email for instructions to reset your password or to'
@@ -102,6 +104,9 @@ def password_reset(token):
         return redirect(url_for('auth.request_password_reset'))
     form = PasswordResetForm()
     if form.validate_on_submit():
+        if not User.verify_password_reset_token(token, consume=True):
+            flash('This password reset link has already been used.')
+            return redirect(url_for('auth.request_password_reset'))
         user.password = form.password.data
         db.session.commit()
         flash('Your password has been reset.')
@@ -110,15 +115,24 @@ def password_reset(token):
 
 
 @blueprint.route('/register/', methods=['GET', 'POST'])
+@rate_limit('RATELIMIT_AUTH_PER_IP', by_ip)
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User(email=form.email.data, password=form.password.data,
-                    first_name=form.first_name.data,
-                    last_name=form.last_name.data)
-        user.save()
+        try:
+            user = User(email=form.email.data, password=form.password.data,
+                        first_name=form.first_name.data,
+                        last_name=form.last_name.data)
+            user.save()
+        except DuplicateEmailError:
+            # The email was verified since the form validated.
+            form.email.errors.append('A user with this email has already '
+                                     'registered. Did you forget your '
+                                     'password?')
+            return render_template('auth/registration.html',
+                                   title='Register', form=form)
         login_user(user)
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('auth.send_email_verification'))
@@ -128,6 +142,8 @@ def register():
 
 @blueprint.route('/send_email_verification/', methods=['GET'])
 @blueprint.route('/send_email_verification/<email>', methods=['GET'])
+@rate_limit('RATELIMIT_MAIL_PER_IP', by_ip, methods=['GET'])
+@rate_limit('RATELIMIT_MAIL_PER_ACCOUNT', by_user, methods=['GET'])
 def send_email_verification(email=None):
     if not current_user.is_authenticated:
         flash('You must log in before you can verify your email.')
@@ -36,7 +36,7 @@ class EditProfileForm(BaseForm):
 
     def validate_email(self, email):
         if email.data != self.original_email:
-            user = User.query.filter_by(email=email.data).first()
+            user = User.find_by_email(email.data)
             if user is not None:
                 raise ValidationError('Another user is already using this email.')
 
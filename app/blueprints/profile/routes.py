@@ -8,6 +8,7 @@ The profile routes for spa-base.
 """
 
 from flask import (
+    abort,
     Blueprint,
     flash,
     redirect,
@@ -27,7 +28,9 @@ blueprint = Blueprint('profile', __name__, template_folder='templates')
 @blueprint.route('/user/<email>')
 @login_required
 def profile(email):
-    user = User.query.filter_by(email=email).first_or_404()
+    user = User.find_by_email(email)
+    if user is None:
+        abort(404)
     return render_template('profile/profile.html', user=user)
 
 
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.broadcast
+~~~~~~~~~~~~~
+
+Broadcast mail to every active user for spa-base (`flask mail broadcast`).
+
+A broadcast is built to reach a million users without holding them in memory
+or tying up the database:
+
+* Recipients are read in pages of `chunk_size` users, ordered by id. Each page
+  is a new query starting after the last user's id, so no cursor (or
+  transaction) is held open for the hours a large broadcast takes. Only
+  verified primary emails are mailed.
+* Each page is rendered with `MailTemplate.render_many` (see
+  `app.mail_templates`).
+* Messages are sent one at a time over pooled connections (see `app.smtp`),
+  paced to the provider's rate (MAIL_BROADCAST_RATE, such as `'10/second'`).
+* The id of the last user mailed is written to a checkpoint file after every
+  message. Running the same broadcast again with the same checkpoint resumes
+  after that user, so a crash sends at most one message twice (one that was
+  accepted by the server just before the crash).
+"""
+
+from collections import namedtuple
+import json
+import smtplib
+from os import path, remove, replace
+from time import sleep, time
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_
+
+from app.mail import send_message
+from app.models import Email, session, User
+from app.ratelimit import gcra, Limit
+
+
+class BroadcastStats(namedtuple('BroadcastStats', 'sent failed '
+                                                  'resumed_after')):
+    """The counts of messages handled by a broadcast."""
+
+
+def recipients(after_id=0, chunk_size=1000):
+    """Yields pages of (id, first_name, last_name, primary_email) rows for the
+    active users after `after_id` whose primary email is verified."""
+    primary_email = User.primary_email
+    while True:
+        rows = session.query(User.id, User.first_name, User.last_name,
+                             primary_email) \
+            .join(Email, and_(Email.user_id == User.id,
+                              Email.email == primary_email)) \
+            .filter(User.active == True, Email.verified == True,
+                    User.id > after_id) \
+            .order_by(User.id) \
+            .limit(chunk_size) \
+            .all()
+        # End the read transaction between pages.
+        session.commit()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
+
+
+class Pacer(object):
+    """Waits between calls to keep to a rate (such as `'10/second'`)."""
+
+    def __init__(self, rate):
+        self.limit = Limit.parse(rate)
+        self.tat = None
+
+    def wait(self):
+        while True:
+            tat, retry_after = gcra(self.tat, time(), self.limit)
+            if tat is not None:
+                self.tat = tat
+                return
+            sleep(retry_after)
+
+
+def broadcast(template, subject, rate=None, checkpoint=None, chunk_size=1000,
+              **shared):
+    """Renders `template` (a `MailTemplate`) for every active user, with
+    `user` in the context along with the `shared` context, and sends it.
+    Returns the BroadcastStats."""
+    config = current_app.config
+    pacer = Pacer(rate or config['MAIL_BROADCAST_RATE'])
+    resumed_after = last_id = read_checkpoint(checkpoint)
+    sent = failed = 0
+    for page in recipients(last_id, chunk_size):
+        bodies = template.render_many(({'user': row} for row in page),
+                                      **shared)
+        for row, (text_body, html_body) in zip(page, bodies):
+            if row.primary_email:
+                pacer.wait()
+                try:
+                    send_message(Message(subject,
+                                         sender=config['SERVER_EMAIL'],
+                                         recipients=[row.primary_email],
+                                         body=text_body, html=html_body))
+                    sent += 1
+                except (smtplib.SMTPRecipientsRefused,
+                        smtplib.SMTPDataError) as error:
+                    current_app.logger.warning('Broadcast to user %d failed: '
+                                               '%r', row.id, error)
+                    failed += 1
+            write_checkpoint(checkpoint, row.id)
+    if checkpoint and path.exists(checkpoint):
+        remove(checkpoint)
+    return BroadcastStats(sent, failed, resumed_after)
+
+
+def read_checkpoint(checkpoint):
+    """Returns the id of the last user a previous run mailed."""
+    if not checkpoint or not path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as checkpoint_file:
+        return json.load(checkpoint_file)['last_user_id']
+
+
+def write_checkpoint(checkpoint, last_user_id):
+    """Atomically records the id of the last user mailed."""
+    if not checkpoint:
+        return
+    with open(checkpoint + '.tmp', 'w') as checkpoint_file:
+        json.dump({'last_user_id': last_user_id}, checkpoint_file)
+    replace(checkpoint + '.tmp', checkpoint)
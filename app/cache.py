@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.cache
+~~~~~~~~~
+
+The in-process cache utilities for spa-base.
+
+These caches live in a single worker process. They are not shared between
+gunicorn workers, so anything cached here should either be safe to be slightly
+stale or be given a short time to live.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache(object):
+    """A bounded, thread safe, least-recently-used cache.
+
+    When `ttl` is set, entries older than `ttl` seconds are treated as missing.
+    A `maxsize` of 0 disables the cache entirely (every lookup is a miss and
+    nothing is stored). Hits and misses are counted so the cache's usefulness
+    can be inspected at runtime."""
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        """Returns the cached value for `key` (or `default` if it is missing or
+        expired) and marks it as recently used."""
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += count
+                return default
+            if expires is not None and expires <= monotonic():
+                del self._data[key]
+                self.misses += count
+                return default
+            self._data.move_to_end(key)
+            self.hits += count
+            return value
+
+    def set(self, key, value):
+        """Stores `value` under `key`, evicting the least recently used entry
+        if the cache is full."""
+        if self.maxsize <= 0:
+            return
+        expires = monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes `key` from the cache and returns its value."""
+        with self._lock:
+            value = self._data.pop(key, None)
+        return value[0] if value else default
+
+    def clear(self):
+        """Empties the cache and resets its counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """Resizes the cache and/or changes its time to live."""
+        if ttl is not None:
+            self.ttl = ttl
+        if maxsize is not None:
+            self.maxsize = maxsize
+            with self._lock:
+                while len(self._data) > max(self.maxsize, 0):
+                    self._data.popitem(last=False)
+
+    @property
+    def stats(self):
+        """Returns a dict of the cache's counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
@@ -11,9 +11,24 @@ import click
 import secrets
 import os
 
+from app.assets import build_service_worker, update_manifest
+from app.blueprints.auth.mail import send_unverified_email_reminders
+from app.broadcast import broadcast
+from app.mail_templates import MailTemplate
+from app.models import bulk, db, OutboxMessage, UsedToken
+from app.outbox import run_worker
+from app.password_policy import calibrate, METHODS, time_hash
+from app.sessions import ServerSideSessionInterface
+
 
 def init_app(app):
 
+    def fingerprint(*patterns):
+        """Fingerprints the built assets and regenerates the service worker."""
+        assets = update_manifest(app.static_folder,
+                                 app.config['ASSETS_MANIFEST'], patterns)
+        build_service_worker(app.static_folder, assets)
+
     @app.cli.group()
     def build():
         """Runs the build commands for the app."""
@@ -26,6 +41,7 @@ def init_app(app):
             raise RuntimeError('"sassc" command failed.')
         if os.system('sassc -I ./node_modules/bulma assets/sass/auth.scss htdocs/css/auth.css'):
             raise RuntimeError('"sassc" command failed.')
+        fingerprint('css/*.css')
 
     @build.command()
     def icons():
@@ -34,12 +50,21 @@ def init_app(app):
             raise RuntimeError('"svgo" command failed.')
         if os.system('cp assets/icons/*.png htdocs/icons/ && ./node_modules/.bin/pngo htdocs/icons/*.png'):
             raise RuntimeError('"svgo" command failed.')
+        fingerprint('icons/*.svg', 'icons/*.png')
 
     @build.command()
     def js():
         """Compiles javascript files."""
         if os.system('./node_modules/.bin/browserify assets/js/app.js -o ./htdocs/js/app.js'):
             raise RuntimeError('"browserify" command failed.')
+        if os.system('cp assets/js/show-password.js htdocs/js/'):
+            raise RuntimeError('"cp" command failed.')
+        fingerprint('js/*.js')
+
+    @build.command('service-worker')
+    def service_worker():
+        """Generates the service worker from the asset manifest."""
+        fingerprint()
 
     @build.command()
     def generate_key():
@@ -66,6 +91,159 @@ def init_app(app):
             env_file.writelines(lines)
 
 
+    @app.cli.group()
+    def users():
+        """Bulk imports and exports users."""
+        pass
+
+    @users.command('import')
+    @click.argument('source', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(bulk.FORMATS),
+                  default=None, help='Defaults to the file extension.')
+    @click.option('--chunk-size', default=1000,
+                  help='Users inserted and committed per chunk.')
+    @click.option('--checkpoint', default=None,
+                  help='Checkpoint file (defaults to SOURCE.checkpoint).')
+    def import_users(source, file_format, chunk_size, checkpoint):
+        """Imports users from a CSV or NDJSON file."""
+        file_format = file_format or bulk.guess_format(source)
+        checkpoint = checkpoint or source + '.checkpoint'
+        with open(source, newline='') as source_file:
+            stats = bulk.import_users(bulk.read_records(source_file, file_format),
+                                      chunk_size=chunk_size,
+                                      checkpoint=checkpoint)
+        if stats.resumed_from:
+            click.echo('Resumed after {} records.'.format(stats.resumed_from))
+        click.echo('Imported {} users ({} duplicates skipped, {} invalid '
+                   'records skipped).'.format(stats.imported, stats.duplicates,
+                                              stats.invalid))
+
+    @users.command('export')
+    @click.argument('destination', type=click.File('w'))
+    @click.option('--format', 'file_format', type=click.Choice(bulk.FORMATS),
+                  default=None, help='Defaults to the file extension.')
+    @click.option('--chunk-size', default=1000,
+                  help='Rows fetched from the database at a time.')
+    def export_users(destination, file_format, chunk_size):
+        """Exports users to a CSV or NDJSON file (- for stdout)."""
+        file_format = file_format or bulk.guess_format(destination.name)
+        bulk.write_records(destination, bulk.export_users(chunk_size),
+                           file_format)
+
+
+    @app.cli.group()
+    def auth():
+        """Manages authentication settings."""
+        pass
+
+    @auth.command('calibrate')
+    @click.option('--method', type=click.Choice(METHODS),
+                  default=lambda: app.config['PASSWORD_HASH_METHOD'])
+    @click.option('--target-ms', default=250,
+                  help='Target time to hash a password, in milliseconds.')
+    @click.option('--max-cost', default=None, type=int,
+                  help='Upper limit for the cost (scrypt uses 128 * N * 8 '
+                       'bytes of memory).')
+    def calibrate_hashing(method, target_ms, max_cost):
+        """Picks the password hash cost for a target hash time."""
+        policy = calibrate(method, target_ms / 1000, max_cost)
+        click.echo('{} takes {:.0f}ms on this host. Set:\n'.format(
+            policy.method_string, time_hash(policy) * 1000))
+        click.echo('PASSWORD_HASH_METHOD={}'.format(policy.method))
+        click.echo('PASSWORD_HASH_COST={}'.format(policy.cost))
+        click.echo('\nExisting passwords are rehashed as their users log in.')
+
+    @auth.command('prune-tokens')
+    def prune_tokens():
+        """Deletes used single-use tokens that have expired."""
+        count = UsedToken.prune()
+        db.session.commit()
+        click.echo('Deleted {} expired tokens.'.format(count))
+
+
+    @app.cli.group()
+    def sessions():
+        """Manages the server-side session store."""
+        pass
+
+    @sessions.command('expire')
+    def expire_sessions():
+        """Deletes every expired session."""
+        if not isinstance(app.session_interface, ServerSideSessionInterface):
+            raise click.ClickException('SESSION_STORE is not set.')
+        count = app.session_interface.store.expire()
+        click.echo('Deleted {} expired sessions.'.format(count))
+
+
+    @app.cli.group()
+    def mail():
+        """Sends mail to the app's users."""
+        pass
+
+    @mail.command('broadcast')
+    @click.argument('template')
+    @click.option('--subject', required=True)
+    @click.option('--rate', default=None,
+                  help='Provider rate, such as 10/second (defaults to '
+                       'MAIL_BROADCAST_RATE).')
+    @click.option('--checkpoint', default=None,
+                  help='Checkpoint file (defaults to TEMPLATE.checkpoint).')
+    @click.option('--chunk-size', default=1000,
+                  help='Users fetched from the database at a time.')
+    def broadcast_mail(template, subject, rate, checkpoint, chunk_size):
+        """Mails every active user TEMPLATE (such as mail/privacy_policy,
+        rendered from its .txt and .html templates)."""
+        checkpoint = checkpoint or template.replace('/', '_') + '.checkpoint'
+        # Mail links to the app, so build urls as if serving a request.
+        with app.test_request_context(base_url=app.config['MAIL_BASE_URL']):
+            stats = broadcast(MailTemplate(template), subject, rate=rate,
+                              checkpoint=checkpoint, chunk_size=chunk_size)
+        if stats.resumed_after:
+            click.echo('Resumed after user {}.'.format(stats.resumed_after))
+        click.echo('Sent {} messages ({} failed).'.format(stats.sent,
+                                                          stats.failed))
+
+    @mail.command('verification-reminders')
+    @click.option('--chunk-size', default=1000,
+                  help='Users mailed and committed per chunk.')
+    def verification_reminders(chunk_size):
+        """Mails every active user whose primary email isn't verified a new
+        link to verify it."""
+        with app.test_request_context(base_url=app.config['MAIL_BASE_URL']):
+            count = send_unverified_email_reminders(chunk_size)
+        click.echo('Queued {} reminders.'.format(count))
+
+
+    @app.cli.group()
+    def outbox():
+        """Delivers the mail and events in the outbox."""
+        pass
+
+    @outbox.command('worker')
+    @click.option('--once', is_flag=True,
+                  help='Stop once the outbox is empty.')
+    @click.option('--poll-interval', default=None, type=float,
+                  help='Seconds to wait when the outbox is empty.')
+    def outbox_worker(once, poll_interval):
+        """Delivers messages from the outbox."""
+        run_worker(poll_interval, once=once)
+
+    @outbox.command('dead')
+    def dead_letters():
+        """Lists the messages that could not be delivered."""
+        for message in OutboxMessage.dead_letters().order_by(OutboxMessage.id):
+            click.echo('{} {} ({} attempts): {}'.format(
+                message.id, message.kind, message.attempts, message.last_error))
+
+    @outbox.command('retry')
+    @click.argument('ids', nargs=-1, type=int)
+    def retry_dead_letters(ids):
+        """Puts dead letters (all of them, or IDS) back in the outbox."""
+        count = OutboxMessage.retry_dead_letters(ids)
+        db.session.commit()
+        click.echo('Requeued {} messages.'.format(count))
+
+
     @app.cli.command()
     @click.option('--mysql/--no-mysql', '-m', default=False)
     @click.option('--use-migrations/--no-use-migrations', '-u', default=False)
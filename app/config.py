@@ -9,6 +9,7 @@ The app config for spa-base.
 
 from dotenv import load_dotenv
 from os import environ, path
+from tempfile import gettempdir
 
 
 basedir = path.abspath(path.dirname(__file__))
@@ -19,6 +20,10 @@ def _is_true(env_var):
     return env_var.lower() in [1, 'true', 'yes']
 
 
+def _int_or_none(env_var):
+    return int(env_var) if env_var else None
+
+
 class Config(object):
     """The default config object."""
     FLASK_ENV                = environ.get('FLASK_ENV', 'production')
@@ -33,6 +38,9 @@ class Config(object):
     SESSION_COOKIE_SAMESITE  = environ.get('SESSION_COOKIE_SAMESITE', None)
     SESSION_COOKIE_SECURE    = _is_true(environ.get('SESSION_COOKIE_SECURE', 'false'))
     SESSION_REFRESH_EACH_REQUEST = environ.get('SESSION_REFRESH_EACH_REQUEST', None)
+    SESSION_STORE            = environ.get('SESSION_STORE', None)
+    SESSION_STORE_PATH       = environ.get('SESSION_STORE_PATH',
+        path.join(gettempdir(), 'spa_base_sessions.db'))
 
     REMEMBER_COOKIE_NAME     = environ.get('REMEMBER_COOKIE_NAME', 'remember_me')
     REMEMBER_COOKIE_DURATION = environ.get('REMEMBER_COOKIE_DURATION', 5184000)
@@ -46,12 +54,66 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI  = environ.get('DATABASE_URI',
         'sqlite:///' + path.join(basedir + '/../', 'app.db'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_POOL_SIZE     = _int_or_none(environ.get('DATABASE_POOL_SIZE'))
+    SQLALCHEMY_MAX_OVERFLOW  = _int_or_none(environ.get('DATABASE_MAX_OVERFLOW'))
+    SQLALCHEMY_POOL_TIMEOUT  = _int_or_none(environ.get('DATABASE_POOL_TIMEOUT'))
+    SQLALCHEMY_POOL_RECYCLE  = _int_or_none(environ.get('DATABASE_POOL_RECYCLE'))
+    SQLALCHEMY_POOL_PRE_PING = _is_true(environ.get('DATABASE_POOL_PRE_PING', 'true'))
+    DATABASE_MAX_CONNECTIONS = _int_or_none(environ.get('DATABASE_MAX_CONNECTIONS'))
+    SQLALCHEMY_REPLICA_URIS  = [uri for uri in environ.get('DATABASE_REPLICA_URIS',
+                                                           '').split(',') if uri]
+    SQLALCHEMY_REPLICA_STICKY_SECONDS = int(environ.get(
+        'DATABASE_REPLICA_STICKY_SECONDS', 5))
+    SQLALCHEMY_QUERY_HEADERS = _is_true(environ.get('DATABASE_QUERY_HEADERS', 'false'))
+    SQLALCHEMY_QUERY_WARN_COUNT = int(environ.get('DATABASE_QUERY_WARN_COUNT', 25))
+    SQLALCHEMY_QUERY_WARN_TIME = float(environ.get('DATABASE_QUERY_WARN_TIME', 0.5))
+    SQLALCHEMY_QUERY_REPEAT_LIMIT = int(environ.get('DATABASE_QUERY_REPEAT_LIMIT', 3))
+
+    WEB_CONCURRENCY          = int(environ.get('WEB_CONCURRENCY', 4))
+    WEB_THREADS              = int(environ.get('WEB_THREADS', 1))
+
+    USER_CACHE_SIZE          = int(environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL           = int(environ.get('USER_CACHE_TTL', 60))
+
+    PASSWORD_HASH_WORKERS    = int(environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE      = int(environ.get('PASSWORD_HASH_QUEUE', 32))
+    PASSWORD_HASH_TIMEOUT    = float(environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    PASSWORD_HASH_METHOD     = environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_COST       = int(environ.get('PASSWORD_HASH_COST', 150000))
+
+    TOKEN_KEYS               = [key for key in environ.get('TOKEN_KEYS',
+                                                           '').split(',') if key]
+    TOKEN_CACHE_SIZE         = int(environ.get('TOKEN_CACHE_SIZE', 1024))
+    TOKEN_CACHE_TTL          = int(environ.get('TOKEN_CACHE_TTL', 300))
+
+    RATELIMIT_ENABLED        = _is_true(environ.get('RATELIMIT_ENABLED', 'true'))
+    RATELIMIT_STORAGE_PATH   = environ.get('RATELIMIT_STORAGE_PATH',
+        path.join(gettempdir(), 'spa_base_ratelimit.db'))
+    RATELIMIT_AUTH_PER_IP    = environ.get('RATELIMIT_AUTH_PER_IP', '30/minute')
+    RATELIMIT_AUTH_PER_ACCOUNT = environ.get('RATELIMIT_AUTH_PER_ACCOUNT', '5/minute')
+    RATELIMIT_MAIL_PER_IP    = environ.get('RATELIMIT_MAIL_PER_IP', '10/hour')
+    RATELIMIT_MAIL_PER_ACCOUNT = environ.get('RATELIMIT_MAIL_PER_ACCOUNT', '3/hour')
 
     MAIL_USERNAME            = environ.get('MAIL_USERNAME', None)
     MAIL_PASSWORD            = environ.get('MAIL_PASSWORD', None)
     MAIL_SERVER              = environ.get('MAIL_SERVER', None)
     MAIL_PORT                = int(environ.get('MAIL_PORT', 443))
     MAIL_USE_TLS             = _is_true(environ.get('MAIL_USE_TLS', 'True'))
+    MAIL_WORKERS             = int(environ.get('MAIL_WORKERS', 2))
+    MAIL_QUEUE_SIZE          = int(environ.get('MAIL_QUEUE_SIZE', 100))
+    MAIL_QUEUE_POLICY        = environ.get('MAIL_QUEUE_POLICY', 'block')
+    MAIL_QUEUE_TIMEOUT       = float(environ.get('MAIL_QUEUE_TIMEOUT', 5))
+    MAIL_SHUTDOWN_TIMEOUT    = float(environ.get('MAIL_SHUTDOWN_TIMEOUT', 10))
+    MAIL_POOL_SIZE           = int(environ.get('MAIL_POOL_SIZE', 2))
+    MAIL_POOL_IDLE_TIMEOUT   = float(environ.get('MAIL_POOL_IDLE_TIMEOUT', 30))
+    MAIL_BROADCAST_RATE      = environ.get('MAIL_BROADCAST_RATE', '10/second')
+    MAIL_BASE_URL            = environ.get('MAIL_BASE_URL', 'http://localhost:8000')
+    OUTBOX_BATCH_SIZE        = int(environ.get('OUTBOX_BATCH_SIZE', 100))
+    OUTBOX_LEASE             = int(environ.get('OUTBOX_LEASE', 300))
+    OUTBOX_MAX_ATTEMPTS      = int(environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_BACKOFF           = int(environ.get('OUTBOX_BACKOFF', 30))
+    OUTBOX_MAX_BACKOFF       = int(environ.get('OUTBOX_MAX_BACKOFF', 3600))
+    OUTBOX_POLL_INTERVAL     = float(environ.get('OUTBOX_POLL_INTERVAL', 1))
     ADMIN_EMAILS             = environ.get('ADMIN_EMAILS', '').split(',')
     SERVER_EMAIL             = environ.get('SERVER_EMAIL', None)
 
@@ -62,8 +124,33 @@ class Config(object):
     RECAPTCHA_PUBLIC_KEY     = environ.get('RECAPTCHA_PUBLIC_KEY', None)
     RECAPTCHA_PRIVATE_KEY    = environ.get('RECAPTCHA_PRIVATE_KEY', None)
 
+    ASSETS_MANIFEST          = environ.get('ASSETS_MANIFEST', 'assets.json')
+
+    STATIC_FILES             = _is_true(environ.get('STATIC_FILES', 'True'))
+    STATIC_MAX_AGE           = int(environ.get('STATIC_MAX_AGE', 3600))
+    STATIC_MEMORY_LIMIT      = int(environ.get('STATIC_MEMORY_LIMIT', 64 * 1024))
+
+    COMPRESS_RESPONSES       = _is_true(environ.get('COMPRESS_RESPONSES', 'True'))
+    COMPRESS_MIN_SIZE        = int(environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_LEVEL           = int(environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY  = int(environ.get('COMPRESS_BROTLI_QUALITY', 4))
+    COMPRESS_MIMETYPES       = environ.get('COMPRESS_MIMETYPES',
+                                           'text/html,text/css,text/plain,'
+                                           'text/javascript,application/javascript,'
+                                           'application/json,image/svg+xml').split(',')
+
     LOG_LEVEL                = environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT               = environ.get('LOG_FORMAT', 'text')
+    LOG_FILE                 = environ.get('LOG_FILE', 'logs/flask.log')
+    LOG_MAX_BYTES            = int(environ.get('LOG_MAX_BYTES', 100 * 1024 * 1024))
+    LOG_BACKUP_COUNT         = int(environ.get('LOG_BACKUP_COUNT', 10))
+    LOG_BUFFER_SIZE          = int(environ.get('LOG_BUFFER_SIZE', 64 * 1024))
+    LOG_FLUSH_INTERVAL       = float(environ.get('LOG_FLUSH_INTERVAL', 1))
+    LOG_ACCESS_SAMPLE_RATE   = float(environ.get('LOG_ACCESS_SAMPLE_RATE', 1))
     MAIL_LOG_LEVEL           = environ.get('MAIL_LOG_LEVEL', 'ERROR')
+    MAIL_LOG_WINDOW          = int(environ.get('MAIL_LOG_WINDOW', 300))
+    MAIL_LOG_RATE            = environ.get('MAIL_LOG_RATE', '10/hour')
+    MAIL_LOG_QUEUE_SIZE      = int(environ.get('MAIL_LOG_QUEUE_SIZE', 1000))
 
 
 class DebugConfig(Config):
@@ -80,4 +167,10 @@ class TestingConfig(Config):
 
     DEBUG_TB_INTERCEPT_REDIRECTS = False
 
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_COST = 1000
+
+    RATELIMIT_ENABLED = False
+    RATELIMIT_STORAGE_PATH = None
+
     PRESERVE_CONTEXT_ON_EXCEPTION = False
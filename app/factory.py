@@ -11,15 +11,24 @@ from flask import Flask
 from werkzeug.utils import find_modules, import_string
 
 from app import (
+    assets,
     debug,
     logger,
     mail,
     models,
+    passwords,
+    ratelimit,
     routes,
+    sessions,
     templates,
+    tokens,
 )
 from .config import Config as DefaultConfig, DebugConfig
-from .middleware import HTTPMethodOverrideMiddleware
+from .middleware import (
+    CompressionMiddleware,
+    HTTPMethodOverrideMiddleware,
+    StaticFilesMiddleware,
+)
 
 
 def create_app(Config = None):
@@ -31,8 +40,13 @@ def create_app(Config = None):
     app.config.from_object(Config)
     register_blueprints(app)
     models.init_app(app)
+    passwords.init_app(app)
+    ratelimit.init_app(app)
+    tokens.init_app(app)
+    sessions.init_app(app)
     routes.init_app(app)
     templates.init_app(app)
+    assets.init_app(app)
     mail.init_app(app)
 
     if not app.testing:
@@ -41,6 +55,21 @@ def create_app(Config = None):
     if app.debug:
         debug.init_app(app)
 
+    if app.config['COMPRESS_RESPONSES']:
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app,
+            min_size=app.config['COMPRESS_MIN_SIZE'],
+            level=app.config['COMPRESS_LEVEL'],
+            brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+            mimetypes=app.config['COMPRESS_MIMETYPES'])
+
+    if app.config['STATIC_FILES']:
+        app.wsgi_app = StaticFilesMiddleware(
+            app.wsgi_app, app.static_folder,
+            max_age=app.config['STATIC_MAX_AGE'],
+            memory_limit=app.config['STATIC_MEMORY_LIMIT'],
+            refresh=app.debug)
+
     return app
 
 
@@ -5,45 +5,473 @@ app.logger
 ~~~~~~~~~~
 
 The logger module for spa-base.
+
+Errors are mailed to ADMIN_EMAILS without holding up the request that logged
+them: the record is put on a bounded queue (MAIL_LOG_QUEUE_SIZE) and mailed by
+a background thread. If the queue is full, the record is dropped rather than
+blocking. The thread is started by the first error a process logs, so each
+gunicorn worker has its own (a thread started before a fork, such as with
+`preload_app`, doesn't run in the workers).
+
+During an incident the same error tends to be logged by every request, so
+errors are fingerprinted (by where they were logged and, for exceptions, their
+type and where they were raised). The first occurrence of an error is mailed
+right away; later occurrences within MAIL_LOG_WINDOW seconds are only counted
+and reported in a single digest mail at the end of the window. No more than
+MAIL_LOG_RATE mails (such as `'10/hour'`) are sent; errors that can't be mailed
+yet are held for the next digest.
+
+The log file (LOG_FILE) is written by every gunicorn worker, so it is opened
+for appending and each buffer of records (up to LOG_BUFFER_SIZE bytes, or
+LOG_FLUSH_INTERVAL seconds, or an error) is written with a single write.
+Rotation (at LOG_MAX_BYTES) is done by whichever worker notices the file is
+full, under a file lock; the others notice the file has been replaced and
+reopen it. Rotated files are gzipped in the background and the newest
+LOG_BACKUP_COUNT are kept.
+
+With LOG_FORMAT set to `json`, each record is a line of JSON with the request
+it was logged in (request id, user id, endpoint and so on), and every request
+is logged as an access record with its status and latency. A fraction
+(LOG_ACCESS_SAMPLE_RATE) of the successful requests' access records can be
+kept to cut the volume; errors are always logged.
 """
 
+import atexit
+from collections import OrderedDict
+from datetime import datetime
+import fcntl
+from glob import glob
+import gzip
+from hashlib import sha1
+import json
 import logging
-from logging.handlers import RotatingFileHandler, SMTPHandler
+from logging.handlers import QueueHandler, QueueListener
+import os
 from os import mkdir, path
+from queue import Empty, Full, Queue
+from random import random
+from secrets import token_hex
+import shutil
+from threading import Event, Lock, Thread
+import traceback
+from time import perf_counter, time
+
+from flask import _request_ctx_stack, g, has_request_context, request
+from flask_mail import Message
+
+from app.mail import send_message
+from app.ratelimit import gcra, Limit
+
+
+def fingerprint(record):
+    """Returns a key that is the same for every occurrence of an error, no
+    matter the arguments it was logged with."""
+    parts = [record.name, record.levelname, record.pathname,
+             str(record.lineno), str(record.msg)]
+    if record.exc_info and record.exc_info[0]:
+        exc_type, _, tb = record.exc_info
+        parts.append(exc_type.__name__)
+        frames = traceback.extract_tb(tb)
+        if frames:
+            parts.append('{}:{}'.format(frames[-1].filename,
+                                        frames[-1].lineno))
+    return sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class FingerprintQueueHandler(QueueHandler):
+    """Queues records (fingerprinted, since formatting them loses their
+    message template) without ever blocking. The `listener` (if any) is
+    started in each process that queues a record."""
+
+    def __init__(self, queue, listener=None):
+        super().__init__(queue)
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.fingerprint = fingerprint(record)
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        if self.listener is not None:
+            self.listener.start()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class DigestQueueListener(QueueListener):
+    """A listener that flushes its handlers whenever the queue has been idle
+    for `flush_interval` seconds, so digests go out even when no more errors
+    are logged."""
+
+    def __init__(self, queue, *handlers, flush_interval=10):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+        self._pid = None
+        self._start_lock = Lock()
+        self._stopping = False
+
+    def start(self):
+        """Starts the listener's thread, unless it is already running in
+        this process."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._stopping = False
+                super().start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            super().stop()
+        self._pid = None
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except Empty:
+                for handler in self.handlers:
+                    handler.flush()
+                if self._stopping:
+                    return self._sentinel
+
+    def enqueue_sentinel(self):
+        try:
+            self.queue.put(self._sentinel, timeout=self.flush_interval)
+        except Full:
+            # Stop once the queue has been drained instead.
+            self._stopping = True
+
+
+class _Error(object):
+    """An error seen within the current window."""
+
+    def __init__(self, record, now):
+        self.record = record
+        self.since = now
+        self.unreported = 1
+
+
+class DigestMailHandler(logging.Handler):
+    """Mails the first occurrence of each error and a digest of how often
+    errors recurred, at no more than `rate` mails.
+
+    `send(subject, body)` sends a mail."""
+
+    def __init__(self, send, subject, window=300, rate='10/hour'):
+        super().__init__()
+        self.send = send
+        self.subject = subject
+        self.window = window
+        self.limit = Limit.parse(rate)
+        self.errors = OrderedDict()
+        self._tat = None
+
+    def emit(self, record):
+        try:
+            key = getattr(record, 'fingerprint', None) or fingerprint(record)
+            if key in self.errors:
+                self.errors[key].unreported += 1
+                return
+            now = time()
+            error = self.errors[key] = _Error(record, now)
+            if self._allow(now):
+                self.send('{}: {}'.format(self.subject,
+                                          record.getMessage().splitlines()[0]),
+                          self.format(record))
+                error.unreported = 0
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, force=False):
+        """Mails a digest of the errors whose window has ended (all of them
+        if `force`)."""
+        self.acquire()
+        try:
+            now = time()
+            due = [(key, error) for key, error in self.errors.items()
+                   if force or now - error.since >= self.window]
+            reported = [error for _, error in due if error.unreported]
+            if reported and not self._allow(now):
+                return
+            for key, _ in due:
+                del self.errors[key]
+            if reported:
+                self.send('{}: {} errors'.format(
+                              self.subject,
+                              sum(error.unreported for error in reported)),
+                          self._digest(reported))
+        except Exception:
+            self.handleError(logging.makeLogRecord(
+                {'msg': 'Failed to mail an error digest.'}))
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush(force=True)
+        super().close()
+
+    def _allow(self, now):
+        tat, _ = gcra(self._tat, now, self.limit)
+        if tat is None:
+            return False
+        self._tat = tat
+        return True
+
+    def _digest(self, errors):
+        sections = []
+        for error in errors:
+            sections.append('{} more time(s) since {:.0f} seconds ago:\n\n{}'
+                            .format(error.unreported, time() - error.since,
+                                    self.format(error.record)))
+        return '\n\n{}\n\n'.format('-' * 72).join(sections)
+
+
+CONTEXT_FIELDS = ('request_id', 'user_id', 'method', 'path', 'endpoint',
+                  'remote_addr', 'status', 'latency_ms')
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the current request's details to records."""
+
+    def filter(self, record):
+        if has_request_context():
+            # The user Flask-Login has loaded, if any (without loading it).
+            user = getattr(_request_ctx_stack.top, 'user', None)
+            record.request_id = g.get('request_id')
+            record.user_id = user.get_id() if user is not None and \
+                user.is_authenticated else None
+            record.method = request.method
+            record.path = request.path
+            record.endpoint = request.endpoint
+            record.remote_addr = request.remote_addr
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single line of JSON."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.utcfromtimestamp(record.created)
+                            .isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def compress(filename):
+    """Gzips a rotated log file."""
+    with open(filename, 'rb') as source, \
+            gzip.open(filename + '.gz.tmp', 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    os.replace(filename + '.gz.tmp', filename + '.gz')
+    os.remove(filename)
+
+
+class SharedFileHandler(logging.Handler):
+    """A buffered, rotating log file handler that is safe to use from many
+    processes at once. Only the newest `backup_count` rotated files are kept
+    (or all of them, with a `backup_count` of 0)."""
+
+    def __init__(self, filename, max_bytes=100 * 1024 * 1024,
+                 backup_count=10, buffer_size=64 * 1024, flush_interval=1.0):
+        super().__init__()
+        self.filename = path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffered = 0
+        self._fd = None
+        self._pid = None
+        self._closed = Event()
+
+    def emit(self, record):
+        try:
+            line = (self.format(record) + '\n').encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+        self.acquire()
+        try:
+            self._start()
+            self._buffer.append(line)
+            self._buffered += len(line)
+            if self._buffered >= self.buffer_size or \
+                    record.levelno >= logging.ERROR:
+                self.flush()
+        finally:
+            self.release()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self._buffer or self._pid != os.getpid():
+                return
+            data = b''.join(self._buffer)
+            self._buffer, self._buffered = [], 0
+            self._reopen_if_rotated()
+            # One write per buffer, so records from different processes are
+            # never interleaved in an O_APPEND file.
+            while data:
+                data = data[os.write(self._fd, data):]
+            if os.fstat(self._fd).st_size >= self.max_bytes:
+                self._rotate()
+        except Exception:
+            self.handleError(logging.makeLogRecord(
+                {'msg': 'Failed to write to the log file.'}))
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        self._closed.set()
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+            self._fd = None
+        super().close()
+
+    def _start(self):
+        """Opens the file and starts the flush thread in this process."""
+        if self._pid == os.getpid():
+            return
+        # Records buffered before a fork are the parent's to write.
+        self._buffer, self._buffered = [], 0
+        self._pid = os.getpid()
+        self._open()
+        Thread(target=self._flush_periodically, daemon=True,
+               name='log-flush').start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.filename,
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _reopen_if_rotated(self):
+        try:
+            rotated = os.stat(self.filename).st_ino != \
+                os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self._open()
+
+    def _rotate(self):
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another process may have rotated it while we waited.
+                self._reopen_if_rotated()
+                if os.fstat(self._fd).st_size < self.max_bytes:
+                    return
+                rotated = '{}.{}-{}'.format(
+                    self.filename,
+                    datetime.utcnow().strftime('%Y%m%d%H%M%S%f'), os.getpid())
+                os.rename(self.filename, rotated)
+                self._open()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        Thread(target=self._compress_and_prune, args=(rotated,),
+               daemon=True, name='log-compress').start()
+
+    def _compress_and_prune(self, rotated):
+        try:
+            compress(rotated)
+            if self.backup_count:
+                backups = sorted(glob(self.filename + '.*.gz'))
+                for backup in backups[:-self.backup_count]:
+                    os.remove(backup)
+        except OSError:
+            self.handleError(logging.makeLogRecord(
+                {'msg': 'Failed to compress {}.'.format(rotated)}))
 
 
 def initialize_mail_on_error(app):
     if not app.config['MAIL_SERVER']:
         return # Can't do anything if MAIL_SERVER is not set
 
-    auth = None
-    if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-        auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-    secure = None
-    if app.config['MAIL_USE_TLS']:
-        secure = ()
-    mail_handler = SMTPHandler(
-        mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-        fromaddr=app.config['SERVER_EMAIL'],
-        toaddrs=app.config['ADMIN_EMAILS'], subject='SPA-base Failure',
-        credentials=auth, secure=secure)
+    def send(subject, body):
+        with app.app_context():
+            send_message(Message(subject, sender=app.config['SERVER_EMAIL'],
+                                 recipients=app.config['ADMIN_EMAILS'],
+                                 body=body))
+
+    mail_handler = DigestMailHandler(send, subject='SPA-base Failure',
+                                     window=app.config['MAIL_LOG_WINDOW'],
+                                     rate=app.config['MAIL_LOG_RATE'])
     mail_handler.setLevel(getattr(logging, app.config['MAIL_LOG_LEVEL']))
-    app.logger.addHandler(mail_handler)
+    queue = Queue(maxsize=app.config['MAIL_LOG_QUEUE_SIZE'])
+    listener = DigestQueueListener(queue, mail_handler)
+    queue_handler = FingerprintQueueHandler(queue, listener)
+    queue_handler.setLevel(mail_handler.level)
+    atexit.register(listener.stop)
+    app.logger.addHandler(queue_handler)
 
 
 def initialize_log_on_error(app):
-    if not path.exists('logs'):
-        mkdir('logs')
-    file_handler = RotatingFileHandler('logs/flask.log', maxBytes=10240,
-                                       backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+    log_dir = path.dirname(app.config['LOG_FILE'])
+    if log_dir and not path.exists(log_dir):
+        mkdir(log_dir)
+    file_handler = SharedFileHandler(
+        app.config['LOG_FILE'], max_bytes=app.config['LOG_MAX_BYTES'],
+        backup_count=app.config['LOG_BACKUP_COUNT'],
+        buffer_size=app.config['LOG_BUFFER_SIZE'],
+        flush_interval=app.config['LOG_FLUSH_INTERVAL'])
+    if app.config['LOG_FORMAT'] == 'json':
+        file_handler.setFormatter(JSONFormatter())
+        file_handler.addFilter(RequestContextFilter())
+        initialize_access_log(app)
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
     app.logger.setLevel(getattr(logging, app.config['LOG_LEVEL']))
     app.logger.info('Microblog startup')
 
 
+def initialize_access_log(app):
+    """Logs every request (or a sample of the successful ones) with its
+    latency, and tags it with a request id."""
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get('X-Request-ID') or token_hex(8)
+        g.request_start = perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers.setdefault('X-Request-ID', g.get('request_id', ''))
+        if response.status_code < 400 and \
+                random() >= app.config['LOG_ACCESS_SAMPLE_RATE']:
+            return response
+        latency = perf_counter() - g.get('request_start', perf_counter())
+        app.logger.info('%s %s %s', request.method, request.path,
+                        response.status_code,
+                        extra={'status': response.status_code,
+                               'latency_ms': round(latency * 1000, 2)})
+        return response
+
+
 def init_app(app):
     """Initializes error logging."""
     if app.debug:
@@ -5,15 +5,237 @@ app.mail
 ~~~~~~~~
 
 The mail module for spa-base.
+
+Mail is sent in the background by a fixed number of worker threads
+(MAIL_WORKERS) reading from a bounded queue (MAIL_QUEUE_SIZE). When the queue is
+full, MAIL_QUEUE_POLICY decides what happens to a new message:
+
+* `block` waits up to MAIL_QUEUE_TIMEOUT seconds for room, then sends the
+  message in the calling thread so it is never lost,
+* `drop` discards it (and counts it), and
+* `sync` sends it in the calling thread straight away.
+
+Queued mail is drained (for up to MAIL_SHUTDOWN_TIMEOUT seconds) when the
+process exits. SIGTERM only marks the dispatcher as stopping, so the signal
+handler returns straight away; the process then exits (and drains the queue)
+as it would have, and mail submitted in the meantime is sent in the calling
+thread. `dispatcher.statistics()` reports the queue depth and how long
+messages wait and take to send.
+
+Messages are sent over pooled SMTP connections (see `app.smtp`).
 """
 
-from threading import Thread
+import atexit
+import os
+from queue import Full, Queue
+import signal
+from threading import current_thread, Event, Lock, main_thread, Thread
+from time import perf_counter
 
 from flask import current_app
 from flask_mail import Mail, Message
 
+from .smtp import SMTPPool
+
 
 mail = Mail()
+smtp_pool = SMTPPool(mail)
+
+
+class MailDispatcher(object):
+    """Sends mail from a bounded queue with a fixed pool of threads."""
+
+    policies = ('block', 'drop', 'sync')
+
+    def __init__(self, workers=2, queue_size=100, policy='block', timeout=5.0,
+                 shutdown_timeout=10.0):
+        self._lock = Lock()
+        self._stats_lock = Lock()
+        self._threads = []
+        self._pid = None
+        self._exit_hooks_installed = False
+        self._stopping = Event()
+        self.configure(workers, queue_size, policy, timeout, shutdown_timeout)
+
+    def configure(self, workers, queue_size, policy, timeout,
+                  shutdown_timeout):
+        if policy not in self.policies:
+            raise ValueError('Unknown mail queue policy "{}".'.format(policy))
+        self.shutdown()
+        self.workers = workers
+        self.policy = policy
+        self.timeout = timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.queue = Queue(maxsize=queue_size)
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        with self._stats_lock:
+            self.sent = 0
+            self.failed = 0
+            self.dropped = 0
+            self.sent_sync = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.total_send_time = 0.0
+            self.max_send_time = 0.0
+
+    def submit(self, app, msg):
+        """Queues a message to be sent in the background. Returns False if
+        the message was dropped."""
+        if self._stopping.is_set() and self._pid == os.getpid():
+            self._count('sent_sync')
+            self.send(msg)
+            return True
+        self._start(app)
+        item = (msg, perf_counter())
+        try:
+            if self.policy == 'block':
+                self.queue.put(item, timeout=self.timeout)
+            else:
+                self.queue.put_nowait(item)
+            return True
+        except Full:
+            if self.policy == 'drop':
+                self._count('dropped')
+                app.logger.warning('Mail queue is full, dropped "%s".',
+                                   msg.subject)
+                return False
+        self._count('sent_sync')
+        self.send(msg)
+        return True
+
+    def send(self, msg, queued_at=None):
+        """Sends a message in the current thread (which needs an app
+        context)."""
+        start = perf_counter()
+        try:
+            send_message(msg)
+        except Exception:
+            self._count('failed')
+            raise
+        finally:
+            end = perf_counter()
+            wait = start - queued_at if queued_at is not None else 0.0
+            with self._stats_lock:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_send_time += end - start
+                self.max_send_time = max(self.max_send_time, end - start)
+        self._count('sent')
+
+    def statistics(self):
+        """Returns a dict of the queue's state and counters."""
+        with self._stats_lock:
+            finished = self.sent + self.failed
+            return {
+                'workers': len(self._threads),
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'sent': self.sent,
+                'sent_sync': self.sent_sync,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'average_wait': self.total_wait / finished
+                                if finished else 0.0,
+                'max_wait': self.max_wait,
+                'average_send_time': self.total_send_time / finished
+                                     if finished else 0.0,
+                'max_send_time': self.max_send_time,
+            }
+
+    def shutdown(self, timeout=None):
+        """Stops the workers once the queued mail has been sent, waiting up to
+        `timeout` seconds. Returns the number of messages left unsent."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return 0
+            threads, self._threads = self._threads, []
+            self._pid = None
+        deadline = perf_counter() + (self.shutdown_timeout
+                                     if timeout is None else timeout)
+        for _ in threads:
+            try:
+                self.queue.put((None, None),
+                               timeout=max(deadline - perf_counter(), 0))
+            except Full:
+                break
+        for thread in threads:
+            thread.join(max(deadline - perf_counter(), 0))
+        smtp_pool.close()
+        return sum(1 for msg, _ in list(self.queue.queue) if msg is not None)
+
+    def _start(self, app):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork; start this process's own. A
+            # dispatcher that was stopped (or forked while stopping) is
+            # running again once they are started.
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [Thread(target=self._work, args=(app,),
+                                    name='mail-{}'.format(n), daemon=True)
+                             for n in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._install_exit_hooks()
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _work(self, app):
+        with app.app_context():
+            while True:
+                msg, queued_at = self.queue.get()
+                if msg is None:
+                    return
+                try:
+                    self.send(msg, queued_at)
+                except Exception:
+                    app.logger.exception('Failed to send mail "%s".',
+                                         msg.subject)
+
+    def _install_exit_hooks(self):
+        if self._exit_hooks_installed:
+            return
+        self._exit_hooks_installed = True
+        atexit.register(self.shutdown)
+        if current_thread() is not main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def stop_on_sigterm(signum, frame):
+            # Draining could block for MAIL_SHUTDOWN_TIMEOUT seconds, so it is
+            # left to the atexit hook.
+            self._stopping.set()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+        signal.signal(signal.SIGTERM, stop_on_sigterm)
+
+
+dispatcher = MailDispatcher()
+
+
+def send_message(msg):
+    """Sends a message now, over a pooled connection if pooling is on."""
+    if smtp_pool.size:
+        smtp_pool.send(msg)
+    else:
+        mail.send(msg)
+
+
+def send_messages(msgs):
+    """Sends a batch of messages now, over a single connection."""
+    if smtp_pool.size:
+        smtp_pool.send_many(msgs)
+    else:
+        with mail.connect() as connection:
+            for msg in msgs:
+                connection.send(msg)
 
 
 def send_mail(subject, sender, recipients, text_body, html_body,
@@ -26,17 +248,18 @@ def send_mail(subject, sender, recipients, text_body, html_body,
             msg.attach(*attachment)
 
     if send_async and not send_mail.testing:
-        Thread(target=send_mail_async, args=(current_app._get_current_object(),
-                                             msg)).start()
+        dispatcher.submit(current_app._get_current_object(), msg)
     else:
-        mail.send(msg)
-
-
-def send_mail_async(app, msg):
-    with app.app_context():
-        mail.send(msg)
+        send_message(msg)
 
 
 def init_app(app):
     mail.init_app(app)
     send_mail.testing = app.testing
+    smtp_pool.configure(size=app.config['MAIL_POOL_SIZE'],
+                        idle_timeout=app.config['MAIL_POOL_IDLE_TIMEOUT'])
+    dispatcher.configure(workers=app.config['MAIL_WORKERS'],
+                         queue_size=app.config['MAIL_QUEUE_SIZE'],
+                         policy=app.config['MAIL_QUEUE_POLICY'],
+                         timeout=app.config['MAIL_QUEUE_TIMEOUT'],
+                         shutdown_timeout=app.config['MAIL_SHUTDOWN_TIMEOUT'])
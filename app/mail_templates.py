@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.mail_templates
+~~~~~~~~~~~~~~~~~~
+
+The mail rendering layer for spa-base.
+
+Every mail has a plain text and an html body, rendered from a pair of templates
+that share a name (`auth/email/password_reset.txt` and `.html`):
+
+    PASSWORD_RESET = MailTemplate('auth/email/password_reset')
+    text_body, html_body = PASSWORD_RESET.render(user=user, token=token)
+
+The compiled pair is looked up once per app and kept, rather than going
+through `render_template` (and the template loader) twice per mail, unless
+templates are auto reloaded (when debugging). A template made with
+`static=True` doesn't depend on its context, so its bodies are only rendered
+once per host: the configured SERVER_NAME, or else the last few hosts requests
+came in on (since the Host header comes from the client).
+
+`render_many` renders the pair for many recipients at once: the app's template
+context (from the context processors) and the `shared` context are built once,
+and each recipient's context is merged over them.
+
+    bodies = REMINDER.render_many([{'user': user, 'token': token}
+                                   for user, token in zip(users, tokens)],
+                                  deadline=deadline)
+"""
+
+from weakref import WeakKeyDictionary
+
+from flask import current_app, has_request_context, request
+
+from app.cache import LRUCache
+
+
+STATIC_HOSTS = 8
+
+
+class MailTemplate(object):
+    """A pair of text and html templates rendered together."""
+
+    def __init__(self, name, static=False):
+        self.name = name
+        self.static = static
+        self._compiled = WeakKeyDictionary()
+        self._bodies = WeakKeyDictionary()
+
+    @property
+    def templates(self):
+        """The compiled (text, html) templates for the current app."""
+        environment = current_app.jinja_env
+        templates = self._compiled.get(environment)
+        if templates is None or environment.auto_reload:
+            templates = (environment.get_template(self.name + '.txt'),
+                         environment.get_template(self.name + '.html'))
+            self._compiled[environment] = templates
+        return templates
+
+    def render(self, **context):
+        """Returns the (text, html) bodies for `context`."""
+        if self.static:
+            return self._render_static()
+        return next(self.render_many([context]))
+
+    def render_many(self, contexts, **shared):
+        """Yields the (text, html) bodies for each of `contexts`, merged over
+        the `shared` context."""
+        text, html = self.templates
+        current_app.update_template_context(shared)
+        for context in contexts:
+            context = dict(shared, **context)
+            yield text.render(context), html.render(context)
+
+    def _render_static(self):
+        # External urls depend on the host the app is served from.
+        config = current_app.config
+        if config['SERVER_NAME']:
+            host = (config['PREFERRED_URL_SCHEME'], config['SERVER_NAME'])
+        else:
+            host = request.host_url if has_request_context() else None
+        bodies = self._bodies.get(current_app.jinja_env)
+        if bodies is None:
+            bodies = self._bodies[current_app.jinja_env] = \
+                LRUCache(maxsize=STATIC_HOSTS)
+        rendered = bodies.get(host)
+        if rendered is None:
+            rendered = next(self.render_many([{}]))
+            bodies.set(host, rendered)
+        return rendered
@@ -7,6 +7,31 @@ app.middleware
 This module contains the flask middleware for the application.
 """
 
+from calendar import timegm
+from datetime import datetime
+import mimetypes
+import os
+from os import path
+import re
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import (
+    http_date,
+    is_resource_modified,
+    parse_accept_header,
+    parse_cache_control_header,
+    parse_if_range_header,
+    parse_options_header,
+    parse_range_header,
+)
+from werkzeug.wsgi import FileWrapper
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 class HTTPMethodOverrideMiddleware(object):
     """Many servers do not allow newer HTTP methods (such as PATCH, PUT, etc).
@@ -37,3 +62,367 @@ class HTTPMethodOverrideMiddleware(object):
         if method in self.bodyless_methods:
             environ['CONTENT_LENGTH'] = '0'
         return self.app(environ, start_response)
+
+
+class StaticFile(object):
+    """A file in the static file index, with its precompressed variants."""
+
+    def __init__(self, filename, memory_limit):
+        stat = os.stat(filename)
+        self.filename = filename
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.modified = datetime.utcfromtimestamp(self.mtime)
+        self.etag = '{:x}-{:x}'.format(self.size, self.mtime)
+        self.last_modified = http_date(self.mtime)
+        content_type = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        if content_type.startswith('text/') or \
+                content_type in ('application/javascript', 'image/svg+xml'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.data = None
+        if self.size <= memory_limit:
+            with open(filename, 'rb') as static_file:
+                self.data = static_file.read()
+        self.variants = {}
+
+    def is_stale(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return True
+        return stat.st_size != self.size or int(stat.st_mtime) != self.mtime
+
+
+class StaticFilesMiddleware(object):
+    """Serves the files in `root` (htdocs) from the root of the site.
+
+    The directory is indexed once, when the app is created, so a request for
+    anything else costs a single dict lookup. Files up to `memory_limit` bytes
+    are kept in memory; larger ones are streamed from disk (with the server's
+    `wsgi.file_wrapper`, so sendfile can be used).
+
+    Responses have an ETag and Last-Modified (and are answered with a 304 when
+    they match), support byte range requests, and are served from a `.br` or
+    `.gz` file next to the original when there is one and the client accepts
+    it. Files whose name carries a content hash (`app.3f2a9c1b.css`) are
+    cached for a year, everything else for `max_age` seconds.
+
+    With `refresh` (when debugging), files are checked for changes on every
+    request and new files are picked up.
+    """
+    encodings = (('br', '.br'), ('gzip', '.gz'))
+    fingerprinted = re.compile(r'\.[0-9a-f]{8,}\.\w+$')
+    immutable_max_age = 31536000
+    chunk_size = 64 * 1024
+
+    def __init__(self, app, root, max_age=3600, memory_limit=64 * 1024,
+                 refresh=False):
+        self.app = app
+        self.root = path.abspath(root)
+        self.max_age = max_age
+        self.memory_limit = memory_limit
+        self.refresh = refresh
+        self.files = {}
+        self.index()
+
+    def index(self):
+        """Indexes every (non hidden) file under the root."""
+        files = {}
+        for directory, dirnames, filenames in os.walk(self.root,
+                                                      followlinks=True):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            for name in filenames:
+                if not name.startswith('.'):
+                    filename = path.join(directory, name)
+                    files[self._url(filename)] = StaticFile(filename,
+                                                            self.memory_limit)
+        for url, static_file in files.items():
+            for encoding, suffix in self.encodings:
+                variant = files.get(url + suffix)
+                if variant is not None:
+                    static_file.variants[encoding] = variant
+        self.files = files
+
+    def __call__(self, environ, start_response):
+        static_file = self.files.get(environ.get('PATH_INFO', ''))
+        if self.refresh:
+            static_file = self._refresh(environ.get('PATH_INFO', ''),
+                                        static_file)
+        if static_file is None or \
+                environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        try:
+            return self.serve(environ, start_response, static_file)
+        except OSError:
+            # The file was removed (or replaced) since it was indexed.
+            if self.refresh:
+                self.index()
+            return self.app(environ, start_response)
+
+    def serve(self, environ, start_response, static_file):
+        headers = [('Cache-Control', self._cache_control(static_file)),
+                   ('Accept-Ranges', 'bytes')]
+        if static_file.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        content_type = static_file.content_type
+        byte_range = None
+        if 'HTTP_RANGE' in environ:
+            byte_range = self._byte_range(environ, static_file)
+            if byte_range is False:
+                start_response('416 Requested Range Not Satisfiable',
+                               headers + [('Content-Range', 'bytes */{}'
+                                           .format(static_file.size))])
+                return []
+        else:
+            accepted = parse_accept_header(
+                environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding, _ in self.encodings:
+                if encoding in static_file.variants and accepted[encoding]:
+                    static_file = static_file.variants[encoding]
+                    headers.append(('Content-Encoding', encoding))
+                    break
+
+        etag = '"{}"'.format(static_file.etag)
+        headers += [('ETag', etag),
+                    ('Last-Modified', static_file.last_modified)]
+        if not is_resource_modified(environ, static_file.etag,
+                                    last_modified=static_file.modified):
+            start_response('304 Not Modified', headers)
+            return []
+
+        disk_file = None
+        if static_file.data is None and environ['REQUEST_METHOD'] != 'HEAD':
+            # Opened before the response starts, so that a file removed since
+            # it was indexed can still be passed on to the app.
+            disk_file = open(static_file.filename, 'rb')
+
+        start, stop = byte_range or (0, static_file.size)
+        headers += [('Content-Type', content_type),
+                    ('Content-Length', str(stop - start))]
+        if byte_range:
+            headers.append(('Content-Range', 'bytes {}-{}/{}'.format(
+                start, stop - 1, static_file.size)))
+            start_response('206 Partial Content', headers)
+        else:
+            start_response('200 OK', headers)
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        if static_file.data is not None:
+            return [static_file.data[start:stop]]
+        if byte_range:
+            return self._read_range(disk_file, start, stop)
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(disk_file, self.chunk_size)
+
+    def _byte_range(self, environ, static_file):
+        """Returns the (start, stop) of a satisfiable single range request,
+        None to send the whole file, or False if it can't be satisfied."""
+        if_range = parse_if_range_header(environ.get('HTTP_IF_RANGE'))
+        if if_range.etag is not None and \
+                if_range.etag != static_file.etag or \
+                if_range.date is not None and \
+                timegm(if_range.date.utctimetuple()) < static_file.mtime:
+            return None
+        byte_range = parse_range_header(environ.get('HTTP_RANGE'))
+        if byte_range is None or len(byte_range.ranges) != 1:
+            return None
+        return byte_range.range_for_length(static_file.size) or False
+
+    def _read_range(self, disk_file, start, stop):
+        with disk_file as static_file:
+            static_file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = static_file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def _cache_control(self, static_file):
+        if self.fingerprinted.search(static_file.filename):
+            return 'public, max-age={}, immutable'.format(
+                self.immutable_max_age)
+        return 'public, max-age={}'.format(self.max_age)
+
+    def _refresh(self, url, static_file):
+        if static_file is None and not path.isfile(self._filename(url)):
+            return None
+        if static_file is None or static_file.is_stale():
+            self.index()
+        return self.files.get(url)
+
+    def _url(self, filename):
+        return '/' + path.relpath(filename, self.root).replace(path.sep, '/')
+
+    def _filename(self, url):
+        filename = path.normpath(path.join(self.root, url.lstrip('/')))
+        return filename if filename.startswith(self.root + path.sep) else ''
+
+
+class CompressionMiddleware(object):
+    """Compresses responses with brotli (when the `brotli` package is
+    installed) or gzip, whichever the client prefers.
+
+    Only responses with a content type in `mimetypes` and a body of at least
+    `min_size` bytes are compressed, and never responses that are already
+    encoded, partial, marked `no-transform` or setting a cookie. Compressing a
+    secret (such as a CSRF token) next to reflected input lets an attacker
+    guess the secret from the compressed size (BREACH), so views that render
+    one should be marked `no-transform` (see `app.routes`). Bodies are compressed as they
+    are streamed: each chunk the app yields is compressed and flushed on its
+    own, so a streamed response reaches the client as it is produced. A body
+    of unknown length is buffered until it reaches `min_size` (or ends) to
+    decide whether it is worth compressing.
+
+    Compressible responses get `Vary: Accept-Encoding` whether or not they
+    were compressed for this client, so caches keep the variants apart, and
+    compressed responses get a weak ETag.
+    """
+    mimetypes = frozenset([
+        'application/javascript',
+        'application/json',
+        'application/xml',
+        'image/svg+xml',
+        'text/css',
+        'text/html',
+        'text/javascript',
+        'text/plain',
+        'text/xml',
+    ])
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4,
+                 mimetypes=None):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        if mimetypes is not None:
+            self.mimetypes = frozenset(mimetypes)
+        self.encodings = ['br', 'gzip'] if brotli else ['gzip']
+
+    def __call__(self, environ, start_response):
+        response = {}
+
+        def capture_response(status, headers, exc_info=None):
+            if exc_info is not None and response.get('sent'):
+                try:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            response.update(status=status, headers=Headers(headers))
+
+        app_iter = self.app(environ, capture_response)
+        try:
+            return self._respond(environ, start_response, app_iter, response)
+        except BaseException:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            raise
+
+    def _respond(self, environ, start_response, app_iter, response):
+        body = iter(app_iter)
+        # The app may only call start_response when its first chunk is read.
+        first = [] if 'status' in response else [next(body, b'')]
+        status, headers = response['status'], response['headers']
+        response['sent'] = True
+        if not self._is_compressible(status, headers):
+            start_response(status, headers.to_wsgi_list())
+            return _closing(_chain(first, body), app_iter)
+
+        headers['Vary'] = _vary(headers.get('Vary'))
+        encoding = self._encoding(environ)
+        length = headers.get('Content-Length', type=int)
+        if length is None and encoding is not None:
+            # Read enough of the body to know if it is worth compressing.
+            buffered = sum(len(chunk) for chunk in first)
+            for chunk in body:
+                first.append(chunk)
+                buffered += len(chunk)
+                if buffered >= self.min_size:
+                    break
+            else:
+                length = buffered
+                headers['Content-Length'] = str(length)
+        if encoding is None or length is not None and length < self.min_size \
+                or environ['REQUEST_METHOD'] == 'HEAD':
+            start_response(status, headers.to_wsgi_list())
+            return _closing(_chain(first, body), app_iter)
+
+        headers['Content-Encoding'] = encoding
+        headers.pop('Content-Length', None)
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        start_response(status, headers.to_wsgi_list())
+        return _closing(self._compress(encoding, _chain(first, body),
+                                       streamed=length is None), app_iter)
+
+    def _is_compressible(self, status, headers):
+        content_type = parse_options_header(headers.get('Content-Type'))[0]
+        cache_control = parse_cache_control_header(
+            headers.get('Cache-Control'))
+        return content_type in self.mimetypes and \
+            'Content-Encoding' not in headers and \
+            'Content-Range' not in headers and \
+            'no-transform' not in cache_control and \
+            'Set-Cookie' not in headers and \
+            status[:3] not in ('204', '206', '304')
+
+    def _encoding(self, environ):
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = accepted.best_match(self.encodings)
+        return encoding if encoding and accepted[encoding] else None
+
+    def _compressor(self, encoding):
+        """Returns the (compress, flush, finish) functions for `encoding`."""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        return compressor.compress, \
+            lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def _compress(self, encoding, chunks, streamed):
+        compress, flush, finish = self._compressor(encoding)
+        if not streamed:
+            yield b''.join(compress(chunk) for chunk in chunks) + finish()
+            return
+        # Flush every chunk, so the client gets it as soon as it is produced.
+        for chunk in chunks:
+            if chunk:
+                yield compress(chunk) + flush()
+        yield finish()
+
+
+def _chain(first, body):
+    for chunk in first:
+        yield chunk
+    for chunk in body:
+        yield chunk
+
+
+def _closing(chunks, app_iter):
+    """Yields `chunks`, then closes the app's iterable."""
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+def _vary(vary):
+    """Adds Accept-Encoding to a Vary header."""
+    fields = [field.strip() for field in (vary or '').split(',')
+              if field.strip()]
+    if '*' in fields or 'accept-encoding' in (field.lower() for field in
+                                              fields):
+        return ', '.join(fields)
+    return ', '.join(fields + ['Accept-Encoding'])
@@ -7,25 +7,60 @@ app.models
 The models module for spa-base.
 """
 
+from time import perf_counter
+
+from flask import current_app, g, request
 from sqlalchemy.exc import DatabaseError
 
 from .base import BaseModel, db, IntegrityConstraintViolation, migrate, session
 from .user import DuplicateEmailError, Email, User
+from .token import UsedToken
+from .outbox import OutboxMessage
+from .cache import invalidate_user, load_user, user_cache
+from .pool import pool_statistics, reset_engines
+from .queries import QueryRecorder, record_queries
+from . import cache, pool, queries, routing
 
 
 def init_app(app):
     db.init_app(app)
     migrate.init_app(app, db)
+    routing.init_app(app)
+    pool.init_app(app)
+    cache.init_app(app)
+    queries.init_app(app)
 
     @app.after_request
     def session_commit(response):
         """Automatically commit database changes at the end of every successful
-        request."""
+        request.
+
+        Requests that never used the session, or only read from it, skip the
+        commit; their session is closed (and its connection returned) when the
+        app context is torn down. The outcome is recorded in
+        `g.transaction_stats`."""
         if response.status_code >= 400:
             return response
+        if not session.registry.has() or not session().has_writes:
+            _record_transaction(committed=False)
+            return response
+        start = perf_counter()
         try:
             session.commit()
+            _record_transaction(committed=True,
+                                commit_time=perf_counter() - start)
             return response
         except DatabaseError:
             session.rollback()
             raise
+
+
+def _record_transaction(committed, commit_time=0.0):
+    """Stores (and logs) the request's transaction statistics."""
+    g.transaction_stats = {
+        'committed': committed,
+        'flushes': session().flushes if session.registry.has() else 0,
+        'commit_time': commit_time,
+    }
+    current_app.logger.debug('Transaction for %s: %s', request.path,
+                             g.transaction_stats)
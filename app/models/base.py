@@ -11,14 +11,37 @@ https://chase-seibert.github.io/blog/2016/03/31/flask-sqlalchemy-sessionless.htm
 """
 
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import event, orm
 from sqlalchemy.exc import DatabaseError
+from sqlalchemy.ext import baked
+
+from .pool import apply_pool_options
+from .routing import record_flush, RoutingSession
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with the pool settings from `app.config.Config` and a
+    session that can route reads to replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        apply_pool_options(app, info, options)
+        super().apply_driver_hacks(app, info, options)
 
 
 db = SQLAlchemy()
 session = db.session
 migrate = Migrate()
 
+# The cache of constructed and compiled queries used by the models' hot
+# lookups. See https://docs.sqlalchemy.org/en/latest/orm/extensions/baked.html
+bakery = baked.bakery(size=500)
+
+event.listen(session, 'after_flush', record_flush)
+
 
 class IntegrityConstraintViolation(Exception):
     pass
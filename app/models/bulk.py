@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.bulk
+~~~~~~~~~~~~~~~
+
+Streaming bulk import and export of users for spa-base.
+
+Records are read from (and written to) CSV or newline delimited JSON files one
+at a time, and users are inserted with core bulk inserts in chunks, so memory
+use stays the same no matter how large the file is. Each record looks like:
+
+    {"email": "jane@example.com", "first_name": "Jane", "last_name": "Doe",
+     "password_hash": "pbkdf2:sha256:50000$...", "verified": true,
+     "emails": [{"email": "jane.doe@example.com", "verified": false}]}
+
+`email` is the user's primary email and `emails` lists their other emails
+(optional; in CSV files it is a JSON list). A plain text `password` may be
+given instead of a `password_hash`, but hashing it is by far the slowest part
+of an import. Duplicate emails (within a chunk or already in the database) are
+skipped rather than claimed: a user whose primary email is a duplicate is
+skipped, and their other emails that are duplicates are left out.
+
+After every committed chunk the number of records consumed is written to a
+checkpoint file. Running the same import again with the same checkpoint skips
+the records that were already imported.
+"""
+
+import csv
+import json
+from collections import namedtuple, OrderedDict
+from itertools import groupby, islice
+from os import path, remove, replace
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from .base import session
+from .cache import invalidate_user
+from .user import Email, User
+
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ('email', 'first_name', 'last_name', 'password_hash',
+                 'verified', 'active', 'emails')
+
+
+class ImportStats(namedtuple('ImportStats', 'imported duplicates invalid '
+                                            'resumed_from')):
+    """The counts of records handled by an import."""
+
+
+def guess_format(filename):
+    """Guesses the record format from a file name."""
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(stream, file_format='ndjson'):
+    """Yields records (dicts) from a CSV or NDJSON stream."""
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def write_records(stream, records, file_format='ndjson'):
+    """Writes records (dicts) to a CSV or NDJSON stream."""
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(dict(record, emails=json.dumps(record['emails']))
+                         if 'emails' in record else record
+                         for record in records)
+        return
+    for record in records:
+        stream.write(json.dumps(record) + '\n')
+
+
+def chunked(iterable, size):
+    """Yields lists of up to `size` items from `iterable`."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def import_users(records, chunk_size=1000, checkpoint=None, retries=3):
+    """Bulk inserts users (and their emails) from an iterable of records.
+
+    Each chunk is committed on its own. If `checkpoint` is a file path, records
+    consumed by an earlier run are skipped and progress is recorded after each
+    chunk. The checkpoint is removed once the import completes."""
+    resumed_from = read_checkpoint(checkpoint)
+    consumed = resumed_from
+    imported = duplicates = invalid = 0
+    for chunk in chunked(islice(records, resumed_from, None), chunk_size):
+        users, chunk_invalid = _normalize(chunk)
+        for attempt in range(retries):
+            try:
+                chunk_imported = _insert_chunk(users)
+                session.commit()
+                break
+            except IntegrityError:
+                # Another writer claimed an id or an email between reading the
+                # chunk and inserting it; start the chunk over.
+                session.rollback()
+                if attempt == retries - 1:
+                    raise
+        consumed += len(chunk)
+        imported += chunk_imported
+        invalid += chunk_invalid
+        duplicates += len(users) - chunk_imported
+        write_checkpoint(checkpoint, consumed)
+    if checkpoint and path.exists(checkpoint):
+        remove(checkpoint)
+    return ImportStats(imported, duplicates, invalid, resumed_from)
+
+
+def export_users(chunk_size=1000):
+    """Yields one record per user, streaming them from the database in
+    `chunk_size` batches. The exported email is the user's primary email (or
+    the same fallback `User.primary_email` uses), and their other emails are
+    exported in `emails`."""
+    users, emails = User.__table__, Email.__table__
+    query = select([users.c.id, users.c.first_name, users.c.last_name,
+                    users.c.password_hash, users.c.active,
+                    users.c.primary_email_fk, emails.c.email,
+                    emails.c.verified]) \
+        .select_from(users.join(emails, emails.c.user_id == users.c.id)) \
+        .order_by(users.c.id, emails.c.email) \
+        .execution_options(stream_results=True)
+    result = session.execute(query)
+    rows = iter(lambda: result.fetchmany(chunk_size), [])
+    rows = (row for batch in rows for row in batch)
+    for _, user_rows in groupby(rows, key=lambda row: row.id):
+        user_rows = list(user_rows)
+        primary = next((row for row in user_rows
+                        if row.email == row.primary_email_fk), None) \
+            or next((row for row in user_rows if row.verified), user_rows[0])
+        yield {
+            'email': primary.email,
+            'first_name': primary.first_name,
+            'last_name': primary.last_name,
+            'password_hash': primary.password_hash,
+            'verified': bool(primary.verified),
+            'active': bool(primary.active),
+            'emails': [{'email': row.email, 'verified': bool(row.verified)}
+                       for row in user_rows if row is not primary],
+        }
+
+
+def read_checkpoint(checkpoint):
+    """Returns the number of records a previous run consumed."""
+    if not checkpoint or not path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as checkpoint_file:
+        return json.load(checkpoint_file)['records']
+
+
+def write_checkpoint(checkpoint, records):
+    """Atomically records the number of records consumed so far."""
+    if not checkpoint:
+        return
+    with open(checkpoint + '.tmp', 'w') as checkpoint_file:
+        json.dump({'records': records}, checkpoint_file)
+    replace(checkpoint + '.tmp', checkpoint)
+
+
+def _is_true(value):
+    return str(value).lower() in ['1', 'true', 'yes']
+
+
+def _normalize(records):
+    """Turns raw records into insertable user dicts. Returns the users and the
+    number of records that were invalid."""
+    users = []
+    for record in records:
+        email = (record.get('email') or '').strip()
+        password_hash = record.get('password_hash')
+        if not password_hash and record.get('password'):
+            password_hash = generate_password_hash(record['password'])
+        if not email or not record.get('first_name') or \
+                not record.get('last_name') or not password_hash or \
+                password_hash.count('$') != 2:
+            continue
+        try:
+            other_emails = _other_emails(record.get('emails'), email)
+        except ValueError:
+            continue
+        users.append({
+            'email': email,
+            'first_name': record['first_name'],
+            'last_name': record['last_name'],
+            'password_hash': password_hash,
+            'verified': _is_true(record.get('verified', False)),
+            'active': _is_true(record.get('active', True)),
+            'emails': other_emails,
+        })
+    return users, len(records) - len(users)
+
+
+def _other_emails(emails, primary):
+    """Turns a record's `emails` (a list, or a JSON list from a CSV file, of
+    addresses or {"email", "verified"} dicts) into a list of email dicts.
+    Throws a ValueError if they are malformed."""
+    if not emails:
+        return []
+    if isinstance(emails, str):
+        emails = json.loads(emails)
+    if not isinstance(emails, list):
+        raise ValueError('emails must be a list.')
+    other_emails = OrderedDict()
+    for email in emails:
+        if isinstance(email, str):
+            email = {'email': email}
+        if not isinstance(email, dict):
+            raise ValueError('Emails must be addresses or dicts.')
+        address = (email.get('email') or '').strip()
+        if not address:
+            raise ValueError('Every email needs an address.')
+        if address != primary:
+            other_emails[address] = _is_true(email.get('verified', False))
+    return [{'email': address, 'verified': verified}
+            for address, verified in other_emails.items()]
+
+
+def _insert_chunk(users):
+    """Inserts a chunk of users and their emails, skipping duplicate emails.
+    Returns the number of users inserted."""
+    emails = Email.__table__
+    addresses = [email['email'] for user in users
+                 for email in [user] + user['emails']]
+    existing = {row.email for row in session.execute(
+        select([emails.c.email]).where(emails.c.email.in_(addresses)))}
+    unique_users = []
+    for user in users:
+        if user['email'] not in existing:
+            existing.add(user['email'])
+            user['emails'] = [email for email in user['emails']
+                              if email['email'] not in existing]
+            existing.update(email['email'] for email in user['emails'])
+            unique_users.append(user)
+    if not unique_users:
+        return 0
+
+    next_id = (session.execute(select([func.max(User.__table__.c.id)]))
+               .scalar() or 0) + 1
+    for id, user in enumerate(unique_users, next_id):
+        user['id'] = id
+        invalidate_user(id)
+
+    session.execute(User.__table__.insert(), [
+        {key: user[key] for key in ('id', 'first_name', 'last_name',
+                                    'password_hash', 'active')}
+        for user in unique_users])
+    session.execute(emails.insert(), [
+        {'email': email['email'], 'user_id': user['id'],
+         'verified': email['verified']}
+        for user in unique_users for email in [user] + user['emails']])
+
+    verified = [{'_id': user['id'], '_email': user['email']}
+                for user in unique_users if user['verified']]
+    if verified:
+        session.execute(
+            User.__table__.update()
+                .where(User.__table__.c.id == bindparam('_id'))
+                .values(primary_email_fk=bindparam('_email')),
+            verified)
+    return len(unique_users)
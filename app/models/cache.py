@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.cache
+~~~~~~~~~~~~~~~~
+
+The cross-request user identity cache for spa-base.
+
+Every authenticated request runs the login manager's user loader. Rather than
+querying the database each time, a detached copy of the user (along with its
+joined primary email) is kept in a small per-worker LRU cache and merged into
+the request's session without loading it again.
+
+Any flush that touches a User or an Email (which includes `BaseModel.save`,
+`update` and `delete`) evicts the affected user from this worker's cache, and
+evicts it again once the transaction commits, since another thread may load
+(and cache) the old committed row in between. Other workers will hold on to
+their copy until it expires, so keep USER_CACHE_TTL short.
+"""
+
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm import (
+    make_transient_to_detached,
+    object_mapper,
+)
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.cache import LRUCache
+from .base import db, session
+from .user import Email, User
+
+
+user_cache = LRUCache(maxsize=0)
+
+
+def load_user(user_id):
+    """Returns the user with `user_id`, attached to the current session,
+    from the cache if possible."""
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return session.merge(cached_user, load=False)
+    user = User.get_by_id(user_id)
+    if user is not None:
+        user_cache.set(user_id, detached_user_copy(user))
+    return user
+
+
+def invalidate_user(user_id):
+    """Evicts a user from the cache."""
+    user_cache.pop(user_id)
+
+
+def detached_user_copy(user):
+    """Returns a detached copy of a user and its primary email that can be
+    safely shared between sessions."""
+    copy = _detached_copy(user, commit=False)
+    primary_email = user.primary_email_rel
+    set_committed_value(copy, 'primary_email_rel',
+                        _detached_copy(primary_email) if primary_email else None)
+    make_transient_to_detached(copy)
+    return copy
+
+
+def _detached_copy(instance, commit=True):
+    """Copies the column attributes of an instance into a new instance of the
+    same model without calling its constructor."""
+    mapper = object_mapper(instance)
+    copy = mapper.class_manager.new_instance()
+    for attr in mapper.column_attrs:
+        set_committed_value(copy, attr.key, getattr(instance, attr.key))
+    if commit:
+        make_transient_to_detached(copy)
+    return copy
+
+
+@event.listens_for(db.session, 'after_flush')
+def invalidate_flushed_users(flush_session, flush_context):
+    """Evicts any user whose User or Email rows were touched by a flush, and
+    remembers them to be evicted again when the transaction commits."""
+    flushed = flush_session.info.setdefault('flushed_user_ids', set())
+    for instance in chain(flush_session.new, flush_session.dirty,
+                          flush_session.deleted):
+        if isinstance(instance, User):
+            user_id = instance.id
+        elif isinstance(instance, Email):
+            user_id = instance.user_id
+        else:
+            continue
+        invalidate_user(user_id)
+        flushed.add(user_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_committed_users(commit_session):
+    """Evicts the users flushed in a transaction once it commits."""
+    if commit_session.transaction.nested:
+        return
+    for user_id in commit_session.info.pop('flushed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_flushed_users(rollback_session):
+    """Forgets the users flushed in a transaction that was rolled back."""
+    if not rollback_session.transaction.nested:
+        rollback_session.info.pop('flushed_user_ids', None)
+
+
+def init_app(app):
+    user_cache.configure(maxsize=app.config['USER_CACHE_SIZE'],
+                         ttl=app.config['USER_CACHE_TTL'])
+    user_cache.clear()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.outbox
+~~~~~~~~~~~~~~~~~
+
+The OutboxMessage model for spa-base.
+
+Side effects of a request (such as sending mail) are written to the outbox in
+the same transaction as the changes that cause them, so they happen if and only
+if the transaction commits. The outbox worker (see `app.outbox`) delivers them
+afterwards.
+
+Workers claim a batch of due messages with `SELECT ... FOR UPDATE SKIP LOCKED`,
+so several workers never wait on (or deliver) each other's messages. SQLite has
+no row locks; there each message is claimed with a compare-and-set update
+instead. Claiming a message leases it: it is not due again until the lease
+runs out, so the messages of a worker that dies are picked up by another one.
+"""
+
+import json
+from time import time
+
+from sqlalchemy import and_, update
+
+from .base import BaseModel, db, session
+
+
+class OutboxMessage(BaseModel):
+    __tablename__ = 'outbox'
+    __table_args__ = (db.Index('ix_outbox_status_available_at', 'status',
+                               'available_at'),)
+
+    PENDING = 'pending'
+    DEAD = 'dead'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.Integer, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return '<OutboxMessage {} {}>'.format(self.id, self.kind)
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    @staticmethod
+    def enqueue(kind, data, delay=0):
+        """Adds a message to the outbox in the current transaction. It is
+        delivered once the transaction commits."""
+        now = int(time())
+        message = OutboxMessage(kind=kind, payload=json.dumps(data),
+                                status=OutboxMessage.PENDING, attempts=0,
+                                available_at=now + delay, created_at=now)
+        session.add(message)
+        return message
+
+    @staticmethod
+    def claim(batch_size, lease, now=None):
+        """Claims up to `batch_size` due messages for `lease` seconds and
+        commits. Returns the claimed messages."""
+        now = int(now or time())
+        dialect = session.get_bind().dialect.name
+        query = OutboxMessage.due(batch_size, now, dialect)
+        if dialect == 'sqlite':
+            ids = [message.id for message in query.all()
+                   if OutboxMessage._compare_and_claim(message, lease, now)]
+        else:
+            messages = query.all()
+            for message in messages:
+                message.available_at = now + lease
+                message.attempts += 1
+            ids = [message.id for message in messages]
+        session.commit()
+        if not ids:
+            return []
+        # Reload the batch (expired by the commit) in one query.
+        return OutboxMessage.query.filter(OutboxMessage.id.in_(ids)) \
+                                  .order_by(OutboxMessage.id).all()
+
+    @staticmethod
+    def due(batch_size, now, dialect):
+        """Returns the query for up to `batch_size` due messages, locking them
+        (and skipping those locked by other workers) where `dialect` can."""
+        query = OutboxMessage.query \
+            .filter(OutboxMessage.status == OutboxMessage.PENDING,
+                    OutboxMessage.available_at <= now) \
+            .order_by(OutboxMessage.available_at, OutboxMessage.id) \
+            .limit(batch_size)
+        if dialect == 'sqlite':
+            return query
+        if dialect == 'mysql':
+            # SQLAlchemy 1.2 only renders SKIP LOCKED for postgresql itself.
+            return query.with_for_update().suffix_with('SKIP LOCKED')
+        return query.with_for_update(skip_locked=True)
+
+    @staticmethod
+    def _compare_and_claim(message, lease, now):
+        """Claims a message unless another worker changed it first."""
+        table = OutboxMessage.__table__
+        result = session.execute(
+            update(table)
+            .where(and_(table.c.id == message.id,
+                        table.c.available_at == message.available_at,
+                        table.c.status == OutboxMessage.PENDING))
+            .values(available_at=now + lease, attempts=table.c.attempts + 1))
+        return result.rowcount == 1
+
+    def delivered(self):
+        """Removes a delivered message from the outbox."""
+        session.delete(self)
+
+    def failed(self, error, retry_in=None):
+        """Records a failed delivery. The message is tried again in `retry_in`
+        seconds, or becomes a dead letter if `retry_in` is None."""
+        self.last_error = error
+        if retry_in is None:
+            self.status = OutboxMessage.DEAD
+        else:
+            self.available_at = int(time() + retry_in)
+
+    @staticmethod
+    def dead_letters():
+        return OutboxMessage.query.filter_by(status=OutboxMessage.DEAD)
+
+    @staticmethod
+    def retry_dead_letters(ids=None):
+        """Puts dead letters (all of them, or those in `ids`) back in the
+        outbox. Returns the number of messages requeued."""
+        query = OutboxMessage.dead_letters()
+        if ids:
+            query = query.filter(OutboxMessage.id.in_(ids))
+        return query.update({'status': OutboxMessage.PENDING, 'attempts': 0,
+                             'available_at': int(time())},
+                            synchronize_session=False)
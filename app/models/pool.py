@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.pool
+~~~~~~~~~~~~~~~
+
+The database connection pool management for spa-base.
+
+Each gunicorn worker gets its own connection pool. Unless DATABASE_POOL_SIZE
+is set, a worker's pool is sized to its thread count (a thread only ever holds
+one connection at a time) and the overflow is whatever is left of
+DATABASE_MAX_CONNECTIONS once it is shared between all of the workers.
+Connections are pre-pinged on checkout so a MySQL "server has gone away" is
+handled by reconnecting rather than failing the request.
+
+Connections must never be shared across a fork. When the app is loaded before
+forking (gunicorn's --preload), `reset_engines` gives the child fresh pools; it
+is called automatically after a fork on Python 3.7+ and from the post_fork hook
+in gunicorn.conf.py. As a last line of defense, a connection checked out in a
+different process than the one that opened it is discarded.
+"""
+
+import os
+from time import perf_counter
+from weakref import WeakSet
+
+from flask_sqlalchemy import get_state
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+_apps = WeakSet()
+_fork_hook_registered = False
+_orphaned_pools = []
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that keeps statistics on how long it takes to check out a
+    connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = perf_counter() - start
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def recreate(self):
+        # QueuePool.recreate doesn't carry pre_ping over to the new pool.
+        pool = super().recreate()
+        pool._pre_ping = self._pre_ping
+        return pool
+
+    def statistics(self):
+        """Returns a dict of the pool's current state and counters."""
+        return {
+            'pool': type(self).__name__,
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'average_wait': self.total_wait / self.checkouts
+                            if self.checkouts else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+def derive_pool_size(workers, threads, max_connections=None):
+    """Returns a (pool_size, max_overflow) pair for each worker.
+
+    A worker needs one pooled connection per thread. When the database only
+    allows `max_connections`, the workers split them evenly and any left over
+    after the pool becomes overflow."""
+    pool_size = max(threads, 1)
+    if not max_connections:
+        return pool_size, pool_size
+    per_worker = max(max_connections // max(workers, 1), 1)
+    pool_size = min(pool_size, per_worker)
+    return pool_size, per_worker - pool_size
+
+
+def apply_pool_options(app, info, options):
+    """Adds the pool class, pre-ping and (derived) pool size to the engine
+    options. SQLite keeps Flask-SQLAlchemy's defaults."""
+    if info.drivername == 'sqlite':
+        return
+    options['poolclass'] = TimedQueuePool
+    options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+    pool_size, max_overflow = derive_pool_size(
+        app.config['WEB_CONCURRENCY'], app.config['WEB_THREADS'],
+        app.config['DATABASE_MAX_CONNECTIONS'])
+    options.setdefault('pool_size', pool_size)
+    options.setdefault('max_overflow', max_overflow)
+
+
+def pool_statistics(app):
+    """Returns the statistics of every engine's pool in this process, keyed by
+    bind (the default bind is None)."""
+    return {bind: _statistics(connector.get_engine().pool)
+            for bind, connector in get_state(app).connectors.items()}
+
+
+def reset_engines(app=None):
+    """Gives every engine a fresh, empty pool. Call this in a child process
+    after a fork. The parent's connections are left open (and referenced) so
+    the child doesn't close the parent's sockets."""
+    for app in [app] if app else list(_apps):
+        for connector in get_state(app).connectors.values():
+            engine = connector.get_engine()
+            _orphaned_pools.append(engine.pool)
+            engine.pool = engine.pool.recreate()
+
+
+def _statistics(pool):
+    if isinstance(pool, TimedQueuePool):
+        return pool.statistics()
+    return {'pool': type(pool).__name__}
+
+
+@event.listens_for(TimedQueuePool, 'connect')
+def _record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(TimedQueuePool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid {}, attempting to check out in '
+            'pid {}'.format(connection_record.info['pid'], pid))
+
+
+def init_app(app):
+    global _fork_hook_registered
+    _apps.add(app)
+    if hasattr(os, 'register_at_fork') and not _fork_hook_registered:
+        os.register_at_fork(after_in_child=reset_engines)
+        _fork_hook_registered = True
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.queries
+~~~~~~~~~~~~~~~~~~
+
+Per-request SQL query instrumentation for spa-base.
+
+Every statement sent to the database (on any engine), including the ones that
+fail, is counted and timed by whichever `QueryRecorder`s are active in the
+current thread. Each request gets
+its own recorder, kept in `g.query_stats`. At the end of the request:
+
+* a warning is logged when it ran more than DATABASE_QUERY_WARN_COUNT
+  statements or spent more than DATABASE_QUERY_WARN_TIME seconds in them,
+* a warning is logged for each statement that was run
+  DATABASE_QUERY_REPEAT_LIMIT or more times (the same SQL with different
+  parameters is almost always an N+1 lazy load), and
+* the X-Query-Count and X-Query-Time headers are added to the response when
+  DATABASE_QUERY_HEADERS is true.
+
+`record_queries` can be used to count the statements run by any block of code
+(see `tests.utilities.helpers.assert_max_queries`).
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from threading import local
+from time import perf_counter
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+_active = local()
+
+
+class QueryRecorder(object):
+    """Records the statements run while it is active."""
+
+    def __init__(self):
+        self.statements = []
+        self.total_time = 0.0
+
+    def __len__(self):
+        return len(self.statements)
+
+    def record(self, statement, duration):
+        self.statements.append(statement)
+        self.total_time += duration
+
+    def repeated(self, limit=2):
+        """Returns (statement, count) pairs for the statements that were run
+        at least `limit` times, the most repeated first."""
+        return [(statement, count) for statement, count
+                in Counter(self.statements).most_common() if count >= limit]
+
+    def start(self):
+        _recorders().append(self)
+        return self
+
+    def stop(self):
+        if self in _recorders():
+            _recorders().remove(self)
+        return self
+
+
+@contextmanager
+def record_queries():
+    """A context manager that yields a `QueryRecorder` for its block."""
+    recorder = QueryRecorder().start()
+    try:
+        yield recorder
+    finally:
+        recorder.stop()
+
+
+def _recorders():
+    if not hasattr(_active, 'recorders'):
+        _active.recorders = []
+    return _active.recorders
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    _record(conn, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _stop_timer_on_error(exception_context):
+    # Errors before the statement was sent have no timer yet, and errors while
+    # fetching its results have no statement (its timer was already stopped).
+    conn = exception_context.connection
+    if exception_context.statement is not None and conn is not None and \
+            conn.info.get('query_start'):
+        _record(conn, exception_context.statement)
+
+
+def _record(conn, statement):
+    duration = perf_counter() - conn.info['query_start'].pop()
+    for recorder in _recorders():
+        recorder.record(statement, duration)
+
+
+def start_request_recorder():
+    """Starts recording the current request's queries."""
+    g.query_stats = QueryRecorder().start()
+
+
+def report_request_queries(response):
+    """Stops recording the current request's queries, warns about slow or
+    repeated ones and adds the query headers."""
+    recorder = g.get('query_stats')
+    if recorder is None:
+        return response
+    recorder.stop()
+    config = current_app.config
+    if len(recorder) > config['SQLALCHEMY_QUERY_WARN_COUNT'] or \
+            recorder.total_time > config['SQLALCHEMY_QUERY_WARN_TIME']:
+        current_app.logger.warning(
+            '%s %s ran %d queries in %.3fs', request.method, request.path,
+            len(recorder), recorder.total_time)
+    for statement, count in recorder.repeated(
+            config['SQLALCHEMY_QUERY_REPEAT_LIMIT']):
+        current_app.logger.warning(
+            'Probable N+1 query: %s %s ran this %d times: %s',
+            request.method, request.path, count, statement)
+    if config['SQLALCHEMY_QUERY_HEADERS']:
+        response.headers['X-Query-Count'] = str(len(recorder))
+        response.headers['X-Query-Time'] = \
+            '{:.6f}'.format(recorder.total_time)
+    return response
+
+
+def stop_request_recorder(exception=None):
+    recorder = g.get('query_stats')
+    if recorder is not None:
+        recorder.stop()
+
+
+def init_app(app):
+    app.before_request(start_request_recorder)
+    app.after_request(report_request_queries)
+    app.teardown_request(stop_request_recorder)
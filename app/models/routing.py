@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.routing
+~~~~~~~~~~~~~~~~~~
+
+The read replica routing session for spa-base. The session also keeps track of
+whether it has written anything, so requests that didn't can skip their
+commit.
+
+When DATABASE_REPLICA_URIS is set, each replica becomes a bind and the session
+sends plain reads to one of them (the same one for the life of the session).
+Flushes, insert/update/delete statements, `SELECT ... FOR UPDATE` and raw
+connections always use the primary.
+
+Replicas lag behind the primary, so after a session writes anything it sticks
+to the primary for the rest of the request. The user who made the write also
+sticks to the primary for DATABASE_REPLICA_STICKY_SECONDS afterwards (tracked
+in their flask session), so the redirect that follows a form post will see
+what was just committed.
+"""
+
+from random import choice
+from time import time
+
+from flask import has_request_context, session as flask_session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.sql.expression import TextClause, UpdateBase
+
+
+PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """A session that routes reads to replicas and writes to the primary."""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        self.wrote = False
+        self.flushes = 0
+        self._replica_key = None
+
+    def get_bind(self, mapper=None, clause=None):
+        replica_keys = self.app.config['SQLALCHEMY_REPLICA_BINDS']
+        if replica_keys and self._is_read(mapper, clause) and \
+                not self._sticks_to_primary():
+            if self._replica_key is None:
+                self._replica_key = choice(replica_keys)
+            return self.db.get_engine(self.app, bind=self._replica_key)
+        if isinstance(clause, (UpdateBase, TextClause)):
+            self.mark_write()
+        return super().get_bind(mapper, clause)
+
+    @property
+    def has_writes(self):
+        """True if this session has written to the database or has changes
+        waiting to be flushed."""
+        return self.wrote or bool(self.new or self.deleted or self.dirty)
+
+    def mark_write(self):
+        """Records a write and sticks this session (and the current user) to
+        the primary."""
+        self.wrote = True
+        if self.app.config['SQLALCHEMY_REPLICA_BINDS'] and \
+                has_request_context():
+            flask_session[PRIMARY_UNTIL_KEY] = \
+                time() + self.app.config['SQLALCHEMY_REPLICA_STICKY_SECONDS']
+
+    def _is_read(self, mapper, clause):
+        if self._flushing or mapper is None and clause is None:
+            return False
+        if mapper is not None and \
+                mapper.mapped_table.info.get('bind_key') is not None:
+            return False
+        if isinstance(clause, (UpdateBase, TextClause)):
+            return False
+        return getattr(clause, '_for_update_arg', None) is None
+
+    def _sticks_to_primary(self):
+        if self.wrote:
+            return True
+        return has_request_context() and \
+            flask_session.get(PRIMARY_UNTIL_KEY, 0) > time()
+
+
+def record_flush(session, flush_context):
+    """Session event that records a flush as a write."""
+    session.flushes += 1
+    session.mark_write()
+
+
+def init_app(app):
+    replica_uris = app.config['SQLALCHEMY_REPLICA_URIS']
+    replica_keys = ['replica_{}'.format(n) for n in range(len(replica_uris))]
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(zip(replica_keys, replica_uris))
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.config['SQLALCHEMY_REPLICA_BINDS'] = replica_keys
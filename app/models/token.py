@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.models.token
+~~~~~~~~~~~~~~~~
+
+The UsedToken model for spa-base.
+
+Single-use tokens (such as password reset tokens) carry a random `jti` claim.
+When one is used its jti is recorded here, so the same token is rejected the
+next time. Rows are small (the jti and the token's expiry), looked up by
+primary key, and can be pruned by the expiry index once the token would have
+expired anyway.
+"""
+
+from time import time
+
+from sqlalchemy import insert
+
+from .base import BaseModel, db, session
+
+
+class UsedToken(BaseModel):
+    __tablename__ = 'used_tokens'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.Integer, index=True, nullable=False)
+
+    def __repr__(self):
+        return '<UsedToken {}>'.format(self.jti)
+
+    @staticmethod
+    def use(jti, expires_at):
+        """Records `jti` as used. Returns False if it had already been used.
+
+        The insert ignores a duplicate jti rather than raising, so two requests
+        using the same token at once can't both succeed and neither aborts the
+        session's transaction."""
+        statement = insert(UsedToken.__table__) \
+            .prefix_with('IGNORE', dialect='mysql') \
+            .prefix_with('OR IGNORE', dialect='sqlite') \
+            .values(jti=jti, expires_at=int(expires_at))
+        return session.execute(statement).rowcount == 1
+
+    @staticmethod
+    def prune(now=None):
+        """Deletes the used tokens that have expired. Returns the number of
+        tokens deleted."""
+        return UsedToken.query.filter(UsedToken.expires_at < (now or time())) \
+                              .delete(synchronize_session=False)
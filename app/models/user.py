@@ -29,26 +29,48 @@ The User cannot delete their primary email, hence, it is not possible for the
 user to 'unconfirm' their account. In order to delete their primary email, they
 must first add another email, then confirm it, then set it as primary. The
 original email can then be deleted.
+
+An email that has not been verified is still up for grabs: when another user
+adds it, it is taken from its current owner. Only verified emails are protected
+by a DuplicateEmailError. On MySQL and SQLite users claim emails with an
+atomic upsert, so two users claiming the same email at once cannot both win: a
+new user is flushed first, and its emails are upserted once it has an id. On
+other databases a new user's emails are inserted along with the user; if a
+concurrent registration inserted one of them first, the unique email index
+rejects the insert and saving the user throws a DuplicateEmailError.
 """
 
-from flask import current_app
+from collections import OrderedDict
+
 from flask_login import UserMixin
 from hashlib import md5
-from jwt import encode as jwt_encode, decode as jwt_decode
 from sqlalchemy import (
+    and_,
+    bindparam,
     CheckConstraint,
     DDL,
     event,
     ForeignKeyConstraint,
-    PrimaryKeyConstraint
+    func,
+    PrimaryKeyConstraint,
+    select,
+    text,
 )
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.event import listens_for
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import backref, validates
-from time import time
-from werkzeug.security import generate_password_hash, check_password_hash
-
-from .base import BaseModel, db, IntegrityConstraintViolation, session
+from sqlalchemy.orm import backref, joinedload, validates
+
+from app.passwords import hasher
+from app.tokens import tokens
+from .base import (
+    bakery,
+    BaseModel,
+    db,
+    IntegrityConstraintViolation,
+    session,
+)
 
 
 class DuplicateEmailError(IntegrityConstraintViolation):
@@ -71,12 +93,12 @@ class User(UserMixin, BaseModel):
     )
 
     id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     first_name = db.Column(db.String(128), nullable=False)
     last_name = db.Column(db.String(128), nullable=False)
     emails = db.relationship('Email', foreign_keys='Email.user_id',
                              cascade='all, delete-orphan',
-                             backref='user')
+                             order_by='Email.email', backref='user')
     primary_email_fk = db.Column('primary_email_fk', db.String(128), nullable=True,
                                  unique=True)
     primary_email_rel = db.relationship('Email', uselist=False, lazy="joined",
@@ -101,18 +123,81 @@ class User(UserMixin, BaseModel):
         """Compares user instances with other user instances."""
         return isinstance(other, User) and other.id == self.id
 
+    @classmethod
+    def find_by_email(cls, email, verified_only=False):
+        """Returns the user that owns `email` (or None).
+
+        The lookup joins through the unique email index and eager loads the
+        user's emails and primary email in the same statement. It is a baked
+        query, so it is only built and compiled once."""
+        query = bakery(lambda session: session.query(User)
+                       .join(Email, Email.user_id == User.id)
+                       .filter(Email.email == bindparam('email'))
+                       .options(joinedload(User.emails)))
+        if verified_only:
+            query += lambda query: query.filter(Email.verified == True)
+        return query(session()).params(email=email).one_or_none()
+
+    @classmethod
+    def get_by_id(cls, user_id):
+        """Returns the user with `user_id` (or None) using a baked query."""
+        return bakery(lambda session: session.query(User))(session()) \
+            .get(user_id)
+
+    @classmethod
+    def find_by_verified_email(cls, email):
+        """Returns the user that owns `email` only if it has been verified."""
+        return cls.find_by_email(email, verified_only=True)
+
+    def save(self):
+        """Saves the user. Throws a DuplicateEmailError (and rolls back) if one
+        of a new user's emails was claimed by another user in the meantime."""
+        if self.id is None and Email.supports_upsert():
+            emails = [email.email for email in self.emails]
+            del self.emails[:]
+            super().save()
+            try:
+                Email.upsert(self.id, emails)
+            except DuplicateEmailError:
+                session.rollback()
+                raise
+            session.expire(self, ['emails'])
+            return self
+        try:
+            return super().save()
+        except IntegrityError as error:
+            if _is_duplicate_email(error):
+                raise DuplicateEmailError('This email has already been claimed'
+                                          ' by another account.') from error
+            raise
+
     def delete(self):
         """Deletes this user instance."""
         self.update(primary_email_fk=None, active=False)
         super().delete()
 
     def add_email(self, email=None, emails=None):
-        """Adds a single email (or a list of emails) to the user."""
-        emails = emails if emails else []
+        """Adds a single email (or a list of emails) to the user.
+
+        Duplicates of all of the emails are resolved at once. For a user that
+        is already in the database, the emails are claimed with a single
+        atomic upsert; otherwise they are added to the user's emails and
+        inserted with the user (or upserted when it is saved)."""
+        emails = list(emails) if emails else []
         if email:
             emails.append(email)
+        if not emails:
+            return
+        if self.id is not None and Email.supports_upsert():
+            session.flush()
+            Email.upsert(self.id, emails)
+            session.expire(self, ['emails'])
+            return
+        if not Email.supports_upsert():
+            # Otherwise the upsert in `save` claims them.
+            Email.claim_duplicates(emails)
         for email in emails:
-            self.emails.append(Email(email=email))
+            self.emails.append(Email(email=email, check_duplicates=False))
 
     def remove_email(self, email=None):
         """Removes a single email (or a list of emails) to the user."""
@@ -139,6 +224,25 @@ class User(UserMixin, BaseModel):
             self.primary_email_rel = first_verified_email
         return self.primary_email_rel
 
+    @primary_email.expression
+    def primary_email(cls):
+        """The primary email as a SQL expression (the email address string).
+
+        This is the primary_email_fk when it is set, falling back to the
+        user's first verified email and then their first email, so queries can
+        filter, sort and select on primary email without loading any emails.
+        Emails are ordered by address, as the `emails` relationship is, so
+        this picks the same email as the getter."""
+        emails = Email.__table__.alias('primary_emails')
+        first_email = select([emails.c.email]) \
+            .where(emails.c.user_id == cls.id) \
+            .order_by(emails.c.verified.desc(), emails.c.email) \
+            .limit(1) \
+            .correlate(cls) \
+            .as_scalar()
+        return func.coalesce(cls.primary_email_fk, first_email) \
+                   .label('primary_email')
+
     @primary_email.setter
     def primary_email(self, email):
         """Property that is an email instance that is represented by the
@@ -187,13 +291,19 @@ class User(UserMixin, BaseModel):
     @password.setter
     def password(self, password):
         """Setting the password will only set a password_hash."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        """Checks if a provided password matches the stored password_hash."""
+        """Checks if a provided password matches the stored password_hash.
+        A matching hash made under an outdated hash policy is replaced with
+        one made under the current policy."""
         if not self.password_hash:
             return False
-        return check_password_hash(self.password_hash, password)
+        if not hasher.check(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            self.password = password
+        return True
 
     @property
     def is_active(self):
@@ -213,28 +323,27 @@ class User(UserMixin, BaseModel):
     def avatar(self, size):
         """Returns a url for a gravatar.com avatar based on the user's primary
         email."""
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
+        digest = md5(str(self.email).lower().encode('utf-8')).hexdigest()
         return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
             digest, size)
 
     @property
     def password_reset_token(self, expires_in=600):
-        """Returns a signed password reset token that expires in 'expires_in'
-        seconds (defaults to 600)."""
-        return jwt_encode({'password_reset_for_email': str(self.email),
-                           'exp': time() + expires_in},
-                          current_app.config['SECRET_KEY'],
-                          algorithm='HS256').decode('utf-8')
+        """Returns a signed, single-use password reset token that expires in
+        'expires_in' seconds (defaults to 600)."""
+        return tokens.issue('password_reset',
+                            {'password_reset_for_email': str(self.email)},
+                            expires_in, single_use=True)
 
     @staticmethod
-    def verify_password_reset_token(token):
-        """Verifies that a provided password reset token is valid."""
-        try:
-            email = jwt_decode(token, current_app.config['SECRET_KEY'],
-                               algorithms=['HS256'])['password_reset_for_email']
-        except:
+    def verify_password_reset_token(token, consume=False):
+        """Verifies that a provided password reset token is valid. When
+        `consume` is true the token is used up, so it can't be used again."""
+        verify = tokens.consume if consume else tokens.verify
+        claims = verify(token, 'password_reset')
+        if claims is None or 'password_reset_for_email' not in claims:
             return
-        return User.query.join('emails').filter_by(email=email).first()
+        return User.find_by_email(claims['password_reset_for_email'])
 
 event.listen(
     User.__table__,
@@ -269,23 +378,19 @@ class Email(BaseModel):
     )
 
     email = db.Column(db.String(128), index=True, unique=True)
-    user_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, index=True)
     verified = db.Column(db.Boolean, default=False)
 
-    def __init__(self, email=email, **kwargs):
+    def __init__(self, email=email, check_duplicates=True, **kwargs):
         """The constructor for the email model checks for duplicate emails. If
         there is a duplicate, but it is not verified, the duplicate email is
         deleted and this one is created. If the duplicate is already verified,
-        an DuplicateEmailException is thrown."""
-        duplicate_email_query = Email.query.filter_by(email=email)
-        duplicate_email = duplicate_email_query.first()
-        if duplicate_email:
-            if duplicate_email.verified:
-                raise DuplicateEmailError('This email has already been claimed'
-                                          ' by another account.')
-            else:
-                # Delete unverified duplicate emails.
-                duplicate_email.delete()
+        an DuplicateEmailException is thrown.
+
+        Pass check_duplicates=False when the duplicates have already been
+        resolved with `claim_duplicates`."""
+        if check_duplicates:
+            Email.claim_duplicates([email])
         super().__init__(email=email, **kwargs)
 
     def __str__(self):
@@ -323,23 +428,127 @@ class Email(BaseModel):
     def verification_token(self, expires_in=1209600):
         """Returns a signed email verification token that expires in
         'expires_in' seconds (defaults to 1209600 or 14 days)."""
-        return jwt_encode({'email': self.email,
-                           'user_id': self.user_id,
-                           'exp': time() + expires_in},
-                          current_app.config['SECRET_KEY'],
-                          algorithm='HS256').decode('utf-8')
+        return tokens.issue('email_verification',
+                            {'email': self.email, 'user_id': self.user_id},
+                            expires_in)
+
+    @staticmethod
+    def verification_tokens(emails, expires_in=1209600):
+        """Returns the verification tokens for a list of emails at once (for
+        mass mailings)."""
+        return tokens.issue_many('email_verification',
+                                 [{'email': email.email,
+                                   'user_id': email.user_id}
+                                  for email in emails], expires_in)
+
+    @staticmethod
+    def claim_duplicates(emails):
+        """Resolves duplicates of a list of emails with a single query. If any
+        of them has already been verified, a DuplicateEmailError is thrown.
+        Otherwise, the unverified duplicates are deleted."""
+        duplicates = Email.query.filter(Email.email.in_(emails)).all()
+        if any(duplicate.verified for duplicate in duplicates):
+            raise DuplicateEmailError('This email has already been claimed'
+                                      ' by another account.')
+        if duplicates:
+            for duplicate in duplicates:
+                session.delete(duplicate)
+            session.flush()
+
+    @staticmethod
+    def supports_upsert():
+        """Returns true if the database can atomically claim emails."""
+        dialect = session.get_bind(mapper=Email.__mapper__).dialect
+        if dialect.name == 'sqlite':
+            return dialect.dbapi.sqlite_version_info >= (3, 24, 0)
+        return dialect.name == 'mysql'
+
+    @staticmethod
+    def upsert(user_id, emails, verified=False):
+        """Atomically adds a list of emails to an existing user.
+
+        Emails that don't exist yet are inserted and unverified emails owned
+        by other users are reassigned to this user, all in one statement, so
+        concurrent claims of the same email cannot both succeed. If any of the
+        emails is verified and belongs to another user, a DuplicateEmailError
+        is thrown (and the transaction should be rolled back)."""
+        emails = list(OrderedDict.fromkeys(emails))
+        table = Email.__table__
+        owners = session.execute(
+            select([table.c.email, table.c.user_id, table.c.verified])
+                .where(table.c.email.in_(emails))).fetchall()
+        if any(owner.verified and owner.user_id != user_id
+               for owner in owners):
+            raise DuplicateEmailError('This email has already been claimed'
+                                      ' by another account.')
+
+        rows = [{'email': email, 'user_id': user_id, 'verified': verified}
+                for email in emails]
+        dialect = session.get_bind(mapper=Email.__mapper__).dialect.name
+        if dialect == 'mysql':
+            statement = mysql_insert(table)
+            statement = statement.on_duplicate_key_update(
+                user_id=func.if_(table.c.verified, table.c.user_id,
+                                 statement.inserted.user_id))
+        else:
+            statement = text(
+                'INSERT INTO emails (email, user_id, verified) '
+                'VALUES (:email, :user_id, :verified) '
+                'ON CONFLICT (email) DO UPDATE SET user_id = excluded.user_id '
+                'WHERE COALESCE(emails.verified, 0) = 0')
+        session.execute(statement, rows)
+
+        # A concurrent transaction may have verified one of the emails between
+        # the first query and the upsert.
+        claimed = session.execute(
+            select([func.count()]).where(and_(table.c.email.in_(emails),
+                                              table.c.user_id == user_id))
+        ).scalar()
+        if claimed != len(emails):
+            raise DuplicateEmailError('This email has already been claimed'
+                                      ' by another account.')
+
+        # Core statements don't go through the session, so expire anything it
+        # has loaded for the emails' previous owners.
+        for owner in owners:
+            if owner.user_id == user_id:
+                continue
+            stale_email = session.identity_map.get(
+                session.identity_key(Email, (owner.email, owner.user_id)))
+            if stale_email is not None:
+                session.expunge(stale_email)
+            previous_owner = session.identity_map.get(
+                session.identity_key(User, owner.user_id))
+            if previous_owner is not None:
+                session.expire(previous_owner, ['emails'])
+            _invalidate_cached_user(owner.user_id)
+        _invalidate_cached_user(user_id)
 
     @staticmethod
     def get_email_by_token(token):
         """Returns the email matching the verification token."""
-        try:
-            decoded_token = jwt_decode(token, current_app.config['SECRET_KEY'],
-                                       algorithms=['HS256'])
-            email = decoded_token['email']
-            user_id = decoded_token['user_id']
-        except:
+        claims = tokens.verify(token, 'email_verification')
+        if claims is None or 'email' not in claims or 'user_id' not in claims:
             return None
-        return Email.query.filter_by(email=email, user_id=user_id).first()
+        return Email.find(claims['email'], claims['user_id'])
+
+    @staticmethod
+    def find(email, user_id):
+        """Returns `user_id`'s Email for the `email` address (or None) using a
+        baked query."""
+        query = bakery(lambda session: session.query(Email)
+                       .filter(Email.email == bindparam('email'),
+                               Email.user_id == bindparam('user_id')))
+        return query(session()).params(email=email, user_id=user_id).first()
+
+    @staticmethod
+    def find_verified(email):
+        """Returns the Email for the `email` address if it is verified (or
+        None) using a baked query."""
+        query = bakery(lambda session: session.query(Email)
+                       .filter(Email.email == bindparam('email'),
+                               Email.verified == True))
+        return query(session()).params(email=email).first()
 
 event.listen(
     Email.__table__,
@@ -348,8 +557,28 @@ event.listen(
         CREATE TRIGGER enforce_email_immutability_on_update BEFORE UPDATE ON emails
             FOR EACH ROW
             BEGIN
-                IF NEW.email != OLD.email OR NEW.user_id != OLD.user_id
+                IF NEW.email != OLD.email OR
+                   (NEW.user_id != OLD.user_id AND OLD.verified = 1)
                 THEN
                     SIGNAL SQLSTATE '45000' SET message_text = 'Email is immutable and cannot be changed.';
                 END IF;
             END;""").execute_if(dialect='mysql'))
+
+
+def _is_duplicate_email(error):
+    """Returns true if the IntegrityError `error` was raised by the unique
+    index on emails.email (or the emails primary key)."""
+    orig = error.orig
+    diag = getattr(orig, 'diag', None)
+    if diag is not None:
+        # PostgreSQL names the violated constraint.
+        return diag.constraint_name in ('ix_emails_email', 'emails_pkey')
+    # SQLite: "UNIQUE constraint failed: emails.email", MySQL: "Duplicate entry
+    # '...' for key 'ix_emails_email'".
+    message = str(orig)
+    return 'emails.email' in message or 'ix_emails_email' in message
+
+
+def _invalidate_cached_user(user_id):
+    from .cache import invalidate_user
+    invalidate_user(user_id)
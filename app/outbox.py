@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.outbox
+~~~~~~~~~~
+
+The outbox worker for spa-base.
+
+Work that has to follow a committed change (such as mail) is added to the
+outbox in the same transaction as the change (see `app.models.OutboxMessage`)
+and delivered by `flask outbox worker`, so the request neither sends mail for
+a transaction that rolls back nor waits on the mail server. Each kind of
+message has a handler, registered with the `handler` decorator:
+
+    @handler('mail')
+    def deliver_mail(data):
+        ...
+
+The worker claims due messages in batches of OUTBOX_BATCH_SIZE. A message
+whose handler raises is retried with exponential backoff (OUTBOX_BACKOFF
+seconds, doubling up to OUTBOX_MAX_BACKOFF) and becomes a dead letter after
+OUTBOX_MAX_ATTEMPTS attempts. Dead letters stay in the outbox until they are
+retried with `flask outbox retry`.
+
+Handlers share the worker's session, and each runs in a savepoint: a handler
+that fails on the database only rolls back its own changes, and the rest of
+the batch is still committed.
+"""
+
+from collections import namedtuple
+from time import sleep
+
+from flask import current_app
+
+from app.mail import send_mail
+from app.models import OutboxMessage, session
+
+
+handlers = {}
+
+
+class BatchStats(namedtuple('BatchStats', 'delivered retried dead')):
+    """The counts of messages handled in a batch."""
+
+    def __len__(self):
+        return self.delivered + self.retried + self.dead
+
+
+def handler(kind):
+    """Registers a function that delivers the data of `kind` messages."""
+    def decorator(fn):
+        handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def backoff(attempts, base, maximum):
+    """Returns the seconds to wait before trying a message again."""
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+def enqueue_mail(subject, sender, recipients, text_body, html_body):
+    """Adds a mail to the outbox, to be sent once the transaction commits."""
+    return OutboxMessage.enqueue('mail', {
+        'subject': subject,
+        'sender': sender,
+        'recipients': recipients,
+        'text_body': text_body,
+        'html_body': html_body,
+    })
+
+
+@handler('mail')
+def deliver_mail(data):
+    send_mail(data['subject'], sender=data['sender'],
+              recipients=data['recipients'], text_body=data['text_body'],
+              html_body=data['html_body'], send_async=False)
+
+
+def process_batch(batch_size=None):
+    """Claims and delivers a batch of due messages. Returns the BatchStats."""
+    config = current_app.config
+    messages = OutboxMessage.claim(batch_size or config['OUTBOX_BATCH_SIZE'],
+                                   lease=config['OUTBOX_LEASE'])
+    delivered = retried = dead = 0
+    for message in messages:
+        try:
+            with session.begin_nested():
+                handlers[message.kind](message.data)
+        except Exception as error:
+            current_app.logger.exception('Failed to deliver %r.', message)
+            if message.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+                message.failed(repr(error))
+                dead += 1
+            else:
+                message.failed(repr(error), retry_in=backoff(
+                    message.attempts, config['OUTBOX_BACKOFF'],
+                    config['OUTBOX_MAX_BACKOFF']))
+                retried += 1
+        else:
+            message.delivered()
+            delivered += 1
+    session.commit()
+    return BatchStats(delivered, retried, dead)
+
+
+def run_worker(poll_interval=None, once=False):
+    """Delivers messages until interrupted, waiting `poll_interval` seconds
+    whenever the outbox is empty. With `once`, stops when it is empty."""
+    poll_interval = poll_interval or current_app.config['OUTBOX_POLL_INTERVAL']
+    while True:
+        stats = process_batch()
+        if stats:
+            current_app.logger.info('Outbox batch: %s', stats)
+        elif once:
+            return
+        else:
+            sleep(poll_interval)
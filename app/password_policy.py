@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.password_policy
+~~~~~~~~~~~~~~~~~~~
+
+The password hash policy for spa-base.
+
+A policy is a hash method and its cost:
+
+* `pbkdf2:sha256` (or any other hashlib digest), where the cost is the number
+  of iterations, or
+* `scrypt`, where the cost is N (a power of two; r=8 and p=1). scrypt requires
+  a Python built against OpenSSL 1.1+.
+
+Hashes are stored in werkzeug's `method$salt$hash` format, with the cost as
+part of the method (`pbkdf2:sha256:150000$...` or `scrypt:16384:8:1$...`), so
+hashes made under an older policy can still be checked and can be recognized
+as outdated. `flask auth calibrate` picks a cost for a target hash time on the
+current host.
+"""
+
+import hashlib
+import hmac
+from secrets import token_hex
+from time import perf_counter
+
+from werkzeug.security import (
+    check_password_hash as check_werkzeug_hash,
+    gen_salt,
+)
+
+
+METHODS = ('pbkdf2:sha256', 'pbkdf2:sha512', 'scrypt')
+SCRYPT_AVAILABLE = hasattr(hashlib, 'scrypt')
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+class HashPolicy(object):
+    """A password hash method and its cost."""
+
+    def __init__(self, method='pbkdf2:sha256', cost=150000, salt_length=16):
+        if method not in METHODS:
+            raise ValueError('Unknown password hash method "{}".'.format(method))
+        if method == 'scrypt':
+            if not SCRYPT_AVAILABLE:
+                raise ValueError('scrypt is not available in this Python.')
+            if cost < 2 or cost & (cost - 1):
+                raise ValueError('The scrypt cost must be a power of two.')
+        self.method = method
+        self.cost = cost
+        self.salt_length = salt_length
+        self._decoy_hash = None
+
+    def __repr__(self):
+        return '<HashPolicy {}>'.format(self.method_string)
+
+    @property
+    def method_string(self):
+        """The method as it is stored at the start of a hash."""
+        if self.method == 'scrypt':
+            return 'scrypt:{}:{}:{}'.format(self.cost, SCRYPT_R, SCRYPT_P)
+        return '{}:{}'.format(self.method, self.cost)
+
+    @property
+    def decoy_hash(self):
+        """A hash of a random password at the policy's cost, for equalizing the
+        time taken to reject unknown users."""
+        if self._decoy_hash is None:
+            self._decoy_hash = generate_password_hash(token_hex(16), self)
+        return self._decoy_hash
+
+    def needs_rehash(self, password_hash):
+        """Returns True if `password_hash` was made under a different
+        policy."""
+        return password_hash.split('$', 1)[0] != self.method_string
+
+
+def generate_password_hash(password, policy):
+    """Hashes `password` according to `policy`."""
+    salt = gen_salt(policy.salt_length)
+    return '{}${}${}'.format(policy.method_string, salt,
+                             _hash(policy.method_string, salt, password))
+
+
+def check_password_hash(password_hash, password):
+    """Returns True if `password` matches `password_hash`, whatever policy it
+    was made under."""
+    if not password_hash.startswith('scrypt:'):
+        return check_werkzeug_hash(password_hash, password)
+    if password_hash.count('$') != 2:
+        return False
+    method_string, salt, hashval = password_hash.split('$')
+    return hmac.compare_digest(_hash(method_string, salt, password), hashval)
+
+
+def _hash(method_string, salt, password):
+    method, *params = method_string.split(':')
+    if method == 'scrypt':
+        n, r, p = (int(param) for param in params)
+        return hashlib.scrypt(password.encode('utf-8'),
+                              salt=salt.encode('utf-8'), n=n, r=r, p=p,
+                              maxmem=2 * 128 * n * r * p).hex()
+    return hashlib.pbkdf2_hmac(params[0], password.encode('utf-8'),
+                               salt.encode('utf-8'), int(params[1])).hex()
+
+
+def time_hash(policy, repeat=3):
+    """Returns the best of `repeat` times to hash a password under
+    `policy`."""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        generate_password_hash('password123', policy)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def calibrate(method, target, max_cost=None):
+    """Returns the policy for `method` whose hash time is closest to (without
+    going much over) `target` seconds on this host.
+
+    PBKDF2's time grows linearly with its iterations, so they are scaled from
+    a short trial. scrypt's N must be a power of two, so it is doubled until
+    the target is reached."""
+    if method == 'scrypt':
+        cost = 2 ** 10
+        while (max_cost is None or cost * 2 <= max_cost) and \
+                time_hash(HashPolicy(method, cost * 2)) <= target:
+            cost *= 2
+        return HashPolicy(method, cost)
+    trial = 10000
+    cost = int(trial * target / time_hash(HashPolicy(method, trial)))
+    cost = max(cost // 1000 * 1000, 1000)
+    return HashPolicy(method, min(cost, max_cost) if max_cost else cost)
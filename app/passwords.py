@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.passwords
+~~~~~~~~~~~~~
+
+The password hashing executor for spa-base.
+
+Hashing a password is deliberately slow. Done inline it holds the GIL (or the
+gevent hub) for tens of milliseconds, stalling every other request on the
+worker. Instead, hashes are computed in a small process pool.
+
+The pool is bounded: at most PASSWORD_HASH_WORKERS hashes run at once and at
+most PASSWORD_HASH_QUEUE more wait for a worker. A request that can't get a
+place in the queue within PASSWORD_HASH_TIMEOUT seconds raises
+PasswordHasherBusy, which is answered with a 503, rather than piling up more
+work on an overloaded worker. Setting PASSWORD_HASH_WORKERS to 0 hashes inline
+(used when testing).
+
+The pool is created lazily in each process, so it is never shared across a
+gunicorn fork. A pool that breaks (because a worker died) is replaced, and the
+hash is tried once more.
+
+New hashes are made under the configured `HashPolicy` (PASSWORD_HASH_METHOD
+and PASSWORD_HASH_COST, see `app.password_policy`).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from .password_policy import (
+    check_password_hash,
+    generate_password_hash,
+    HashPolicy,
+)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _timed(fn, *args):
+    """Runs `fn` and returns its result and how long it took."""
+    start = perf_counter()
+    result = fn(*args)
+    return result, perf_counter() - start
+
+
+class PasswordHasher(object):
+    """Hashes and checks passwords in a bounded process pool, keeping
+    statistics on how long requests wait for a worker versus hashing."""
+
+    def __init__(self, workers=0, queue_size=32, timeout=5.0, policy=None):
+        # Requests hash from several threads, so the counters have a lock of
+        # their own (the executor's lock is held while it shuts down).
+        self._stats_lock = Lock()
+        self.configure(workers, queue_size, timeout, policy)
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+
+    def configure(self, workers, queue_size, timeout, policy=None):
+        self.policy = policy or HashPolicy()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(max(workers, 1) + queue_size)
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        with self._stats_lock:
+            self.hashes = 0
+            self.rejected = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.total_hash_time = 0.0
+            self.max_hash_time = 0.0
+
+    def hash(self, password):
+        """Returns a hash of `password` under the current policy."""
+        return self._run(generate_password_hash, password, self.policy)
+
+    def check(self, password_hash, password):
+        """Returns True if `password` matches `password_hash`."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def check_decoy(self, password):
+        """Checks `password` against the policy's decoy hash, taking as long
+        as checking a real user's password would."""
+        self.check(self.policy.decoy_hash, password)
+        return False
+
+    def needs_rehash(self, password_hash):
+        """Returns True if `password_hash` wasn't made under the current
+        policy."""
+        return self.policy.needs_rehash(password_hash)
+
+    def statistics(self):
+        """Returns a dict of the hasher's settings and counters."""
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'policy': self.policy.method_string,
+                'hashes': self.hashes,
+                'rejected': self.rejected,
+                'average_wait': self.total_wait / self.hashes
+                                if self.hashes else 0.0,
+                'max_wait': self.max_wait,
+                'average_hash_time': self.total_hash_time / self.hashes
+                                     if self.hashes else 0.0,
+                'max_hash_time': self.max_hash_time,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def _run(self, fn, *args):
+        start = perf_counter()
+        if not self.workers:
+            self._acquire_slot(start)
+            try:
+                result, hash_time = _timed(fn, *args)
+            finally:
+                self._slots.release()
+        else:
+            result, hash_time = self._run_in_pool(start, fn, *args)
+        self._record(perf_counter() - start - hash_time, hash_time)
+        return result
+
+    def _acquire_slot(self, start):
+        remaining = max(self.timeout - (perf_counter() - start), 0)
+        if not self._slots.acquire(timeout=remaining):
+            self._reject()
+            raise PasswordHasherBusy('Too many passwords are waiting to be '
+                                     'hashed.')
+
+    def _run_in_pool(self, start, fn, *args):
+        for attempt in range(2):
+            self._acquire_slot(start)
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_timed, fn, *args)
+            except BrokenProcessPool:
+                self._slots.release()
+                self._discard_executor(executor)
+                continue
+            # A running hash can't be cancelled, so its slot is only released
+            # when it finishes, even if the caller has stopped waiting.
+            future.add_done_callback(lambda future: self._slots.release())
+            remaining = max(self.timeout - (perf_counter() - start), 0)
+            try:
+                return future.result(timeout=remaining)
+            except TimeoutError:
+                future.cancel()
+                self._reject()
+                raise PasswordHasherBusy('Timed out waiting for a password '
+                                         'to be hashed.')
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+        self._reject()
+        raise PasswordHasherBusy('The password hashing workers keep dying.')
+
+    def _reject(self):
+        with self._stats_lock:
+            self.rejected += 1
+
+    def _record(self, wait, hash_time):
+        with self._stats_lock:
+            self.hashes += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_hash_time += hash_time
+            self.max_hash_time = max(self.max_hash_time, hash_time)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    hasher.shutdown()
+    hasher.configure(workers=app.config['PASSWORD_HASH_WORKERS'],
+                     queue_size=app.config['PASSWORD_HASH_QUEUE'],
+                     timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+                     policy=HashPolicy(app.config['PASSWORD_HASH_METHOD'],
+                                       app.config['PASSWORD_HASH_COST']))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.ratelimit
+~~~~~~~~~~~~~
+
+The rate limiter for spa-base.
+
+Routes are limited with the `rate_limit` decorator, which names a limit in the
+config (such as `'10/minute'`) and a key function that picks what is being
+limited:
+
+    @blueprint.route('/login/', methods=['GET', 'POST'])
+    @rate_limit('RATELIMIT_AUTH_PER_IP', by_ip)
+    @rate_limit('RATELIMIT_AUTH_PER_ACCOUNT', by_email)
+    def login():
+        ...
+
+Limits are enforced with GCRA (the generic cell rate algorithm, a token bucket
+that only needs to store one timestamp per key), so a limit of `10/minute`
+allows a burst of 10 and then one more every 6 seconds. Requests over the limit
+raise RateLimitExceeded, which is answered with a 429, before the view does
+any hashing or database work.
+
+The state lives in a SQLite database (RATELIMIT_STORAGE_PATH, see `app.sqlite`),
+so it is shared by all of the gunicorn workers on a host. Only the methods
+given to the decorator are limited (POST by default), so merely showing a form
+is never counted. When behind a reverse proxy, make sure `request.remote_addr` is
+the client's address (see werkzeug's ProxyFix).
+"""
+
+from collections import namedtuple
+from functools import wraps
+from threading import Lock
+from time import time
+
+from flask import current_app, request, session as flask_session
+
+from .sqlite import SharedDatabase
+
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Rate limit exceeded, retry after {:.0f} '
+                         'seconds.'.format(retry_after))
+        self.retry_after = retry_after
+
+
+class Limit(namedtuple('Limit', 'count period')):
+    """`count` requests per `period` seconds."""
+
+    @classmethod
+    def parse(cls, text):
+        """Parses a limit such as `'10/minute'` or `'3/hour'`."""
+        count, period = text.split('/')
+        return cls(int(count), PERIODS[period.strip().rstrip('s')])
+
+    @property
+    def interval(self):
+        return self.period / self.count
+
+
+def gcra(tat, now, limit):
+    """Applies GCRA to a key whose theoretical arrival time is `tat` (None if
+    it has no state). Returns the new tat, or None and the number of seconds to
+    wait if the request is over the limit."""
+    tat = max(tat or now, now)
+    allow_at = tat + limit.interval - limit.period
+    if now < allow_at:
+        return None, allow_at - now
+    return tat + limit.interval, 0
+
+
+class MemoryStore(object):
+    """A per-process store (for testing)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = Lock()
+
+    def hit(self, key, limit, now):
+        with self._lock:
+            tat, retry_after = gcra(self._data.get(key), now, limit)
+            if tat is not None:
+                self._data[key] = tat
+            return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteStore(object):
+    """A store in a SQLite database file that can be shared between
+    processes."""
+
+    prune_every = 1000
+
+    def __init__(self, path):
+        self.database = SharedDatabase(path, schema=[
+            'CREATE TABLE IF NOT EXISTS rate_limits '
+            '(key TEXT PRIMARY KEY, tat REAL NOT NULL)'])
+        self._hits = 0
+
+    def hit(self, key, limit, now):
+        connection = self.database.connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT tat FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            tat, retry_after = gcra(row and row[0], now, limit)
+            if tat is not None:
+                connection.execute(
+                    'INSERT OR REPLACE INTO rate_limits (key, tat) '
+                    'VALUES (?, ?)', (key, tat))
+        self._hits += 1
+        if self._hits % self.prune_every == 0:
+            self.prune(now)
+        return retry_after
+
+    def prune(self, now=None):
+        """Deletes the keys that are back to a full bucket."""
+        with self.database.connection() as connection:
+            connection.execute('DELETE FROM rate_limits WHERE tat < ?',
+                               (now or time(),))
+
+    def clear(self):
+        with self.database.connection() as connection:
+            connection.execute('DELETE FROM rate_limits')
+
+
+class RateLimiter(object):
+    """Checks requests against limits kept in a store."""
+
+    def __init__(self, store=None, enabled=True):
+        self.store = store or MemoryStore()
+        self.enabled = enabled
+
+    def hit(self, key, limit, now=None):
+        """Counts a request against `key`. Raises RateLimitExceeded if it is
+        over `limit`."""
+        if not self.enabled:
+            return
+        retry_after = self.store.hit(key, limit, now or time())
+        if retry_after:
+            raise RateLimitExceeded(retry_after)
+
+
+limiter = RateLimiter()
+
+
+def by_ip():
+    """Limits by the client's IP address."""
+    return request.remote_addr
+
+
+def by_email():
+    """Limits by the email address submitted with the form."""
+    email = request.form.get('email', '').strip().lower()
+    return email or None
+
+
+def by_user():
+    """Limits by the logged in user's id (without loading the user)."""
+    return flask_session.get('user_id')
+
+
+def rate_limit(config_key, key_func=by_ip, methods=('POST',)):
+    """A route decorator that limits requests to the limit in
+    `config[config_key]` for each value of `key_func()`. Requests where
+    `key_func` returns None aren't limited."""
+    def decorator(view):
+        @wraps(view)
+        def decorated_view(*args, **kwargs):
+            if request.method in methods:
+                key = key_func()
+                if key is not None:
+                    limiter.hit('{}:{}:{}'.format(request.endpoint,
+                                                  key_func.__name__, key),
+                                Limit.parse(current_app.config[config_key]))
+            return view(*args, **kwargs)
+        return decorated_view
+    return decorator
+
+
+def init_app(app):
+    limiter.enabled = app.config['RATELIMIT_ENABLED']
+    path = app.config['RATELIMIT_STORAGE_PATH']
+    limiter.store = SQLiteStore(path) if path else MemoryStore()
@@ -7,14 +7,26 @@ app.routes
 The main routes for spa-base.
 """
 
-from flask import render_template
+from flask import g, render_template
 from flask_login import login_required
 from .models import db
+from .passwords import PasswordHasherBusy
+from .ratelimit import RateLimitExceeded
 
 
 def init_app(app):
     """Initializes routes for spa-base."""
 
+    @app.after_request
+    def no_transform_csrf_pages(response):
+        """Keeps pages with a CSRF token from being compressed (by the
+        CompressionMiddleware or a proxy), which would expose the token to
+        BREACH."""
+        if app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g:
+            response.cache_control.no_transform = True
+        return response
+
+
     @app.route('/')
     @app.route('/<path:path>')
     @login_required
@@ -27,6 +39,17 @@ def init_app(app):
         return render_template('404.html'), 404
 
 
+    @app.errorhandler(RateLimitExceeded)
+    def too_many_requests_error(error):
+        return render_template('429.html'), 429, \
+            {'Retry-After': str(int(error.retry_after) + 1)}
+
+
+    @app.errorhandler(PasswordHasherBusy)
+    def busy_error(error):
+        return render_template('503.html'), 503, {'Retry-After': '1'}
+
+
     @app.errorhandler(500)
     def internal_error(error):
         db.session.rollback()
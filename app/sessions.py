@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.sessions
+~~~~~~~~~~~~
+
+The optional server-side session store for spa-base.
+
+By default, flask keeps the session in a signed cookie, which is serialized
+and signed again on every response that touches it. When SESSION_STORE is set,
+the session is kept on the server instead and the cookie only holds an opaque,
+random session id:
+
+* `sqlite` keeps sessions in a SQLite file (SESSION_STORE_PATH) shared by the
+  workers on a host (see `app.sqlite`).
+* Any other value is the import path of a `SessionStore` subclass (for a
+  networked store such as redis), which is created with the app.
+
+Sessions are loaded lazily: a request that never reads the session never
+touches the store. A session is only written back when it has been modified,
+or when a permanent session is over halfway to expiring. The store only ever
+sees a hash of the session id, so its contents can't be used to hijack a
+session. Stale sessions are deleted in bulk by `flask sessions expire` (and
+every now and then when a session is written).
+
+The session moves to a new id whenever a user logs in or out, so an id that
+was planted in (or read from) a browser before then is of no use afterwards.
+"""
+
+from abc import ABC, abstractmethod
+from hashlib import sha256
+from random import random
+from secrets import token_urlsafe
+from time import time
+
+from flask import session as current_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from flask_login import user_logged_in, user_logged_out
+from werkzeug.utils import import_string
+
+from .sqlite import SharedDatabase
+
+
+class SessionStore(ABC):
+    """The interface of a server-side session store. Keys are hashed session
+    ids, values are serialized session data and expiries are unix times."""
+
+    def __init__(self, app):
+        pass
+
+    @abstractmethod
+    def load(self, key):
+        """Returns the (data, expires) of an unexpired session, or None."""
+
+    @abstractmethod
+    def save(self, key, data, expires):
+        """Stores a session's data until it expires."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Deletes a session, if there is one."""
+
+    @abstractmethod
+    def expire(self, now=None):
+        """Deletes every expired session and returns how many there were."""
+
+
+class SQLiteSessionStore(SessionStore):
+    """Keeps sessions in a SQLite file shared by the workers on a host."""
+
+    def __init__(self, app):
+        self.database = SharedDatabase(app.config['SESSION_STORE_PATH'], [
+            'CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, '
+            'data BLOB NOT NULL, expires REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS ix_sessions_expires '
+            'ON sessions (expires)'])
+
+    def load(self, key):
+        row = self.database.connection().execute(
+            'SELECT data, expires FROM sessions WHERE key = ? AND expires > ?',
+            (key, time())).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, key, data, expires):
+        self.database.connection().execute(
+            'INSERT OR REPLACE INTO sessions (key, data, expires) '
+            'VALUES (?, ?, ?)', (key, data, expires))
+
+    def delete(self, key):
+        self.database.connection().execute(
+            'DELETE FROM sessions WHERE key = ?', (key,))
+
+    def expire(self, now=None):
+        return self.database.connection().execute(
+            'DELETE FROM sessions WHERE expires <= ?',
+            (now or time(),)).rowcount
+
+
+class ServerSideSession(SessionMixin):
+    """A session whose data is only loaded from the store when it is first
+    used."""
+
+    def __init__(self, sid=None, loader=None):
+        self.sid = sid
+        self.previous_sid = None
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.expires = None
+        self._loader = loader
+        self._data = None if sid else {}
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            self._data, self.expires = self._loader(self.sid)
+            if self.expires is None:
+                # An unknown (or expired) id is never reused, so a session id
+                # can't be planted in someone's browser.
+                self.new = True
+        return self._data
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def regenerate(self):
+        """Moves the session's data to a new id when it is saved."""
+        # Load the data first, which finds out whether the id is known.
+        self.data
+        if not self.new:
+            self.previous_sid = self.sid
+        self.new = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        if self.data:
+            self.data.clear()
+            self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps the session in a `SessionStore`, identified by an opaque cookie."""
+
+    serializer = TaggedJSONSerializer()
+    expire_chance = 0.001
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            return ServerSideSession()
+        return ServerSideSession(sid, self._load)
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.loaded:
+            return
+        if session.previous_sid:
+            self.store.delete(self._key(session.previous_sid))
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(self._key(session.sid))
+            if session.modified and (not session.new or session.previous_sid):
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=self.get_cookie_domain(app),
+                                       path=self.get_cookie_path(app))
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        refresh = session.permanent and session.expires is not None and \
+            session.expires - time() < lifetime / 2
+        if not session.modified and not refresh:
+            return
+        if session.new:
+            session.sid = token_urlsafe(32)
+        self.store.save(self._key(session.sid),
+                        self.serializer.dumps(dict(session)),
+                        time() + lifetime)
+        if random() < self.expire_chance:
+            self.store.expire()
+        if session.new or session.permanent:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=self.get_cookie_domain(app),
+                                path=self.get_cookie_path(app),
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+    def _load(self, sid):
+        """Loads a session's data (an unknown or expired session is empty)."""
+        stored = self.store.load(self._key(sid))
+        if stored is None:
+            return {}, None
+        data, expires = stored
+        return self.serializer.loads(data), expires
+
+    @staticmethod
+    def _key(sid):
+        return sha256(sid.encode('utf-8')).hexdigest()
+
+
+def create_store(app):
+    store = app.config['SESSION_STORE']
+    if store == 'sqlite':
+        return SQLiteSessionStore(app)
+    return import_string(store)(app)
+
+
+def regenerate_session(sender, **extra):
+    if isinstance(current_session._get_current_object(), ServerSideSession):
+        current_session.regenerate()
+
+
+def init_app(app):
+    if app.config['SESSION_STORE']:
+        app.session_interface = ServerSideSessionInterface(create_store(app))
+        user_logged_in.connect(regenerate_session, app)
+        user_logged_out.connect(regenerate_session, app)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.smtp
+~~~~~~~~
+
+A pool of SMTP connections for spa-base.
+
+Flask-Mail's `mail.send` opens (and authenticates, and negotiates TLS on) a
+new connection for every message, which takes far longer than sending the
+message itself. The pool keeps up to MAIL_POOL_SIZE connections (opened with
+Flask-Mail's `mail.connect()`) open between messages and hands them out to the
+mail workers. A connection that has been idle for more than
+MAIL_POOL_IDLE_TIMEOUT seconds is closed rather than reused, since mail servers
+drop idle clients. `send_many` sends a batch of messages over one connection.
+
+A connection that fails while sending is thrown away and the message is sent
+again over a new connection, so a connection dropped by the server is never
+noticed by the caller. Setting MAIL_POOL_SIZE to 0 opens a connection per
+message, as Flask-Mail does.
+"""
+
+import os
+import smtplib
+import socket
+from threading import Lock
+from time import monotonic
+
+
+# Errors that mean the connection is unusable, rather than the message being
+# refused.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError,
+                     socket.timeout)
+
+
+def _close(connection):
+    try:
+        connection.__exit__(None, None, None)
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+class SMTPPool(object):
+    """Keeps authenticated SMTP connections open between messages."""
+
+    def __init__(self, mail, size=2, idle_timeout=30.0):
+        self.mail = mail
+        self._lock = Lock()
+        self._idle = []
+        self._pid = None
+        self.configure(size, idle_timeout)
+
+    def configure(self, size, idle_timeout):
+        self.close()
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        with self._lock:
+            self.connects = 0
+            self.reconnects = 0
+            self.sent = 0
+
+    def send(self, message):
+        """Sends a message over a pooled connection."""
+        self.send_many([message])
+
+    def send_many(self, messages):
+        """Sends messages over one connection, reconnecting if it fails."""
+        connection = self._acquire()
+        try:
+            for message in messages:
+                try:
+                    connection.send(message)
+                except CONNECTION_ERRORS:
+                    _close(connection)
+                    self._count('reconnects')
+                    connection = self._open()
+                    connection.send(message)
+                self._count('sent')
+        except Exception:
+            _close(connection)
+            raise
+        self._release(connection)
+
+    def statistics(self):
+        """Returns a dict of the pool's state and counters."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'connects': self.connects,
+                'reconnects': self.reconnects,
+                'sent': self.sent,
+            }
+
+    def close(self):
+        """Closes all of the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            owned = self._pid == os.getpid()
+        if owned:
+            for connection, _ in idle:
+                _close(connection)
+
+    def _count(self, counter):
+        # Each mail worker sends over its own connection, so the counters are
+        # updated from several threads at once.
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _open(self):
+        self._count('connects')
+        return self.mail.connect().__enter__()
+
+    def _acquire(self):
+        stale = []
+        with self._lock:
+            # Connections opened before a fork belong to the parent.
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if monotonic() - released_at < self.idle_timeout:
+                    break
+                stale.append(connection)
+            else:
+                connection = None
+        for old in stale:
+            _close(old)
+        return connection or self._open()
+
+    def _release(self, connection):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append((connection, monotonic()))
+                return
+        _close(connection)
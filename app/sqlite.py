@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.sqlite
+~~~~~~~~~~
+
+A SQLite database file shared by all of the worker processes on a host.
+
+The rate limiter and the server-side session store keep small amounts of hot
+state that every gunicorn worker needs to see. Rather than running another
+server, they keep it in a SQLite file in WAL mode (readers never block the
+writer) that is memory mapped, so reads are served straight from the page
+cache.
+"""
+
+import os
+import sqlite3
+from threading import local
+
+
+class SharedDatabase(object):
+    """A SQLite database file with one connection per thread and process.
+
+    `schema` is a list of statements run (idempotently) whenever a connection
+    is opened."""
+
+    def __init__(self, path, schema=(), mmap_size=16 * 1024 * 1024):
+        self.path = path
+        self.schema = schema
+        self.mmap_size = mmap_size
+        self._local = local()
+
+    def connection(self):
+        """Returns this thread's connection, in autocommit mode."""
+        # sqlite connections can't be shared between threads or a fork.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA mmap_size={:d}'.format(self.mmap_size))
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
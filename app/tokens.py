@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+app.tokens
+~~~~~~~~~~
+
+The signed token service for spa-base.
+
+Every token the app hands out (password reset links, email verification links)
+is a JWT issued and verified here. Each token carries a `purpose` claim, so a
+token issued for one purpose can't be used for another.
+
+Signing keys are set with TOKEN_KEYS (a comma separated list, defaulting to
+SECRET_KEY). New tokens are signed with the first key and name it in their
+`kid` header; any of the keys is accepted when verifying. To rotate keys, put
+the new key first and drop the old one once its tokens have expired.
+
+Verified tokens are kept in a small LRU (TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL) so
+a link that is clicked again (or prefetched by a mail scanner) isn't decoded
+again. Single-use tokens get a random `jti` that is recorded in the
+used_tokens table when the token is consumed (see `app.models.UsedToken`).
+"""
+
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+import hmac
+import json
+from secrets import token_hex
+from time import time
+
+import jwt
+
+from .cache import LRUCache
+
+
+def _kid(key):
+    return sha256(key.encode('utf-8')).hexdigest()[:8]
+
+
+def _b64(data):
+    return urlsafe_b64encode(data).rstrip(b'=')
+
+
+class TokenService(object):
+    """Issues and verifies signed tokens."""
+
+    algorithm = 'HS256'
+
+    def __init__(self, keys=(), cache_size=1024, cache_ttl=300):
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self.configure(keys)
+
+    def configure(self, keys, cache_size=None, cache_ttl=None):
+        """Sets the signing keys. The first key signs new tokens."""
+        self.keys = [(_kid(key), key) for key in keys]
+        self.cache.configure(cache_size, cache_ttl)
+        self.cache.clear()
+
+    def issue(self, purpose, claims, expires_in, single_use=False):
+        """Returns a token for `purpose` carrying `claims` that expires in
+        `expires_in` seconds."""
+        kid, key = self.keys[0]
+        return jwt.encode(self._payload(purpose, claims, expires_in,
+                                        single_use),
+                          key, algorithm=self.algorithm,
+                          headers={'kid': kid}).decode('utf-8')
+
+    def issue_many(self, purpose, claims_list, expires_in, single_use=False):
+        """Returns a token for each of `claims_list`. The header and the keyed
+        hash are only prepared once, so this is much faster than calling
+        `issue` for every recipient of a mass mailing."""
+        kid, key = self.keys[0]
+        header = _b64(json.dumps({'alg': self.algorithm, 'kid': kid,
+                                  'typ': 'JWT'},
+                                 separators=(',', ':')).encode('utf-8'))
+        mac = hmac.new(key.encode('utf-8'), digestmod=sha256)
+        tokens = []
+        for claims in claims_list:
+            payload = _b64(json.dumps(
+                self._payload(purpose, claims, expires_in, single_use),
+                separators=(',', ':')).encode('utf-8'))
+            signing_input = header + b'.' + payload
+            signature = mac.copy()
+            signature.update(signing_input)
+            tokens.append((signing_input + b'.' +
+                           _b64(signature.digest())).decode('utf-8'))
+        return tokens
+
+    def verify(self, token, purpose):
+        """Returns the claims of a valid, unexpired token for `purpose` (or
+        None)."""
+        claims = self.cache.get(token)
+        if claims is None:
+            claims = self._decode(token)
+            if claims is None:
+                return None
+            self.cache.set(token, claims)
+        if claims.get('purpose', purpose) != purpose or \
+                claims.get('exp', 0) <= time():
+            return None
+        return claims
+
+    def consume(self, token, purpose):
+        """Verifies a single-use token and records it as used. Returns its
+        claims, or None if it is invalid or was already used."""
+        from app.models import UsedToken
+
+        claims = self.verify(token, purpose)
+        if claims is None or 'jti' not in claims or \
+                not UsedToken.use(claims['jti'], claims['exp']):
+            return None
+        self.cache.pop(token)
+        return claims
+
+    def _payload(self, purpose, claims, expires_in, single_use):
+        payload = dict(claims, purpose=purpose, exp=int(time() + expires_in))
+        if single_use:
+            payload['jti'] = token_hex(16)
+        return payload
+
+    def _decode(self, token):
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except jwt.InvalidTokenError:
+            return None
+        # Tokens issued before key rotation have no kid; try every key.
+        keys = [key for key_kid, key in self.keys if kid in (None, key_kid)]
+        for key in keys:
+            try:
+                return jwt.decode(token, key, algorithms=[self.algorithm])
+            except jwt.InvalidSignatureError:
+                continue
+            except jwt.InvalidTokenError:
+                return None
+        return None
+
+
+tokens = TokenService()
+
+
+def init_app(app):
+    tokens.configure(app.config['TOKEN_KEYS'] or [app.config['SECRET_KEY']],
+                     cache_size=app.config['TOKEN_CACHE_SIZE'],
+                     cache_ttl=app.config['TOKEN_CACHE_TTL'])
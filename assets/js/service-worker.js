@@ -0,0 +1,56 @@
+/**
+ * SPA Base Service Worker
+ */
+
+importScripts('https://cdn.onesignal.com/sdks/OneSignalSDKWorker.js');
+
+// Generated by `flask build` from assets/js/service-worker.js, with the
+// fingerprinted assets in the asset manifest. Edit the source, not the copy in
+// htdocs.
+var version = {{ version|tojson }};
+
+// Offline cache name
+var cache_name = 'spa_base-' + version;
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        // Offline Caching
+        caches.open(cache_name).then(function(cache) {
+            return cache.addAll([
+                '/',
+                '/login/',
+                '/manifest.webmanifest',
+                'https://fonts.googleapis.com/css?family=Libre+Franklin:400,400i,700',
+                'https://fonts.googleapis.com/css?family=Libre+Baskerville:400,400i,700',
+            {%- for asset in assets %}
+                {{ asset|tojson }},
+            {%- endfor %}
+            ])
+            .then(function() { self.skipWaiting(); });
+        })
+    );
+});
+
+
+self.addEventListener('activate', function(event) {
+    // Drop the caches of previous versions.
+    return event.waitUntil(
+        caches.keys().then(function(names) {
+            return Promise.all(names.filter(function(name) {
+                return name.indexOf('spa_base-') === 0 && name !== cache_name;
+            }).map(function(name) { return caches.delete(name); }));
+        })
+        .then(function() { return self.clients.claim(); })
+    );
+});
+
+
+self.addEventListener('fetch', function(event) {
+    event.respondWith(
+        caches.open(cache_name)
+            .then(function(cache) { return cache.match(event.request, {ignoreSearch: true}); })
+            .then(function(response) {
+                return response || fetch(event.request);
+            })
+    );
+});
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.baked_queries
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compares the hot lookups (`load_user`, `Email.get_email_by_token`,
+`User.verify_password_reset_token` and `RegistrationForm.validate_email`) built
+as ad hoc ORM queries on every call against the baked query helpers that only
+build and compile them once. The table is kept small so the difference is the
+per-call Python overhead rather than the database.
+
+    python -m benchmarks.baked_queries --users 1000 --lookups 5000
+"""
+
+from random import randint
+
+import click
+from sqlalchemy.orm import joinedload
+
+from app.models import db, Email, User
+from .utilities import (
+    create_benchmark_app,
+    email_address,
+    populate_users,
+    print_table,
+    time_calls,
+)
+
+
+def ad_hoc_user(user_id):
+    return User.query.get(user_id)
+
+
+def ad_hoc_user_by_email(email):
+    return User.query.join(Email, Email.user_id == User.id) \
+                     .filter(Email.email == email) \
+                     .options(joinedload(User.emails)).one_or_none()
+
+
+def ad_hoc_email(email, user_id):
+    return Email.query.filter_by(email=email, user_id=user_id).first()
+
+
+def ad_hoc_verified_email(email):
+    return Email.query.filter_by(email=email, verified=True).first()
+
+
+@click.command()
+@click.option('--users', default=1000)
+@click.option('--lookups', default=5000, help='Lookups per query.')
+@click.option('--database-uri', default=None)
+def main(users, lookups, database_uri):
+    app = create_benchmark_app(database_uri)
+    with app.app_context():
+        db.create_all()
+        populate_users(db, users, verified=True)
+        ids = [randint(1, users) for _ in range(lookups)]
+        lookups = (
+            ('load_user', ((id,) for id in ids),
+             ad_hoc_user, User.get_by_id),
+            ('verify_password_reset_token',
+             ((email_address(id),) for id in ids),
+             ad_hoc_user_by_email, User.find_by_email),
+            ('get_email_by_token', ((email_address(id), id) for id in ids),
+             ad_hoc_email, Email.find),
+            ('validate_email', ((email_address(id),) for id in ids),
+             ad_hoc_verified_email, Email.find_verified),
+        )
+
+        rows = []
+        for name, args, ad_hoc, baked in lookups:
+            args = list(args)
+            timings = []
+            for fn in (ad_hoc, baked):
+                def lookup(*args):
+                    assert fn(*args) is not None
+                    db.session.remove()
+                # Warm up so the baked query is already in the cache.
+                lookup(*args[0])
+                timings.append(time_calls(lookup, args) * 1e6)
+            rows.append((name, '{:.1f}'.format(timings[0]),
+                         '{:.1f}'.format(timings[1]),
+                         '{:.0%}'.format(1 - timings[1] / timings[0])))
+        db.drop_all()
+    print_table(('lookup', 'ad hoc us', 'baked us', 'saved'), rows)
+
+
+if __name__ == '__main__':
+    main()
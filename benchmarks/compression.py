@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.compression
+~~~~~~~~~~~~~~~~~~~~~~
+
+Measures the cost of compressing our rendered pages with the compression
+middleware against the bytes it saves, for each gzip level (and brotli
+quality, when `brotli` is installed).
+
+    python -m benchmarks.compression --requests 200 --levels 1,6,9
+"""
+
+import click
+from flask import render_template
+
+from app.middleware import brotli, CompressionMiddleware
+from .utilities import create_benchmark_app, print_table, time_calls
+
+
+PAGES = ('/login/', '/register/', '/request_password_reset',
+         '/privacy-policy/', '/terms-and-conditions/', '/not-found/')
+
+
+def render_pages(app):
+    """Renders the SPA shell and each page in PAGES. Returns {name: body}."""
+    bodies = {}
+    with app.test_request_context():
+        bodies['index.html'] = render_template('index.html').encode('utf-8')
+    client = app.test_client()
+    for url in PAGES:
+        bodies[url] = client.get(url).data
+    return bodies
+
+
+def page_app(body):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+def serve(middleware, environ):
+    return b''.join(middleware(environ, lambda status, headers: None))
+
+
+def time_compression(body, encoding, requests, **options):
+    """Returns the median seconds to serve `body` compressed with `encoding`,
+    and the compressed size."""
+    middleware = CompressionMiddleware(page_app(body), **options)
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': encoding}
+    seconds = time_calls(serve, [(middleware, environ)] * requests)
+    return seconds, len(serve(middleware, environ))
+
+
+@click.command()
+@click.option('--requests', default=200)
+@click.option('--levels', default='1,6,9')
+@click.option('--qualities', default='1,4,11')
+def main(requests, levels, qualities):
+    app = create_benchmark_app()
+    bodies = render_pages(app)
+    settings = [('gzip', {'level': int(level)}, 'gzip -{}'.format(level))
+                for level in levels.split(',')]
+    if brotli:
+        settings += [('br', {'brotli_quality': int(quality)},
+                      'br -q{}'.format(quality))
+                     for quality in qualities.split(',')]
+    else:
+        print('brotli is not installed; only gzip is measured.')
+    rows = []
+    for name, body in sorted(bodies.items()):
+        for encoding, options, label in settings:
+            seconds, size = time_compression(body, encoding, requests,
+                                             **options)
+            rows.append((name, label, len(body), size,
+                         '{:.0%}'.format(1 - size / len(body)),
+                         '{:.1f}'.format(seconds * 1e6),
+                         '{:.0f}'.format((len(body) - size) / seconds / 2**20)))
+    print_table(('page', 'encoding', 'bytes', 'compressed', 'saved',
+                 'us/response', 'MB saved/cpu s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.find_by_email
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measures `User.find_by_email` latency as the users table grows. Because the
+lookup goes through the unique `ix_emails_email` index, the median latency
+should stay flat from a thousand to a million users.
+
+    python -m benchmarks.find_by_email --sizes 1000,10000,100000,1000000
+"""
+
+from random import randint
+
+import click
+
+from app.models import db, User
+from .utilities import (
+    create_benchmark_app,
+    email_address,
+    populate_users,
+    print_table,
+    time_calls,
+)
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,100000,1000000',
+              help='Comma separated user counts to measure at.')
+@click.option('--lookups', default=2000, help='Lookups per size.')
+@click.option('--database-uri', default=None)
+def main(sizes, lookups, database_uri):
+    app = create_benchmark_app(database_uri)
+    rows = []
+    with app.app_context():
+        db.create_all()
+        populated = 0
+        for size in sorted(int(size) for size in sizes.split(',')):
+            populate_users(db, size - populated, start=populated)
+            populated = size
+
+            def lookup(email):
+                assert User.find_by_email(email) is not None
+                db.session.remove()
+
+            emails = [(email_address(randint(1, size)),)
+                      for _ in range(lookups)]
+            rows.append((size, '{:.1f}'.format(time_calls(lookup, emails) * 1e6)))
+        db.drop_all()
+    print_table(('users', 'median us'), rows)
+
+
+if __name__ == '__main__':
+    main()
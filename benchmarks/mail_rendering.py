@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.mail_rendering
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compares rendering the email verification mail with `render_template` (twice
+per message, once for each body) against `MailTemplate.render` and
+`MailTemplate.render_many`, and the static email not found mail against its
+memoized bodies.
+
+    python -m benchmarks.mail_rendering --messages 5000
+"""
+
+from collections import namedtuple
+from time import perf_counter
+
+import click
+from flask import render_template
+
+from app.blueprints.auth.mail import EMAIL_NOT_FOUND, EMAIL_VERIFICATION
+from .utilities import create_benchmark_app, print_table
+
+
+Recipient = namedtuple('Recipient', 'first_name')
+
+
+def render_template_pair(contexts):
+    for context in contexts:
+        render_template('auth/email/email_verification.txt', **context)
+        render_template('auth/email/email_verification.html', **context)
+
+
+def render_one_by_one(contexts):
+    for context in contexts:
+        EMAIL_VERIFICATION.render(**context)
+
+
+def render_many(contexts):
+    for _ in EMAIL_VERIFICATION.render_many(contexts):
+        pass
+
+
+def render_not_found_template_pair(contexts):
+    for _ in contexts:
+        render_template('auth/email/email_not_found.txt')
+        render_template('auth/email/email_not_found.html')
+
+
+def render_not_found_memoized(contexts):
+    for _ in contexts:
+        EMAIL_NOT_FOUND.render()
+
+
+@click.command()
+@click.option('--messages', default=5000)
+def main(messages):
+    app = create_benchmark_app()
+    contexts = [{'user': Recipient('User {}'.format(n)),
+                 'token': 'token-{}'.format(n)} for n in range(messages)]
+    rows = []
+    with app.test_request_context():
+        for name, render in (
+                ('verification, render_template', render_template_pair),
+                ('verification, MailTemplate.render', render_one_by_one),
+                ('verification, MailTemplate.render_many', render_many),
+                ('not found, render_template', render_not_found_template_pair),
+                ('not found, memoized', render_not_found_memoized)):
+            start = perf_counter()
+            render(contexts)
+            rows.append((name, '{:.0f}'.format(
+                messages / (perf_counter() - start))))
+    print_table(('renderer', 'messages/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.primary_email
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compares building a page of users sorted by primary email by hydrating every
+user and their emails in python against using the `User.primary_email` SQL
+expression.
+
+    python -m benchmarks.primary_email --users 10000 --emails-per-user 20
+"""
+
+import click
+from sqlalchemy.orm import joinedload
+
+from app.models import db, User
+from .utilities import (
+    create_benchmark_app,
+    populate_users,
+    print_table,
+    time_calls,
+)
+
+
+@click.command()
+@click.option('--users', default=10000)
+@click.option('--emails-per-user', default=20)
+@click.option('--page-size', default=50)
+@click.option('--repeat', default=5)
+@click.option('--database-uri', default=None)
+def main(users, emails_per_user, page_size, repeat, database_uri):
+    app = create_benchmark_app(database_uri)
+    with app.app_context():
+        db.create_all()
+        populate_users(db, users, emails_per_user=emails_per_user)
+
+        def hydrated_page():
+            everyone = User.query.options(joinedload(User.emails)).all()
+            page = sorted(everyone, key=lambda user: str(user.primary_email))
+            result = [(user.id, str(user.primary_email))
+                      for user in page[:page_size]]
+            db.session.remove()
+            return result
+
+        def sql_page():
+            result = db.session.query(User.id, User.primary_email) \
+                               .order_by(User.primary_email) \
+                               .limit(page_size).all()
+            db.session.remove()
+            return result
+
+        assert hydrated_page() == [tuple(row) for row in sql_page()]
+        rows = [(name, '{:.1f}'.format(time_calls(fn, [()] * repeat) * 1e3))
+                for name, fn in (('hydrated', hydrated_page),
+                                 ('sql expression', sql_page))]
+        db.drop_all()
+    print('{} users with {} emails each'.format(users, emails_per_user))
+    print_table(('strategy', 'median ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
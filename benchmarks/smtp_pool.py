@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.smtp_pool
+~~~~~~~~~~~~~~~~~~~~
+
+Compares the mail throughput of opening a connection per message (as
+Flask-Mail's `mail.send` does) against sending over pooled connections, one
+message at a time and in batches. Mail is sent to a local SMTP server that adds
+`--latency` seconds to every new connection to stand in for the TCP, TLS and
+authentication round trips of a real mail server.
+
+    python -m benchmarks.smtp_pool --messages 200 --latency 0.05
+"""
+
+from time import perf_counter
+
+import click
+from flask_mail import Message
+
+from app.mail import mail, send_message, send_messages, smtp_pool
+from tests.utilities.smtp import LocalSMTPServer
+from .utilities import create_benchmark_app, print_table
+
+
+def messages(count):
+    return [Message('Message {}'.format(n), sender='app@example.com',
+                    recipients=['user{}@example.com'.format(n)],
+                    body='Hello') for n in range(count)]
+
+
+def one_by_one(msgs):
+    for msg in msgs:
+        send_message(msg)
+
+
+@click.command()
+@click.option('--messages', 'count', default=200)
+@click.option('--latency', default=0.05,
+              help='Seconds added to every new connection.')
+@click.option('--batch-size', default=50)
+def main(count, latency, batch_size):
+    rows = []
+    with LocalSMTPServer(latency=latency) as server:
+        app = create_benchmark_app(MAIL_SERVER='127.0.0.1',
+                                   MAIL_PORT=server.port, MAIL_USE_TLS=False,
+                                   MAIL_USERNAME=None,
+                                   MAIL_SUPPRESS_SEND=False)
+        with app.app_context():
+            runs = (
+                ('connection per message', 0, one_by_one),
+                ('pooled', 1, one_by_one),
+                ('pooled, batches of {}'.format(batch_size), 1,
+                 lambda msgs: [send_messages(msgs[n:n + batch_size])
+                               for n in range(0, len(msgs), batch_size)]),
+            )
+            for name, pool_size, send in runs:
+                smtp_pool.configure(size=pool_size, idle_timeout=30)
+                connections = server.connections
+                msgs = messages(count)
+                start = perf_counter()
+                send(msgs)
+                elapsed = perf_counter() - start
+                rows.append((name, server.connections - connections,
+                             '{:.1f}'.format(count / elapsed)))
+            smtp_pool.close()
+    print_table(('transport', 'connections', 'messages/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
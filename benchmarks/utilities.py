@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.utilities
+~~~~~~~~~~~~~~~~~~~~
+
+Helper functions for the spa-base benchmarks.
+
+Benchmarks are plain scripts that are run as modules from the project root,
+for example:
+
+    python -m benchmarks.find_by_email --sizes 1000,1000000
+"""
+
+from statistics import median
+from tempfile import mkstemp
+from time import perf_counter
+
+from app import create_app
+from app.config import TestingConfig
+
+
+# A precomputed hash so populating users doesn't spend its time hashing.
+PASSWORD_HASH = 'pbkdf2:sha256:50000$benchmrk$' + '0' * 64
+
+
+def create_benchmark_app(database_uri=None, **config):
+    """Creates an app backed by a throwaway sqlite file (or `database_uri`)."""
+    if not database_uri:
+        database_uri = 'sqlite:///' + mkstemp(suffix='.db')[1]
+    config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    return create_app(type('BenchmarkConfig', (TestingConfig,), config))
+
+
+def populate_users(db, count, start=0, emails_per_user=1, verified=False,
+                   chunk_size=10000):
+    """Bulk inserts `count` users (each with `emails_per_user` emails) using
+    core inserts. Users are numbered from `start` so a table can be grown in
+    steps."""
+    from app.models import Email, User
+
+    for offset in range(start, start + count, chunk_size):
+        ids = range(offset + 1, min(offset + chunk_size, start + count) + 1)
+        db.session.execute(User.__table__.insert(), [
+            {'id': id, 'password_hash': PASSWORD_HASH, 'first_name': 'User',
+             'last_name': str(id), 'active': True} for id in ids])
+        db.session.execute(Email.__table__.insert(), [
+            {'email': email_address(id, n), 'user_id': id,
+             'verified': verified} for id in ids
+            for n in range(emails_per_user)])
+        db.session.commit()
+
+
+def email_address(user_id, n=0):
+    """The email address populate_users gives a user's `n`th email."""
+    return 'user{}.{}@example.com'.format(user_id, n)
+
+
+def time_calls(fn, args_list):
+    """Calls `fn` once per item in `args_list` and returns the median call time
+    in seconds."""
+    timings = []
+    for args in args_list:
+        start = perf_counter()
+        fn(*args)
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def print_table(headers, rows):
+    """Prints the results of a benchmark as an aligned table."""
+    widths = [max(len(str(value)) for value in column)
+              for column in zip(headers, *rows)]
+    for row in [headers] + list(rows):
+        print('  '.join(str(value).rjust(width)
+                        for value, width in zip(row, widths)))
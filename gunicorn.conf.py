@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+"""
+gunicorn.conf.py
+~~~~~~~~~~~~~~~~
+
+The gunicorn config for spa-base.
+
+    gunicorn -c gunicorn.conf.py wsgi_app:app
+
+WEB_CONCURRENCY and WEB_THREADS are also read by `app.config.Config` so that
+each worker's database pool is sized to match.
+"""
+
+from os import environ
+
+
+bind = environ.get('GUNICORN_BIND', 'localhost:8000')
+workers = int(environ.get('WEB_CONCURRENCY', 4))
+threads = int(environ.get('WEB_THREADS', 1))
+preload_app = environ.get('GUNICORN_PRELOAD', 'false').lower() in ['true', 'yes']
+
+
+def post_fork(server, worker):
+    """Makes sure a worker never reuses database connections opened by the
+    master before it forked (only possible with preload_app)."""
+    from app.models import reset_engines
+    reset_engines()
+
+
+def worker_exit(server, worker):
+    """Sends any mail still queued before a worker exits."""
+    from app.mail import dispatcher
+    dispatcher.shutdown()
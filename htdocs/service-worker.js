@@ -4,7 +4,10 @@
 
 importScripts('https://cdn.onesignal.com/sdks/OneSignalSDKWorker.js');
 
-var version = 0.1;
+// Generated by `flask build` from assets/js/service-worker.js, with the
+// fingerprinted assets in the asset manifest. Edit the source, not the copy in
+// htdocs.
+var version = "bf21a9e8fb";
 
 // Offline cache name
 var cache_name = 'spa_base-' + version;
@@ -15,14 +18,8 @@ self.addEventListener('install', function(event) {
         caches.open(cache_name).then(function(cache) {
             return cache.addAll([
                 '/',
-                '/css/app.css',
-                '/css/auth.css',
-                '/icons/logo-32x32.png',
-                '/icons/zondicons.svg',
-                '/js/show-password.js',
                 '/login/',
                 '/manifest.webmanifest',
-                '/service-worker.js',
                 'https://fonts.googleapis.com/css?family=Libre+Franklin:400,400i,700',
                 'https://fonts.googleapis.com/css?family=Libre+Baskerville:400,400i,700',
             ])
@@ -33,7 +30,15 @@ self.addEventListener('install', function(event) {
 
 
 self.addEventListener('activate', function(event) {
-    return event.waitUntil(self.clients.claim());
+    // Drop the caches of previous versions.
+    return event.waitUntil(
+        caches.keys().then(function(names) {
+            return Promise.all(names.filter(function(name) {
+                return name.indexOf('spa_base-') === 0 && name !== cache_name;
+            }).map(function(name) { return caches.delete(name); }));
+        })
+        .then(function() { return self.clients.claim(); })
+    );
 });
 
 
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+"""
+adds emails user_id index
+~~~~~~~~~~~~~~~~~~~~~~
+
+Revision ID: 5b2e7c41d9a3
+Revises: 197c3ef71f00
+Create Date: 2026-10-18 09:12:04.318207
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e7c41d9a3'
+down_revision = '197c3ef71f00'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_emails_user_id'), 'emails', ['user_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_emails_user_id'), table_name='emails')
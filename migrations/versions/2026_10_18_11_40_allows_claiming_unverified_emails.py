@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+allows claiming unverified emails
+~~~~~~~~~~~~~~~~~~~~~~
+
+Revision ID: 8f3a1d6c2e47
+Revises: 5b2e7c41d9a3
+Create Date: 2026-10-18 11:40:52.904116
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a1d6c2e47'
+down_revision = '5b2e7c41d9a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'mysql':
+        return
+
+    connection.execute("DROP TRIGGER IF EXISTS enforce_email_immutability_on_update")
+    connection.execute("""
+        CREATE TRIGGER enforce_email_immutability_on_update BEFORE UPDATE ON emails
+            FOR EACH ROW
+            BEGIN
+                IF NEW.email != OLD.email OR
+                   (NEW.user_id != OLD.user_id AND OLD.verified = 1)
+                THEN
+                    SIGNAL SQLSTATE '45000' SET message_text = 'Email is immutable and cannot be changed.';
+                END IF;
+            END;
+    """)
+
+
+def downgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'mysql':
+        return
+
+    connection.execute("DROP TRIGGER IF EXISTS enforce_email_immutability_on_update")
+    connection.execute("""
+        CREATE TRIGGER enforce_email_immutability_on_update BEFORE UPDATE ON emails
+            FOR EACH ROW
+            BEGIN
+                IF NEW.email != OLD.email OR NEW.user_id != OLD.user_id
+                THEN
+                    SIGNAL SQLSTATE '45000' SET message_text = 'Email is immutable and cannot be changed.';
+                END IF;
+            END;
+    """)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+adds used tokens table
+~~~~~~~~~~~~~~~~~~~~~~
+
+Revision ID: 3c9e0b5a7f12
+Revises: 8f3a1d6c2e47
+Create Date: 2026-10-18 19:05:37.102934
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e0b5a7f12'
+down_revision = '8f3a1d6c2e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('used_tokens',
+        sa.Column('jti', sa.String(length=32), nullable=False),
+        sa.Column('expires_at', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_used_tokens_expires_at'), 'used_tokens',
+                    ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_used_tokens_expires_at'), table_name='used_tokens')
+    op.drop_table('used_tokens')
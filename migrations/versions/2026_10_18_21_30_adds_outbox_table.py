@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+adds outbox table
+~~~~~~~~~~~~~~~~~
+
+Revision ID: 6d2f8a4b1e90
+Revises: 3c9e0b5a7f12
+Create Date: 2026-10-18 21:30:12.480516
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f8a4b1e90'
+down_revision = '3c9e0b5a7f12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_status_available_at', 'outbox',
+                    ['status', 'available_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_status_available_at', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""
+widens password hash
+~~~~~~~~~~~~~~~~~~~~
+
+Revision ID: 9a4c7e2b5d18
+Revises: 6d2f8a4b1e90
+Create Date: 2026-10-19 10:15:27.316742
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c7e2b5d18'
+down_revision = '6d2f8a4b1e90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pbkdf2:sha512 and scrypt hashes are longer than 128 characters.
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password_hash',
+                              existing_type=sa.String(length=128),
+                              type_=sa.String(length=255),
+                              existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password_hash',
+                              existing_type=sa.String(length=255),
+                              type_=sa.String(length=128),
+                              existing_nullable=False)
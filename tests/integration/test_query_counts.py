@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.integration.test_query_counts
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Guards the number of SQL statements the busiest routes run.
+"""
+
+from flask import url_for
+import pytest
+
+from app.models import user_cache
+from tests.utilities.fixtures import app, client, db, session
+from tests.utilities.helpers import assert_max_queries, create_user
+
+
+@pytest.fixture(scope='function')
+def anonymous_client(client):
+    """The client, logged out and with an empty user cache."""
+    user_cache.clear()
+    with client.session_transaction() as flask_session:
+        flask_session.clear()
+    client.csrf_token = client.generate_csrf()
+    yield client
+
+
+def test_login_queries(session, anonymous_client):
+    """Logging in looks the user up with a single query."""
+    create_user(session, email='jane@example.com')
+
+    with assert_max_queries(1):
+        response = anonymous_client.login()
+
+    assert response.status_code == 302
+
+def test_register_queries(session, anonymous_client):
+    """Registering checks the email, inserts the user and upserts its email
+    (checking its owner before and after)."""
+    with assert_max_queries(5):
+        response = anonymous_client.post(url_for('auth.register'), data=dict(
+            email='john@example.com', password='password123',
+            confirm_password='password123', first_name='John',
+            last_name='Doe'))
+
+    assert response.status_code == 302
+
+def test_profile_queries(session, anonymous_client):
+    """Viewing a profile loads the current user and the profile's user."""
+    create_user(session, email='jane@example.com')
+    anonymous_client.login()
+
+    with assert_max_queries(3):
+        response = anonymous_client.get(url_for('profile.profile',
+                                                email='jane@example.com'))
+
+    assert response.status_code == 200
+
+def test_query_headers(app, session, anonymous_client):
+    """The query count and time headers are added when enabled."""
+    create_user(session, email='jane@example.com')
+    app.config['SQLALCHEMY_QUERY_HEADERS'] = True
+    try:
+        response = anonymous_client.login()
+    finally:
+        app.config['SQLALCHEMY_QUERY_HEADERS'] = False
+
+    assert response.headers['X-Query-Count'] == '1'
+    assert float(response.headers['X-Query-Time']) > 0
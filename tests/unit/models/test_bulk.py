@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_bulk
+~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for bulk user import and export.
+"""
+
+from io import StringIO
+import json
+
+import pytest
+
+from app.models import Email, User
+from app.models.bulk import (
+    export_users,
+    import_users,
+    read_records,
+    write_checkpoint,
+    write_records,
+)
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+HASH = 'pbkdf2:sha256:50000$salt$' + 'a' * 64
+
+
+def record(email, **kwargs):
+    record = {'email': email, 'first_name': 'Jane', 'last_name': 'Doe',
+              'password_hash': HASH}
+    record.update(kwargs)
+    return record
+
+
+def test_users_can_be_bulk_imported(session):
+    """Users can be bulk imported in chunks with pre-hashed passwords."""
+    # Given several records, one with a verified email
+    records = [record('jane1@example.com'),
+               record('jane2@example.com', verified=True),
+               record('jane3@example.com', password='password123',
+                      password_hash=None)]
+
+    # When they are imported
+    stats = import_users(records, chunk_size=2)
+
+    # Then every user should exist with the expected email and password
+    assert stats.imported == 3
+    jane1 = User.find_by_email('jane1@example.com')
+    assert jane1.password_hash == HASH
+    assert not jane1.is_confirmed
+    assert User.find_by_email('jane2@example.com').is_confirmed
+    assert User.find_by_email('jane3@example.com').check_password('password123')
+
+def test_bulk_import_skips_duplicate_and_invalid_records(session):
+    """A bulk import skips emails that already exist (in the chunk or the
+    database) and invalid records."""
+    # Given an existing user
+    create_user(session, email='jane@example.com')
+
+    # When importing records with duplicates and a missing name
+    stats = import_users([record('jane@example.com'),
+                          record('john@example.com'),
+                          record('john@example.com'),
+                          record('jim@example.com', first_name='')])
+
+    # Then only the new, valid user is imported
+    assert stats.imported == 1
+    assert stats.duplicates == 2
+    assert stats.invalid == 1
+    assert session.query(Email).filter_by(email='john@example.com').count() == 1
+
+def test_bulk_import_resumes_from_a_checkpoint(session, tmpdir):
+    """A bulk import resumes from where a previous run checkpointed."""
+    # Given a checkpoint saying two records were already imported
+    checkpoint = str(tmpdir.join('import.checkpoint'))
+    write_checkpoint(checkpoint, 2)
+
+    # When the import is run
+    stats = import_users([record('jane{}@example.com'.format(n))
+                          for n in range(4)], checkpoint=checkpoint)
+
+    # Then only the remaining records are imported and the checkpoint removed
+    assert stats.resumed_from == 2
+    assert stats.imported == 2
+    assert User.find_by_email('jane1@example.com') is None
+    assert User.find_by_email('jane3@example.com') is not None
+    assert not tmpdir.join('import.checkpoint').exists()
+
+@pytest.mark.parametrize('file_format', ['csv', 'ndjson'])
+def test_exported_users_can_be_read_back(session, file_format):
+    """Exported users can be read back in the same format."""
+    # Given a user with a verified primary email
+    user = create_user(session, emails=['jane1@example.com',
+                                        'jane2@example.com'])
+    user.emails[1].verify()
+    user.update(primary_email='jane2@example.com')
+
+    # When the users are exported
+    stream = StringIO()
+    write_records(stream, export_users(chunk_size=1), file_format)
+    stream.seek(0)
+
+    # Then the user's primary email and password hash are exported
+    records = list(read_records(stream, file_format))
+    assert len(records) == 1
+    assert records[0]['email'] == 'jane2@example.com'
+    assert records[0]['password_hash'] == user.password_hash
+
+    # And so are their other emails
+    emails = records[0]['emails']
+    if file_format == 'csv':
+        emails = json.loads(emails)
+    assert emails == [{'email': 'jane1@example.com', 'verified': False},
+                      {'email': 'jane@example.com', 'verified': False}]
+
+@pytest.mark.parametrize('file_format', ['csv', 'ndjson'])
+def test_other_emails_are_imported(session, file_format):
+    """A user's other emails (and whether they are verified) survive being
+    written and imported."""
+    # Given a record with other emails, written to a file
+    stream = StringIO()
+    write_records(stream, [record(
+        'jane1@example.com', verified=True, active=True,
+        emails=[{'email': 'jane2@example.com', 'verified': True},
+                {'email': 'jane3@example.com', 'verified': False}])],
+        file_format)
+    stream.seek(0)
+
+    # When it is imported
+    stats = import_users(read_records(stream, file_format))
+
+    # Then the user has all of their emails
+    assert stats.imported == 1
+    user = User.find_by_email('jane1@example.com')
+    assert [(email.email, email.verified) for email in user.emails] == \
+        [('jane1@example.com', True), ('jane2@example.com', True),
+         ('jane3@example.com', False)]
+    assert user.primary_email == 'jane1@example.com'
+
+def test_duplicate_other_emails_are_left_out(session):
+    """Another email that already exists is left out of the import, and a
+    record with malformed emails is invalid."""
+    # Given an existing user
+    create_user(session, email='jane@example.com')
+
+    # When importing a user with that email among their other emails
+    stats = import_users([
+        record('john@example.com', emails=['jane@example.com',
+                                           'john2@example.com']),
+        record('jim@example.com', emails=[{'verified': True}])])
+
+    # Then the user is imported without it
+    assert (stats.imported, stats.invalid) == (1, 1)
+    assert [email.email for email in
+            User.find_by_email('john@example.com').emails] == \
+        ['john2@example.com', 'john@example.com']
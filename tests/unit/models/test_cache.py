@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_cache
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the user identity cache.
+"""
+
+import pytest
+
+from app.models import load_user, user_cache
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+@pytest.fixture(scope='function')
+def cache(session):
+    user_cache.clear()
+    yield user_cache
+    user_cache.clear()
+
+
+def test_load_user_caches_users_between_requests(session, cache):
+    """A loaded user is cached and a later load does not query it again."""
+    # Given a user that has been loaded once
+    user = create_user(session, email='jane@example.com')
+    session.commit()
+    load_user(user.id)
+    assert cache.stats['misses'] == 1
+
+    # When the session is cleared (as it is between requests) and the user is
+    # loaded again
+    session.expunge_all()
+    cached_user = load_user(user.id)
+
+    # Then the user comes from the cache attached to the session
+    assert cache.stats['hits'] == 1
+    assert cached_user.id == user.id
+    assert cached_user.first_name == 'Jane'
+    assert cached_user in session
+
+def test_saving_a_user_invalidates_the_cache(session, cache):
+    """Saving a user evicts it from the cache."""
+    # Given a cached user
+    user = create_user(session, email='jane@example.com')
+    load_user(user.id)
+    assert user.id in cache
+
+    # When the user is updated
+    user.update(first_name='Janett')
+
+    # Then the user is no longer cached
+    assert user.id not in cache
+
+def test_saving_an_email_invalidates_its_user(session, cache):
+    """Saving a user's email evicts the user from the cache."""
+    # Given a cached user
+    user = create_user(session, email='jane@example.com')
+    load_user(user.id)
+
+    # When one of the user's emails is verified
+    user.emails[0].verify()
+
+    # Then the user is no longer cached
+    assert user.id not in cache
+
+def test_a_user_cached_before_a_commit_is_evicted_by_it(session, cache):
+    """A user cached between a flush and its commit is evicted again when the
+    transaction commits."""
+    # Given a user whose update has been flushed, but not committed
+    user = create_user(session, email='jane@example.com')
+    session.commit()
+    user.update(first_name='Janett')
+
+    # When the user is cached in the meantime (as another thread might)
+    cache.set(user.id, 'the committed user')
+
+    # Then committing the update evicts it
+    session.commit()
+    assert user.id not in cache
+
+def test_a_rollback_forgets_the_flushed_users(session, cache):
+    """Users flushed in a transaction that is rolled back are not evicted
+    by the next commit."""
+    # Given a flushed update that is rolled back
+    user = create_user(session, email='jane@example.com')
+    session.commit()
+    user_id = user.id
+    user.update(first_name='Janett')
+    session.rollback()
+
+    # When the user is cached and another transaction commits
+    cache.set(user_id, 'the committed user')
+    session.commit()
+
+    # Then the user is still cached
+    assert user_id in cache
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_outbox
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the outbox.
+"""
+
+from time import time
+
+from sqlalchemy.dialects import mysql, postgresql
+
+from app.models import OutboxMessage
+from tests.utilities.fixtures import app, db, session
+
+
+def test_due_messages_are_claimed_in_order(session):
+    """Claiming returns the due messages, oldest first, up to the batch
+    size."""
+    # Given three due messages and one that isn't due yet
+    for n in range(3):
+        OutboxMessage.enqueue('event', {'n': n})
+    OutboxMessage.enqueue('event', {'n': 3}, delay=60)
+
+    # When two are claimed
+    messages = OutboxMessage.claim(batch_size=2, lease=300)
+
+    # Then expect the first two, with an attempt recorded
+    assert [message.data['n'] for message in messages] == [0, 1]
+    assert [message.attempts for message in messages] == [1, 1]
+
+def test_claimed_messages_are_leased(session):
+    """A claimed message isn't claimed again until its lease runs out."""
+    # Given a claimed message
+    OutboxMessage.enqueue('event', {})
+    assert len(OutboxMessage.claim(batch_size=10, lease=300)) == 1
+
+    # Then expect it to only be claimed again once the lease has run out
+    assert OutboxMessage.claim(batch_size=10, lease=300) == []
+    messages = OutboxMessage.claim(batch_size=10, lease=300, now=time() + 301)
+    assert [message.attempts for message in messages] == [2]
+
+def test_dead_letters_can_be_retried(session):
+    """Dead letters aren't claimed until they are retried."""
+    # Given a dead letter
+    message = OutboxMessage.enqueue('event', {})
+    OutboxMessage.claim(batch_size=10, lease=0)
+    message.failed('Error')
+    session.commit()
+    assert OutboxMessage.dead_letters().all() == [message]
+    assert OutboxMessage.claim(batch_size=10, lease=0) == []
+
+    # When it is retried
+    assert OutboxMessage.retry_dead_letters() == 1
+
+    # Then expect it to be claimed again
+    assert [m.id for m in OutboxMessage.claim(batch_size=10, lease=0)] == \
+        [message.id]
+
+def test_due_messages_are_locked_and_skipped(app):
+    """On mysql and postgresql the due messages are selected FOR UPDATE SKIP
+    LOCKED, so workers skip each other's messages."""
+    # Given the claim query for each dialect
+    for dialect in (mysql.dialect(), postgresql.dialect()):
+        query = OutboxMessage.due(10, int(time()), dialect.name)
+
+        # Then expect it to lock the rows it selects, skipping locked ones
+        sql = str(query.statement.compile(dialect=dialect))
+        assert sql.rstrip().endswith('FOR UPDATE SKIP LOCKED')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_pool
+~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the database connection pool management.
+"""
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app.models.pool import derive_pool_size, TimedQueuePool
+
+
+@pytest.fixture(scope='function')
+def engine(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('pool.db')),
+                           poolclass=TimedQueuePool, pool_size=2,
+                           max_overflow=0, pool_timeout=0.01,
+                           pool_pre_ping=True)
+    yield engine
+    engine.dispose()
+
+
+def test_pool_size_matches_the_worker_threads():
+    """A worker's pool holds a connection per thread."""
+    assert derive_pool_size(workers=4, threads=8) == (8, 8)
+
+def test_pool_size_is_limited_by_the_database_connections():
+    """The workers share the database's maximum connections between them."""
+    assert derive_pool_size(workers=4, threads=8, max_connections=100) == (8, 17)
+    assert derive_pool_size(workers=4, threads=8, max_connections=20) == (5, 0)
+
+def test_pool_keeps_checkout_statistics(engine):
+    """A timed pool counts checkouts, timeouts and wait times."""
+    # Given two checked out connections from a pool of two
+    connections = [engine.connect(), engine.connect()]
+
+    # When a third connection is requested
+    # Then the checkout times out
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+
+    # And the pool's statistics reflect it
+    statistics = engine.pool.statistics()
+    assert statistics['checked_out'] == 2
+    assert statistics['checkouts'] == 3
+    assert statistics['timeouts'] == 1
+    assert statistics['max_wait'] >= 0.01
+    for connection in connections:
+        connection.close()
+
+def test_a_recreated_pool_keeps_its_settings(engine):
+    """Recreating a pool (as reset_engines does after a fork) keeps its
+    settings."""
+    engine.connect().close()
+
+    pool = engine.pool.recreate()
+
+    assert pool.size() == 2
+    assert pool._pre_ping
+    assert pool.checkedin() == 0
+
+def test_connections_from_another_process_are_replaced(engine, monkeypatch):
+    """A connection opened in another process is never checked out."""
+    # Given a pooled connection
+    connection = engine.connect()
+    dbapi_connection = connection.connection.connection
+    connection.close()
+
+    # When checking it out from a different process
+    monkeypatch.setattr('os.getpid', lambda: -1)
+    connection = engine.connect()
+
+    # Then a new connection is opened instead
+    assert connection.connection.connection is not dbapi_connection
+    connection.close()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_queries
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the per-request SQL query instrumentation.
+"""
+
+import logging
+
+from flask import g
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app.models import record_queries, User
+from app.models.queries import report_request_queries, start_request_recorder
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+def test_queries_are_counted_and_timed(session):
+    """Every statement run in the block is recorded."""
+    create_user(session, email='jane@example.com')
+
+    with record_queries() as queries:
+        User.find_by_email('jane@example.com')
+        User.find_by_email('john@example.com')
+
+    assert len(queries) == 2
+    assert queries.statements[0].startswith('SELECT users.id')
+    assert queries.total_time > 0
+
+def test_failed_queries_are_recorded(session):
+    """A statement that raises is recorded, and its timer is cleared."""
+    with record_queries() as queries:
+        with pytest.raises(OperationalError):
+            session.execute('SELECT * FROM no_such_table')
+
+    assert queries.statements == ['SELECT * FROM no_such_table']
+    assert session.connection().info['query_start'] == []
+
+def test_recorders_can_be_nested(session):
+    """Outer recorders see the statements of inner ones."""
+    with record_queries() as outer:
+        User.find_by_email('jane@example.com')
+        with record_queries() as inner:
+            User.find_by_email('jane@example.com')
+
+    assert len(outer) == 2
+    assert len(inner) == 1
+
+def test_repeated_statements_are_flagged(app, session, caplog):
+    """A statement run repeatedly in a request is logged as a probable N+1."""
+    with app.test_request_context('/users'):
+        # Given a request that runs the same query several times
+        start_request_recorder()
+        for n in range(3):
+            User.find_by_email('jane{}@example.com'.format(n))
+
+        # When the request finishes
+        with caplog.at_level(logging.WARNING):
+            report_request_queries(app.response_class())
+
+        # Then the repeated query is flagged
+        assert g.query_stats.repeated(3)[0][1] == 3
+        assert 'Probable N+1 query: GET /users ran this 3 times' in caplog.text
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_routing
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the read replica routing session. Two sqlite files stand in for
+the primary and the replica (nothing is replicated between them, which makes it
+easy to tell which one a query went to).
+"""
+
+from flask import session as flask_session
+import pytest
+
+from app.models import db, User
+from app.models.routing import PRIMARY_UNTIL_KEY
+from tests.utilities.helpers import create_user
+
+
+@pytest.fixture(scope='module')
+def replica_app(tmpdir_factory):
+    from app import create_app
+    from app.config import TestingConfig
+
+    directory = tmpdir_factory.mktemp('routing')
+    Config = type('ReplicaConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(directory.join('primary.db')),
+        'SQLALCHEMY_REPLICA_URIS': ['sqlite:///' + str(directory.join('replica.db'))],
+    })
+    app = create_app(Config)
+    with app.app_context():
+        db.create_all()
+        db.Model.metadata.create_all(db.get_engine(app, 'replica_0'))
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.Model.metadata.drop_all(db.get_engine(app, 'replica_0'))
+
+
+@pytest.fixture(scope='function')
+def request_ctx(replica_app):
+    # Other modules' session fixtures configure the session with a bind of
+    # their own; route through this app's engines instead.
+    options = dict(db.session.session_factory.kw)
+    db.session.remove()
+    db.session.session_factory.kw.pop('bind', None)
+    db.session.session_factory.kw.pop('binds', None)
+    ctx = replica_app.test_request_context()
+    ctx.push()
+    yield ctx
+    db.session.remove()
+    ctx.pop()
+    db.session.session_factory.kw.update(options)
+
+
+def replicate_user(app, **values):
+    """Inserts a user directly into the replica only."""
+    values.setdefault('password_hash', 'hash')
+    values.setdefault('last_name', 'Doe')
+    db.get_engine(app, 'replica_0').execute(User.__table__.insert(), **values)
+
+
+def test_reads_go_to_the_replica(replica_app, request_ctx):
+    """Plain reads are sent to the replica."""
+    # Given a user that only exists on the replica
+    replicate_user(replica_app, id=100, first_name='Replica')
+
+    # When the user is queried
+    # Then it is found
+    assert User.query.get(100).first_name == 'Replica'
+
+def test_reads_after_a_write_go_to_the_primary(replica_app, request_ctx):
+    """Once a session writes, its reads go to the primary."""
+    # Given a user that only exists on the replica
+    replicate_user(replica_app, id=200, first_name='Replica')
+
+    # When the session writes to the primary
+    user = create_user(db.session, email='jane@example.com')
+    db.session.commit()
+
+    # Then reads see the primary
+    assert User.query.get(200) is None
+    assert User.query.get(user.id).first_name == 'Jane'
+
+def test_a_user_sticks_to_the_primary_after_writing(replica_app, request_ctx):
+    """After writing, the user's next requests read from the primary until
+    the sticky window has passed."""
+    # Given a user that only exists on the replica and a write in an earlier
+    # session
+    replicate_user(replica_app, id=300, first_name='Replica')
+    create_user(db.session, email='john@example.com')
+    db.session.commit()
+    db.session.remove()
+
+    # When reading in a new session
+    # Then the primary is used
+    assert User.query.get(300) is None
+    db.session.remove()
+
+    # When the sticky window has passed
+    flask_session[PRIMARY_UNTIL_KEY] = 0
+
+    # Then the replica is used again
+    assert User.query.get(300).first_name == 'Replica'
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_session_commit
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the automatic end of request commit.
+"""
+
+from flask import g
+
+from app.models import User
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+def finish_request(app, status=200):
+    """Runs the after request hooks for an empty response."""
+    return app.process_response(app.response_class(status=status))
+
+
+def test_requests_that_never_use_the_session_skip_the_commit(app, db):
+    """A request that never touches the session doesn't commit."""
+    # Given a request that never used the session
+    db.session.remove()
+    with app.test_request_context():
+        # When the request finishes
+        finish_request(app)
+
+        # Then no commit was made and no session was created
+        assert g.transaction_stats['committed'] is False
+        assert not db.session.registry.has()
+
+def test_read_only_requests_skip_the_commit(app, session):
+    """A request that only reads doesn't commit."""
+    with app.test_request_context():
+        # Given a request that reads
+        session.query(User).all()
+
+        # When the request finishes
+        finish_request(app)
+
+        # Then no commit was made
+        assert g.transaction_stats['committed'] is False
+
+def test_requests_that_write_are_committed(app, session):
+    """A request with flushed or pending changes commits them."""
+    with app.test_request_context():
+        # Given a request that flushes a new user and changes it again
+        user = create_user(session, email='jane@example.com')
+        user.first_name = 'Janett'
+
+        # When the request finishes
+        finish_request(app)
+
+        # Then the changes were committed
+        assert g.transaction_stats['committed'] is True
+        assert g.transaction_stats['flushes'] == 2
+
+def test_failed_requests_are_not_committed(app, session):
+    """A request that fails doesn't commit."""
+    with app.test_request_context():
+        # Given a request that wrote, but failed
+        g.pop('transaction_stats', None)
+        create_user(session, email='jane@example.com')
+
+        # When the request finishes
+        finish_request(app, status=400)
+
+        # Then the commit was skipped
+        assert 'transaction_stats' not in g
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.models.test_token
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for single-use tokens.
+"""
+
+from time import time
+
+from app.models import Email, UsedToken, User
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+def test_a_token_can_only_be_used_once(session):
+    """A jti can only be recorded as used once."""
+    assert UsedToken.use('a' * 32, time() + 60)
+    assert not UsedToken.use('a' * 32, time() + 60)
+
+def test_expired_used_tokens_are_pruned(session):
+    """Used tokens are pruned once they expire."""
+    UsedToken.use('a' * 32, 1000)
+    UsedToken.use('b' * 32, time() + 60)
+
+    assert UsedToken.prune() == 1
+    assert [token.jti for token in UsedToken.query] == ['b' * 32]
+
+def test_a_password_reset_token_can_only_be_consumed_once(session):
+    """A password reset token stops working once it has been consumed."""
+    # Given a user's password reset token
+    user = create_user(session, email='jane@example.com')
+    token = user.password_reset_token
+
+    # When it is consumed
+    # Then it finds the user once, and not again
+    assert User.verify_password_reset_token(token) == user
+    assert User.verify_password_reset_token(token, consume=True) == user
+    assert User.verify_password_reset_token(token, consume=True) is None
+
+def test_verification_tokens_can_be_issued_in_bulk(session):
+    """Verification tokens for many emails can be issued at once."""
+    user = create_user(session, emails=['jane1@example.com',
+                                        'jane2@example.com'])
+
+    tokens = Email.verification_tokens(user.emails)
+
+    assert [Email.get_email_by_token(token) for token in tokens] == \
+        user.emails
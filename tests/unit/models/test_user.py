@@ -10,6 +10,7 @@ Unit tests for the user model.
 import pytest
 
 from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.security import generate_password_hash
 
 from app.models import (
     DuplicateEmailError,
@@ -17,6 +18,7 @@ from app.models import (
     IntegrityConstraintViolation,
     User
 )
+from app.passwords import hasher
 from tests.utilities.decorators import requires_mysql
 from tests.utilities.fixtures import app, db, session
 from tests.utilities.helpers import create_user
@@ -598,3 +600,186 @@ def test_user_can_generate_password_reset_token(app, session):
 
     # Then the user's email should be accessible.
     assert decoded_token['password_reset_for_email'] == 'jane@example.com'
+
+def test_a_user_can_be_found_by_any_of_their_emails(session):
+    """A user can be found by any one of their emails."""
+    # Given two users, one with several emails
+    user = create_user(session, emails=['jane1@example.com',
+                                        'jane2@example.com'])
+    create_user(session, email='john@example.com')
+
+    # When looking up the user by their second email
+    found_user = User.find_by_email('jane2@example.com')
+
+    # Then expect the owner of that email with their emails loaded
+    assert found_user == user
+    assert 'emails' in found_user.__dict__
+    assert User.find_by_email('nobody@example.com') is None
+
+def test_a_user_can_be_found_by_verified_email_only(session):
+    """A user can be found by only their verified emails."""
+    # Given a user with a verified and an unverified email
+    user = create_user(session, emails=['jane1@example.com',
+                                        'jane2@example.com'])
+    user.emails[0].verify()
+
+    # When looking up the user by verified email only
+    # Then only the verified email should find the user
+    assert User.find_by_verified_email('jane1@example.com') == user
+    assert User.find_by_verified_email('jane2@example.com') is None
+
+def test_a_user_can_claim_several_unverified_emails_at_once(session):
+    """A user can claim a list of other users' unverified emails at once."""
+    # Given a user with unverified emails and another user
+    user_1 = create_user(session, email=None, emails=['jane1@example.com',
+                                                      'jane2@example.com'])
+    user_2 = create_user(session, email='john@example.com')
+
+    # When the second user adds those emails and a new one
+    user_2.add_email(emails=['jane1@example.com', 'jane2@example.com',
+                             'john2@example.com'])
+    session.commit()
+
+    # Then the second user owns all of them
+    assert len(user_2.emails) == 4
+    assert len(user_1.emails) == 0
+    assert session.query(Email).filter_by(user_id=user_2.id).count() == 4
+
+def test_a_new_user_cannot_be_created_with_another_users_verified_email(session):
+    """A new user's list of emails cannot include another user's verified
+    email."""
+    # Given a user with a verified email
+    user = create_user(session, email='jane@example.com')
+    user.emails[0].verify()
+
+    # When a new user is saved with a list including that email
+    # Then expect a DuplicateEmailError
+    with pytest.raises(DuplicateEmailError):
+        User(first_name='John', last_name='Smith', password='password123',
+             emails=['john@example.com', 'jane@example.com']).save()
+
+def test_a_new_user_loses_a_race_for_a_verified_email(session):
+    """A new user whose email is registered and verified by another user
+    before the new user is saved gets a DuplicateEmailError."""
+    # Given a new user
+    user = User(first_name='John', last_name='Smith', password='password123',
+                email='jane@example.com')
+
+    # When another user registers and verifies the email first
+    jane = User(first_name='Jane', last_name='Doe', password='password123',
+                email='jane@example.com').save()
+    jane.emails[0].verify()
+
+    # Then expect saving the new user to throw a DuplicateEmailError
+    with pytest.raises(DuplicateEmailError):
+        user.save()
+
+def test_a_new_user_claims_an_email_registered_in_the_meantime(session):
+    """A new user takes an email another user registered (but didn't
+    verify) before the new user was saved."""
+    # Given a new user
+    user = User(first_name='John', last_name='Smith', password='password123',
+                email='jane@example.com')
+
+    # When another user registers the email first
+    jane = User(first_name='Jane', last_name='Doe', password='password123',
+                email='jane@example.com').save()
+
+    # Then expect the new user to claim it
+    user.save()
+    assert [str(email) for email in user.emails] == ['jane@example.com']
+    assert Email.query.filter_by(email='jane@example.com').one().user_id == \
+        user.id
+
+def test_a_new_user_loses_a_race_for_an_email_without_upserts(session,
+                                                            monkeypatch):
+    """Without upserts, a new user whose email is inserted by another user
+    before the new user is saved gets a DuplicateEmailError."""
+    monkeypatch.setattr(Email, 'supports_upsert', staticmethod(lambda: False))
+    # Given a new user whose email has been checked for duplicates
+    user = User(first_name='John', last_name='Smith', password='password123',
+                email='jane@example.com')
+
+    # When another user inserts the email first
+    create_user(session, email='jane@example.com')
+
+    # Then expect saving the new user to throw a DuplicateEmailError
+    with pytest.raises(DuplicateEmailError):
+        user.save()
+
+def test_primary_email_can_be_queried_in_sql(session):
+    """A user's primary email can be selected, filtered and sorted on in SQL
+    with the same fallbacks as the python property."""
+    # Given a user with a primary email, one with a verified email and one
+    # with no verified emails
+    user_1 = create_user(session, email=None, emails=['c1@example.com',
+                                                      'c2@example.com'])
+    user_1.emails[1].verify()
+    user_1.update(primary_email='c2@example.com')
+    user_2 = create_user(session, email=None, emails=['b1@example.com',
+                                                      'b2@example.com'])
+    user_2.emails[1].verify()
+    user_3 = create_user(session, email=None, emails=['a1@example.com',
+                                                      'a2@example.com'])
+
+    # When selecting users sorted by their primary email
+    rows = session.query(User.id, User.primary_email) \
+                  .order_by(User.primary_email).all()
+
+    # Then expect the same emails the python property returns
+    assert rows == [(user_3.id, 'a1@example.com'),
+                    (user_2.id, 'b2@example.com'),
+                    (user_1.id, 'c2@example.com')]
+    assert session.query(User).filter(
+        User.primary_email == 'b2@example.com').one() == user_2
+
+def test_primary_email_fallback_matches_in_python_and_sql(session):
+    """Without a primary email, python and SQL fall back to the same email,
+    whatever order the emails were added in."""
+    # Given a user whose emails were added out of address order
+    user = create_user(session, email=None, emails=['z@example.com',
+                                                    'a@example.com'])
+    session.expire(user)
+
+    # When their primary email is read in python and in SQL
+    in_sql = session.query(User.primary_email) \
+                    .filter(User.id == user.id).scalar()
+
+    # Then expect the same email
+    assert str(user.primary_email) == in_sql == 'a@example.com'
+
+def test_baked_lookups_find_users_and_emails(session):
+    """The baked lookup helpers find users and emails."""
+    # Given a user with a verified and an unverified email
+    user = create_user(session, emails=['jane1@example.com',
+                                        'jane2@example.com'])
+    user.emails[0].verify()
+
+    # Then the user can be found by id
+    assert User.get_by_id(user.id) == user
+    assert User.get_by_id(user.id + 1) is None
+
+    # And their emails can be found by address and owner
+    assert Email.find('jane2@example.com', user.id) == 'jane2@example.com'
+    assert Email.find('jane2@example.com', user.id + 1) is None
+
+    # And only the verified email is found as verified
+    assert Email.find_verified('jane1@example.com') == 'jane1@example.com'
+    assert Email.find_verified('jane2@example.com') is None
+
+def test_an_outdated_password_hash_is_upgraded_on_login(session):
+    """A password hashed under an old policy is rehashed when it's checked."""
+    # Given a user whose password was hashed with werkzeug's old default
+    user = create_user(session)
+    user.password_hash = generate_password_hash('password123')
+
+    # When the wrong password is checked
+    # Then the hash is left alone
+    assert not user.check_password('password321')
+    assert hasher.needs_rehash(user.password_hash)
+
+    # When the right password is checked
+    # Then it is rehashed under the current policy
+    assert user.check_password('password123')
+    assert not hasher.needs_rehash(user.password_hash)
+    assert user.check_password('password123')
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_assets
+~~~~~~~~~~~~~~~~~
+
+Unit tests for asset fingerprinting.
+"""
+
+import gzip
+import json
+import os
+
+from flask import render_template_string
+import pytest
+
+from app.assets import (
+    AssetManifest,
+    build_service_worker,
+    manifest_version,
+    unfingerprinted,
+    update_manifest,
+)
+from tests.utilities.fixtures import app
+
+
+@pytest.fixture
+def root(tmpdir):
+    tmpdir.mkdir('css').join('app.css').write('body {}\n')
+    tmpdir.join('css', 'auth.css').write('form {}\n')
+    return tmpdir
+
+
+def test_assets_are_fingerprinted(root):
+    """Built assets are copied to names with a hash of their content."""
+    # When built assets are fingerprinted
+    assets = update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # Then each has a hashed copy, recorded in the manifest
+    assert sorted(assets) == ['css/app.css', 'css/auth.css']
+    assert unfingerprinted(assets['css/app.css']) == 'css/app.css'
+    assert assets['css/app.css'] != 'css/app.css'
+    assert root.join(assets['css/app.css']).read() == 'body {}\n'
+    assert json.loads(root.join('assets.json').read()) == assets
+
+def test_changed_assets_keep_their_previous_copy(root):
+    """A changed asset gets a new name, and keeps its previous copy."""
+    # Given fingerprinted assets
+    before = update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # When one changes and they are fingerprinted again
+    root.join('css', 'app.css').write('body { margin: 0; }\n')
+    after = update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # Then only the changed one is renamed, and its old copy is kept
+    assert after['css/app.css'] != before['css/app.css']
+    assert after['css/auth.css'] == before['css/auth.css']
+    assert sorted(os.listdir(str(root.join('css')))) == sorted(
+        ['app.css', 'auth.css', before['css/app.css'][4:],
+         after['css/app.css'][4:], after['css/auth.css'][4:]])
+
+def test_older_copies_are_removed(root):
+    """Only the current and previous copies of an asset are kept."""
+    # Given an asset that was fingerprinted twice
+    first = update_manifest(str(root), 'assets.json', ['css/app.css'])
+    root.join('css', 'app.css').write('body { margin: 0; }\n')
+    second = update_manifest(str(root), 'assets.json', ['css/app.css'])
+
+    # When it changes again
+    root.join('css', 'app.css').write('body { margin: 1px; }\n')
+    third = update_manifest(str(root), 'assets.json', ['css/app.css'])
+
+    # Then its first copy is removed
+    assert not root.join(first['css/app.css']).exists()
+    assert root.join(second['css/app.css']).exists()
+    assert root.join(third['css/app.css']).exists()
+
+def test_missing_copies_are_dropped(root):
+    """Assets whose fingerprinted copy is gone are dropped."""
+    # Given fingerprinted assets
+    assets = update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # When a fingerprinted copy is removed and another build runs
+    root.join(assets['css/auth.css']).remove()
+    root.mkdir('js').join('app.js').write('app();\n')
+    assets = update_manifest(str(root), 'assets.json', ['js/*.js'])
+
+    # Then it is dropped from the manifest
+    assert sorted(assets) == ['css/app.css', 'js/app.js']
+
+def test_manifest_is_updated_by_each_build(root):
+    """Each build adds to the manifest without dropping other assets."""
+    # Given fingerprinted stylesheets
+    update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # When scripts are built and fingerprinted
+    root.mkdir('js').join('app.js').write('app();\n')
+    assets = update_manifest(str(root), 'assets.json', ['js/*.js'])
+
+    # Then the manifest has both
+    assert sorted(assets) == ['css/app.css', 'css/auth.css', 'js/app.js']
+
+def test_asset_manifest(root):
+    """Asset names resolve to their fingerprinted urls."""
+    # Given a manifest
+    assets = update_manifest(str(root), 'assets.json', ['css/*.css'])
+    manifest = AssetManifest(str(root.join('assets.json')))
+
+    # When asset urls are looked up
+    # Then they resolve through the manifest
+    assert manifest.url('css/app.css') == '/' + assets['css/app.css']
+    assert manifest.url('/css/app.css') == '/' + assets['css/app.css']
+    assert manifest.url('icons/logo.svg') == '/icons/logo.svg'
+
+def test_asset_manifest_is_cached(root):
+    """The manifest is read once, unless it is reloaded."""
+    # Given a cached and a reloading manifest
+    update_manifest(str(root), 'assets.json', ['css/*.css'])
+    cached = AssetManifest(str(root.join('assets.json')))
+    reloading = AssetManifest(str(root.join('assets.json')), reload=True)
+    cached.load()
+    reloading.load()
+
+    # When the manifest changes
+    root.join('assets.json').write('{"css/app.css": "css/app.0123456789.css"}')
+    os.utime(str(root.join('assets.json')), (1, 1))
+
+    # Then only the reloading manifest sees the change
+    assert cached.url('css/app.css') != '/css/app.0123456789.css'
+    assert reloading.url('css/app.css') == '/css/app.0123456789.css'
+
+def test_service_worker_precaches_the_manifest(root):
+    """The service worker precaches the assets in the manifest."""
+    # Given a manifest
+    assets = update_manifest(str(root), 'assets.json', ['css/*.css'])
+
+    # When the service worker is built
+    build_service_worker(str(root), assets)
+
+    # Then it precaches each asset, under a version for the manifest
+    service_worker = root.join('service-worker.js').read()
+    assert 'var version = "{}";'.format(manifest_version(assets)) in \
+        service_worker
+    for hashed in assets.values():
+        assert '"/{}",'.format(hashed) in service_worker
+    assert "'/login/'," in service_worker
+
+def test_asset_url_template_global(app):
+    """Templates link to assets with asset_url."""
+    # When a template links to an asset without an asset manifest
+    # Then it links to the asset itself
+    assert render_template_string("{{ asset_url('css/app.css') }}") == \
+        '/css/app.css'
+
+def test_text_assets_are_precompressed(root):
+    """Fingerprinted text assets are gzipped, and pruned with their copy."""
+    # Given a stylesheet worth compressing
+    root.join('css', 'app.css').write('body { margin: 0; }\n' * 100)
+
+    # When it is fingerprinted three times
+    first = update_manifest(str(root), 'assets.json', ['css/app.css'])
+    root.join('css', 'app.css').write('body { margin: 1px; }\n' * 100)
+    update_manifest(str(root), 'assets.json', ['css/app.css'])
+    root.join('css', 'app.css').write('body { margin: 2px; }\n' * 100)
+    third = update_manifest(str(root), 'assets.json', ['css/app.css'])
+
+    # Then the current copy has a gzipped copy next to it
+    hashed = root.join(third['css/app.css'])
+    assert gzip.decompress(root.join(third['css/app.css'] + '.gz')
+                           .read_binary()) == hashed.read_binary()
+
+    # And the first copy's is removed with it
+    assert not root.join(first['css/app.css'] + '.gz').exists()
+
+    # And assets too small to be worth it aren't compressed
+    assets = update_manifest(str(root), 'assets.json', ['css/auth.css'])
+    assert not root.join(assets['css/auth.css'] + '.gz').exists()
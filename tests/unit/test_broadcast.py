@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_broadcast
+~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for broadcast mail.
+"""
+
+from os import path
+
+import pytest
+
+from app import broadcast as broadcast_module
+from app.broadcast import broadcast, Pacer, read_checkpoint, recipients
+from app.mail import mail
+from app.mail_templates import MailTemplate
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+PRIVACY_POLICY = MailTemplate('mail/privacy_policy')
+
+
+@pytest.fixture(scope='function', autouse=True)
+def server_email(app):
+    original = app.config['SERVER_EMAIL']
+    app.config['SERVER_EMAIL'] = 'no-reply@example.com'
+    yield
+    app.config['SERVER_EMAIL'] = original
+
+
+@pytest.fixture(scope='function')
+def users(session):
+    users = [create_user(session, first_name=name,
+                         email='{}@example.com'.format(name.lower()))
+             for name in ('Ann', 'Bob', 'Cat', 'Dan', 'Eve', 'Fay')]
+    for user in users[:5]:
+        user.emails[0].verify()
+    users[3].active = False
+    session.flush()
+    return users
+
+
+def test_recipients_are_read_in_pages(users):
+    """Active users with a verified email are read a page at a time, in id
+    order."""
+    pages = list(recipients(chunk_size=2))
+
+    assert [[row.first_name for row in page] for page in pages] == \
+        [['Ann', 'Bob'], ['Cat', 'Eve']]
+    assert pages[0][0].primary_email == 'ann@example.com'
+
+def test_every_active_user_is_mailed(users, tmpdir):
+    """Each active user gets the rendered mail, and the checkpoint is removed
+    at the end."""
+    checkpoint = str(tmpdir.join('broadcast.checkpoint'))
+
+    with mail.record_messages() as outbox:
+        stats = broadcast(PRIVACY_POLICY, 'Privacy Policy', rate='1000/second',
+                          checkpoint=checkpoint, chunk_size=2)
+
+    assert stats == (4, 0, 0)
+    assert [msg.recipients for msg in outbox] == \
+        [['ann@example.com'], ['bob@example.com'], ['cat@example.com'],
+         ['eve@example.com']]
+    assert outbox[0].body.startswith('Ann,')
+    assert '/privacy-policy/' in outbox[0].html
+    assert not path.exists(checkpoint)
+
+def test_a_broadcast_resumes_after_a_crash(users, tmpdir, monkeypatch):
+    """A broadcast that is run again resumes after the last user mailed."""
+    checkpoint = str(tmpdir.join('broadcast.checkpoint'))
+
+    # Given a broadcast that crashes after two messages
+    sent = []
+    def send_twice(msg):
+        if len(sent) == 2:
+            raise ConnectionError('Crashed')
+        sent.append(msg)
+    monkeypatch.setattr(broadcast_module, 'send_message', send_twice)
+    with pytest.raises(ConnectionError):
+        broadcast(PRIVACY_POLICY, 'Privacy Policy', rate='1000/second',
+                  checkpoint=checkpoint)
+    assert read_checkpoint(checkpoint) == users[1].id
+    monkeypatch.undo()
+
+    # When it is run again
+    with mail.record_messages() as outbox:
+        stats = broadcast(PRIVACY_POLICY, 'Privacy Policy', rate='1000/second',
+                          checkpoint=checkpoint)
+
+    # Then expect only the users that weren't mailed to get it
+    assert stats == (2, 0, users[1].id)
+    assert [msg.recipients for msg in outbox] == \
+        [['cat@example.com'], ['eve@example.com']]
+
+def test_the_pacer_keeps_to_the_rate(monkeypatch):
+    """The pacer allows a burst, then waits between calls."""
+    now = [1000.0]
+    waits = []
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(broadcast_module, 'time', lambda: now[0])
+    monkeypatch.setattr(broadcast_module, 'sleep', sleep)
+
+    pacer = Pacer('2/second')
+    for _ in range(4):
+        pacer.wait()
+
+    assert waits == [0.5, 0.5]
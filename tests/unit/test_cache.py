@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_cache
+~~~~~~~~~~~~~~~~
+
+Unit tests for the in-process cache utilities.
+"""
+
+from time import sleep
+
+from app.cache import LRUCache
+
+
+def test_lru_cache_stores_and_counts_lookups():
+    """An LRU cache returns stored values and counts hits and misses."""
+    # Given a cache with a value
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+
+    # When looking up a stored and a missing key
+    # Then expect the value and the default
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.stats == {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 2}
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    """An LRU cache evicts the least recently used entry when it is full."""
+    # Given a full cache where 'a' was recently used
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+
+    # When another value is added
+    cache.set('c', 3)
+
+    # Then 'b' should have been evicted
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+def test_lru_cache_entries_expire_after_their_ttl():
+    """An LRU cache entry expires after its time to live."""
+    # Given a cache with a short ttl
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set('a', 1)
+
+    # When the ttl has passed
+    sleep(0.02)
+
+    # Then the entry should be gone
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+def test_lru_cache_with_no_size_is_disabled():
+    """An LRU cache with a maxsize of 0 stores nothing."""
+    cache = LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_logger
+~~~~~~~~~~~~~~~~~
+
+Unit tests for the error mail pipeline.
+"""
+
+from glob import glob
+import gzip
+import json
+import logging
+from queue import Queue
+from time import perf_counter, sleep
+
+from flask import Flask, g
+import pytest
+
+from app import logger as logger_module
+from app.logger import (
+    DigestMailHandler,
+    DigestQueueListener,
+    FingerprintQueueHandler,
+    fingerprint,
+    initialize_access_log,
+    JSONFormatter,
+    RequestContextFilter,
+    SharedFileHandler,
+)
+from tests.utilities.fixtures import app
+
+
+def record(msg='Failed to load %s', args=('a',), lineno=10, exc_info=None):
+    return logging.LogRecord('app', logging.ERROR, 'app/views.py', lineno,
+                             msg, args, exc_info)
+
+
+def raised(exception):
+    try:
+        raise exception
+    except Exception as error:
+        return type(error), error, error.__traceback__
+
+
+@pytest.fixture(scope='function')
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logger_module, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture(scope='function')
+def mails():
+    return []
+
+
+@pytest.fixture(scope='function')
+def handler(clock, mails):
+    return DigestMailHandler(lambda subject, body: mails.append((subject, body)),
+                             subject='Failure', window=300, rate='2/hour')
+
+
+def test_errors_are_fingerprinted_without_their_arguments():
+    """The same error logged with different arguments has one fingerprint."""
+    assert fingerprint(record(args=('a',))) == fingerprint(record(args=('b',)))
+    assert fingerprint(record()) != fingerprint(record(lineno=11))
+    assert fingerprint(record(exc_info=raised(KeyError('a')))) != \
+        fingerprint(record(exc_info=raised(ValueError('a'))))
+
+def test_repeated_errors_are_coalesced_into_a_digest(handler, clock, mails):
+    """The first occurrence is mailed, repeats are counted and mailed in one
+    digest at the end of the window."""
+    for n in range(5):
+        handler.handle(record(args=(n,)))
+
+    assert [subject for subject, _ in mails] == ['Failure: Failed to load 0']
+
+    handler.flush()
+    assert len(mails) == 1
+
+    clock[0] += 300
+    handler.flush()
+    assert mails[1][0] == 'Failure: 4 errors'
+    assert mails[1][1].startswith('4 more time(s)')
+
+def test_mail_is_capped_to_the_rate(handler, clock, mails):
+    """Errors over the rate are held until a digest can be sent."""
+    # Given the rate used up by two different errors
+    for lineno in (1, 2, 3):
+        handler.handle(record(lineno=lineno))
+    assert len(mails) == 2
+
+    # Then expect the third error to wait for a digest within the rate
+    clock[0] += 300
+    handler.flush()
+    assert len(mails) == 2
+    clock[0] += 1800
+    handler.flush()
+    assert mails[2][0] == 'Failure: 1 errors'
+
+def test_errors_are_mailed_from_a_background_thread(handler, mails):
+    """Records go through the queue and are mailed by the listener."""
+    queue = Queue(maxsize=10)
+    queue_handler = FingerprintQueueHandler(queue)
+    listener = DigestQueueListener(queue, handler, flush_interval=0.01)
+    log = logging.getLogger('tests.test_logger')
+    log.addHandler(queue_handler)
+    listener.start()
+    try:
+        for name in ('a', 'b'):
+            log.error('Failed to load %s', name)
+    finally:
+        listener.stop()
+        log.removeHandler(queue_handler)
+    handler.flush(force=True)
+
+    assert [subject for subject, _ in mails] == \
+        ['Failure: Failed to load a', 'Failure: 1 errors']
+
+def test_the_listener_is_started_by_the_first_record(handler, mails):
+    """The listener's thread is started in the process that logs, not when
+    the app is created (which may be before gunicorn forks)."""
+    queue = Queue(maxsize=10)
+    listener = DigestQueueListener(queue, handler, flush_interval=0.01)
+    queue_handler = FingerprintQueueHandler(queue, listener)
+    assert listener._thread is None
+
+    queue_handler.handle(record())
+    try:
+        assert listener._thread.is_alive()
+        for _ in range(100):
+            if mails:
+                break
+            sleep(0.01)
+    finally:
+        listener.stop()
+
+    assert mails[0][0] == 'Failure: Failed to load a'
+
+def test_the_listener_stops_when_the_queue_is_full(handler):
+    """Stopping doesn't fail (or hang) when the sentinel can't be queued."""
+    queue = Queue(maxsize=1)
+    listener = DigestQueueListener(queue, handler, flush_interval=0.01)
+    queue.put_nowait(record())
+
+    listener.enqueue_sentinel()
+
+    assert listener.dequeue(True) is not listener._sentinel
+    assert listener.dequeue(True) is listener._sentinel
+
+def test_a_full_queue_drops_records():
+    """Logging never blocks on a full queue."""
+    queue_handler = FingerprintQueueHandler(Queue(maxsize=1))
+
+    queue_handler.handle(record())
+    queue_handler.handle(record())
+
+    assert queue_handler.dropped == 1
+
+def test_records_are_formatted_as_json_with_the_request(app):
+    """JSON records carry the details of the request they were logged in."""
+    g.request_id = 'abc123'
+    log_record = record()
+    RequestContextFilter().filter(log_record)
+
+    data = json.loads(JSONFormatter().format(log_record))
+
+    assert data['message'] == 'Failed to load a'
+    assert data['level'] == 'ERROR'
+    assert data['request_id'] == 'abc123'
+    assert data['path'] == '/'
+    assert 'user_id' not in data
+
+def test_records_are_buffered(tmpdir):
+    """Records are only written once the buffer is full (or flushed)."""
+    filename = str(tmpdir.join('app.log'))
+    handler = SharedFileHandler(filename, buffer_size=1024,
+                                flush_interval=60)
+    handler.setLevel(logging.INFO)
+    info = logging.makeLogRecord({'msg': 'Hello', 'levelno': logging.INFO})
+
+    handler.handle(info)
+    assert tmpdir.join('app.log').read() == ''
+
+    handler.flush()
+    assert tmpdir.join('app.log').read() == 'Hello\n'
+    handler.close()
+
+def test_rotated_files_are_compressed_and_pruned(tmpdir):
+    """Full files are rotated, gzipped and only the newest are kept."""
+    filename = str(tmpdir.join('app.log'))
+    handler = SharedFileHandler(filename, max_bytes=100, backup_count=2,
+                                buffer_size=0, flush_interval=60)
+
+    for n in range(4):
+        handler.handle(logging.makeLogRecord({'msg': str(n) * 100}))
+        wait_for(lambda: not glob(filename + '.*[0-9]') and
+                 len(glob(filename + '.*.gz')) <= 2)
+    handler.close()
+
+    backups = sorted(glob(filename + '.*.gz'))
+    assert len(backups) == 2
+    with gzip.open(backups[-1], 'rt') as backup:
+        assert backup.read() == '3' * 100 + '\n'
+    assert tmpdir.join('app.log').read() == ''
+
+def test_every_rotated_file_is_kept_without_a_backup_count(tmpdir):
+    """A backup_count of 0 keeps every rotated file."""
+    filename = str(tmpdir.join('app.log'))
+    handler = SharedFileHandler(filename, max_bytes=100, backup_count=0,
+                                buffer_size=0, flush_interval=60)
+
+    for n in range(3):
+        handler.handle(logging.makeLogRecord({'msg': str(n) * 100}))
+        wait_for(lambda: not glob(filename + '.*[0-9]'))
+    handler.close()
+
+    assert len(glob(filename + '.*.gz')) == 3
+
+def test_a_file_rotated_by_another_process_is_reopened(tmpdir):
+    """A handler writes to the new file once another one rotates it."""
+    filename = str(tmpdir.join('app.log'))
+    first, second = [SharedFileHandler(filename, max_bytes=10, buffer_size=0,
+                                       flush_interval=60) for _ in range(2)]
+
+    second.handle(logging.makeLogRecord({'msg': 'second'}))
+    first.handle(logging.makeLogRecord({'msg': 'rotate me'}))
+    second.handle(logging.makeLogRecord({'msg': 'new'}))
+    first.close()
+    second.close()
+
+    assert tmpdir.join('app.log').read() == 'new\n'
+
+def test_access_records_are_sampled(monkeypatch):
+    """Successful requests are sampled, errors are always logged."""
+    app = Flask(__name__)
+    app.config['LOG_ACCESS_SAMPLE_RATE'] = 0.5
+    app.add_url_rule('/', 'index', lambda: 'Hello')
+    initialize_access_log(app)
+    records = []
+    app.logger.addHandler(type('ListHandler', (logging.Handler,),
+                               {'emit': lambda self, r: records.append(r)})())
+    app.logger.setLevel(logging.INFO)
+    client = app.test_client()
+
+    monkeypatch.setattr(logger_module, 'random', lambda: 0.75)
+    response = client.get('/', headers={'X-Request-ID': 'abc123'})
+    client.get('/missing/')
+    monkeypatch.setattr(logger_module, 'random', lambda: 0.25)
+    client.get('/')
+
+    assert response.headers['X-Request-ID'] == 'abc123'
+    assert [(r.getMessage(), r.status) for r in records] == \
+        [('GET /missing/ 404', 404), ('GET / 200', 200)]
+    assert records[0].latency_ms >= 0
+
+
+def wait_for(condition, timeout=5):
+    deadline = perf_counter() + timeout
+    while not condition() and perf_counter() < deadline:
+        sleep(0.01)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_mail
+~~~~~~~~~~~~~~~
+
+Unit tests for the background mail dispatcher.
+"""
+
+import signal
+
+from flask_mail import Message
+import pytest
+
+from app.mail import mail, MailDispatcher
+from tests.utilities.fixtures import app
+
+
+def message(n=0):
+    return Message('Message {}'.format(n), sender='app@example.com',
+                   recipients=['jane@example.com'], body='Hello')
+
+
+@pytest.fixture(scope='function')
+def outbox(app):
+    with mail.record_messages() as outbox:
+        yield outbox
+
+
+def test_queued_mail_is_sent_by_the_workers(app, outbox):
+    """Queued mail is sent in the background and drained on shutdown."""
+    dispatcher = MailDispatcher(workers=2, queue_size=10)
+
+    for n in range(5):
+        assert dispatcher.submit(app, message(n))
+    assert dispatcher.shutdown(timeout=5) == 0
+
+    assert sorted(msg.subject for msg in outbox) == \
+        ['Message {}'.format(n) for n in range(5)]
+    statistics = dispatcher.statistics()
+    assert statistics['sent'] == 5
+    assert statistics['queue_depth'] == 0
+    assert statistics['max_wait'] >= statistics['average_wait'] >= 0
+
+def test_mail_is_dropped_when_the_queue_is_full(app, outbox):
+    """The drop policy discards mail that doesn't fit in the queue."""
+    dispatcher = MailDispatcher(workers=0, queue_size=1, policy='drop')
+
+    assert dispatcher.submit(app, message(1))
+    assert not dispatcher.submit(app, message(2))
+
+    assert dispatcher.statistics()['dropped'] == 1
+    assert dispatcher.statistics()['queue_depth'] == 1
+    assert outbox == []
+
+@pytest.mark.parametrize('policy', ['block', 'sync'])
+def test_mail_is_sent_synchronously_when_the_queue_is_full(app, outbox,
+                                                           policy):
+    """The block (once it times out) and sync policies send mail that doesn't
+    fit in the queue in the calling thread."""
+    dispatcher = MailDispatcher(workers=0, queue_size=1, policy=policy,
+                                timeout=0.01)
+
+    dispatcher.submit(app, message(1))
+    dispatcher.submit(app, message(2))
+
+    assert [msg.subject for msg in outbox] == ['Message 2']
+    assert dispatcher.statistics()['sent_sync'] == 1
+
+def test_an_unknown_policy_is_rejected():
+    """Only the known queue policies can be used."""
+    with pytest.raises(ValueError):
+        MailDispatcher(policy='retry')
+
+def test_sigterm_leaves_the_queue_to_be_drained_at_exit(app, outbox):
+    """SIGTERM doesn't drain the queue in the signal handler, and mail sent
+    after it is sent in the calling thread."""
+    calls = []
+    previous = signal.signal(signal.SIGTERM,
+                             lambda signum, frame: calls.append(signum))
+    try:
+        # Given a dispatcher with queued mail
+        dispatcher = MailDispatcher(workers=0, queue_size=5)
+        dispatcher.submit(app, message(1))
+
+        # When the process receives SIGTERM
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    # Then the previous handler runs and the queue is left alone
+    assert calls == [signal.SIGTERM]
+    assert dispatcher.statistics()['queue_depth'] == 1
+    # And new mail is sent straight away
+    dispatcher.submit(app, message(2))
+    assert [msg.subject for msg in outbox] == ['Message 2']
+
+def test_a_restarted_dispatcher_queues_mail_again(app, outbox):
+    """Once a dispatcher stopped by SIGTERM is started again, mail is queued
+    rather than sent in the calling thread."""
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    try:
+        # Given a dispatcher stopped by SIGTERM
+        dispatcher = MailDispatcher(workers=0, queue_size=5)
+        dispatcher.submit(app, message(1))
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    # When it is shut down and used again
+    dispatcher.shutdown(timeout=0)
+    dispatcher.submit(app, message(2))
+
+    # Then the mail is queued
+    assert outbox == []
+    assert dispatcher.statistics()['sent_sync'] == 0
+    assert dispatcher.statistics()['queue_depth'] == 2
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_mail_templates
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the mail rendering layer.
+"""
+
+from collections import namedtuple
+
+from app.blueprints.auth.mail import (
+    EMAIL_NOT_FOUND,
+    EMAIL_VERIFICATION,
+    PASSWORD_RESET,
+    send_email_verification_reminders,
+    send_unverified_email_reminders,
+)
+from app.mail_templates import STATIC_HOSTS
+from app.models import OutboxMessage
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+Recipient = namedtuple('Recipient', 'first_name')
+
+
+def test_a_template_pair_is_rendered(app):
+    """The text and html bodies are rendered from the same context."""
+    text_body, html_body = PASSWORD_RESET.render(user=Recipient('Jane'),
+                                                 token='abc')
+
+    assert text_body.startswith('Jane,')
+    assert '/reset_password/abc' in text_body
+    assert html_body.startswith('<p>Jane,</p>')
+    assert '/reset_password/abc' in html_body
+
+def test_compiled_templates_are_kept(app):
+    """The templates are only compiled and looked up once per app."""
+    assert PASSWORD_RESET.templates[0] is PASSWORD_RESET.templates[0]
+    assert PASSWORD_RESET.templates[1] is PASSWORD_RESET.templates[1]
+
+def test_static_bodies_are_only_rendered_once(app):
+    """A static template's bodies are memoized."""
+    assert EMAIL_NOT_FOUND.render() is EMAIL_NOT_FOUND.render()
+    assert 'We don\'t\ncurrently have a user' in EMAIL_NOT_FOUND.render()[0]
+
+def test_static_bodies_are_kept_for_a_few_hosts(app):
+    """A static template keeps its bodies for a bounded number of hosts."""
+    # Given a static template rendered for many hosts
+    for number in range(STATIC_HOSTS * 2):
+        with app.test_request_context(
+                base_url='http://host{}.example.com'.format(number)):
+            EMAIL_NOT_FOUND.render()
+    # Then only the last few are kept
+    assert len(EMAIL_NOT_FOUND._bodies[app.jinja_env]) == STATIC_HOSTS
+
+def test_static_bodies_use_the_server_name(app):
+    """With a SERVER_NAME, a static template is rendered once for it."""
+    # Given a configured server name
+    app.config['SERVER_NAME'] = 'example.com'
+    try:
+        # When it is rendered for requests to different hosts
+        with app.test_request_context(base_url='http://example.com'):
+            first = EMAIL_NOT_FOUND.render()
+        with app.test_request_context(base_url='http://other.example.com'):
+            second = EMAIL_NOT_FOUND.render()
+    finally:
+        app.config['SERVER_NAME'] = None
+    # Then the bodies are shared
+    assert first is second
+
+def test_recipient_context_is_merged_over_shared_context(app):
+    """Each recipient's context is merged over the shared context."""
+    bodies = list(EMAIL_VERIFICATION.render_many(
+        [{'user': Recipient('Jane')},
+         {'user': Recipient('John'), 'token': 'john-token'}],
+        token='shared-token'))
+
+    assert [text.split(',')[0] for text, _ in bodies] == ['Jane', 'John']
+    assert '/verify_email/shared-token' in bodies[0][0]
+    assert '/verify_email/john-token' in bodies[1][0]
+    assert '/verify_email/john-token' in bodies[1][1]
+
+def test_verification_reminders_are_queued(session):
+    """Verification reminders are rendered for, and queued to, each user."""
+    # Given two users
+    users = [create_user(session, first_name='Jane', email='jane@example.com'),
+             create_user(session, first_name='John', email='john@example.com')]
+
+    # When they are sent reminders
+    send_email_verification_reminders(users)
+
+    # Then expect a mail for each in the outbox
+    mails = [message.data
+             for message in OutboxMessage.query.order_by(OutboxMessage.id)]
+    assert [mail['recipients'] for mail in mails] == \
+        [['jane@example.com'], ['john@example.com']]
+    assert [mail['text_body'].split(',')[0] for mail in mails] == \
+        ['Jane', 'John']
+
+def test_unverified_users_are_reminded(session):
+    """Only active users with an unverified primary email are reminded."""
+    # Given verified, unverified and inactive users
+    create_user(session, first_name='Jane', email='jane@example.com')
+    john = create_user(session, first_name='John', email='john@example.com')
+    john.primary_email.verify()
+    fay = create_user(session, first_name='Fay', email='fay@example.com')
+    fay.active = False
+    create_user(session, first_name='Ann', email='ann@example.com')
+    session.flush()
+
+    # When reminders are sent in chunks
+    count = send_unverified_email_reminders(chunk_size=1)
+
+    # Then expect a mail for each unverified, active user
+    mails = [message.data
+             for message in OutboxMessage.query.order_by(OutboxMessage.id)]
+    assert count == 2
+    assert [mail['recipients'] for mail in mails] == \
+        [['jane@example.com'], ['ann@example.com']]
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_middleware
+~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the static file and compression middleware.
+"""
+
+import gzip
+import os
+import zlib
+
+from flask import url_for
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from app import middleware
+from app.middleware import CompressionMiddleware, StaticFilesMiddleware
+from tests.utilities.fixtures import app
+
+
+PAGE = b'<p>spa-base</p>\n' * 100
+
+
+def not_static(environ, start_response):
+    start_response('404 Not Found', [('Content-Type', 'text/plain')])
+    return [b'app']
+
+
+def page_app(body=(PAGE,), content_type='text/html; charset=utf-8',
+             **headers):
+    """Returns an app that responds with `body` (a list, or a generator
+    function for a streamed body)."""
+    def app(environ, start_response):
+        response_headers = [('Content-Type', content_type)]
+        if isinstance(body, (list, tuple)):
+            response_headers.append(
+                ('Content-Length', str(sum(len(chunk) for chunk in body))))
+        response_headers += list(headers.items())
+        start_response('200 OK', response_headers)
+        return body if isinstance(body, (list, tuple)) else body()
+    return app
+
+
+def compressed(app, accept_encoding='gzip', **options):
+    return Client(CompressionMiddleware(app, **options), BaseResponse).get(
+        '/', headers={'Accept-Encoding': accept_encoding}, buffered=True)
+
+
+@pytest.fixture
+def root(tmpdir):
+    tmpdir.join('app.js').write('console.log("spa-base");\n' * 10)
+    tmpdir.join('app.js.gz').write_binary(
+        gzip.compress(tmpdir.join('app.js').read_binary()))
+    tmpdir.join('app.js.br').write_binary(b'brotli')
+    tmpdir.join('app.3f2a9c1b.css').write('body {}\n')
+    tmpdir.mkdir('images').join('logo.svg').write('<svg></svg>\n')
+    tmpdir.join('.hidden').write('secret')
+    return tmpdir
+
+
+@pytest.fixture
+def client(root):
+    return Client(StaticFilesMiddleware(not_static, str(root)), BaseResponse)
+
+
+def test_serves_static_files_with_validators(client, root):
+    """Static files are served with an ETag and Last-Modified."""
+    # When a static file is requested
+    response = client.get('/images/logo.svg')
+
+    # Then it is served with its validators and cache headers
+    assert response.status_code == 200
+    assert response.data == b'<svg></svg>\n'
+    assert response.headers['Content-Type'] == 'image/svg+xml; charset=utf-8'
+    assert response.headers['ETag'].startswith('"')
+    assert response.headers['Last-Modified']
+    assert response.headers['Cache-Control'] == 'public, max-age=3600'
+    assert 'Vary' not in response.headers
+
+def test_fingerprinted_files_are_immutable(client):
+    """Files with a content hash in their name are cached for a year."""
+    # When a fingerprinted static file is requested
+    response = client.get('/app.3f2a9c1b.css')
+
+    # Then it is cached for a year
+    assert response.headers['Cache-Control'] == \
+        'public, max-age=31536000, immutable'
+
+def test_passes_other_requests_through(client):
+    """Requests that aren't for a static file go to the app."""
+    # When a path outside the index, a hidden file or a POST is requested
+    # Then the app answers
+    assert client.get('/api/users').data == b'app'
+    assert client.get('/.hidden').data == b'app'
+    assert client.post('/app.js').data == b'app'
+
+def test_not_modified(client):
+    """Matching If-None-Match and If-Modified-Since get a 304."""
+    # Given a file that was already fetched
+    response = client.get('/images/logo.svg')
+
+    # When it is requested again with its validators
+    by_etag = client.get('/images/logo.svg', headers={
+        'If-None-Match': response.headers['ETag']})
+    by_date = client.get('/images/logo.svg', headers={
+        'If-Modified-Since': response.headers['Last-Modified']})
+
+    # Then it is not sent again
+    assert by_etag.status_code == 304
+    assert by_etag.data == b''
+    assert by_date.status_code == 304
+    assert client.get('/images/logo.svg', headers={
+        'If-None-Match': '"stale"'}).status_code == 200
+
+def test_precompressed_variants(client, root):
+    """A .br or .gz file is served when the client accepts it."""
+    # When a file with precompressed variants is requested with different
+    # Accept-Encodings
+    brotli = client.get('/app.js', headers={'Accept-Encoding': 'gzip, br'})
+    gzipped = client.get('/app.js', headers={'Accept-Encoding': 'gzip'})
+    plain = client.get('/app.js')
+
+    # Then the best variant the client accepts is sent
+    assert brotli.headers['Content-Encoding'] == 'br'
+    assert brotli.data == b'brotli'
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == root.join('app.js').read_binary()
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == root.join('app.js').read_binary()
+
+    # And each has its own ETag, with the original's Content-Type
+    assert len({brotli.headers['ETag'], gzipped.headers['ETag'],
+                plain.headers['ETag']}) == 3
+    for response in (brotli, gzipped, plain):
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert response.headers['Content-Type'] == \
+            plain.headers['Content-Type']
+
+def test_range_requests(client, root):
+    """Byte ranges are served with a 206, or a 416 when unsatisfiable."""
+    # Given a static file
+    content = root.join('app.js').read_binary()
+
+    # When a range of it is requested
+    response = client.get('/app.js', headers={'Range': 'bytes=5-9',
+                                              'Accept-Encoding': 'gzip'})
+
+    # Then only that range is sent, uncompressed
+    assert response.status_code == 206
+    assert response.data == content[5:10]
+    assert response.headers['Content-Range'] == \
+        'bytes 5-9/{}'.format(len(content))
+    assert 'Content-Encoding' not in response.headers
+
+    # And a range past the end can't be satisfied
+    response = client.get('/app.js', headers={'Range': 'bytes=9999-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == \
+        'bytes */{}'.format(len(content))
+
+    # And a stale If-Range gets the whole file
+    response = client.get('/app.js', headers={'Range': 'bytes=5-9',
+                                              'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == content
+
+def test_streams_large_files(root):
+    """Files over the memory limit are read from disk."""
+    # Given a middleware that keeps nothing in memory
+    middleware = StaticFilesMiddleware(not_static, str(root), memory_limit=0)
+    client = Client(middleware, BaseResponse)
+    content = root.join('app.js').read_binary()
+
+    # When a file and a range of it are requested
+    # Then they are read from disk
+    assert middleware.files['/app.js'].data is None
+    assert client.get('/app.js').data == content
+    assert client.get('/app.js', headers={'Range': 'bytes=-4'}).data == \
+        content[-4:]
+
+def test_removed_files_are_passed_to_the_app(root):
+    """A file removed after it was indexed is left to the app."""
+    # Given an indexed file that is read from disk
+    middleware = StaticFilesMiddleware(not_static, str(root), memory_limit=0)
+    client = Client(middleware, BaseResponse)
+
+    # When it is removed
+    root.join('app.js').remove()
+
+    # Then requests for it go to the app
+    response = client.get('/app.js')
+    assert response.status_code == 404
+    assert response.data == b'app'
+
+    # And with refresh, the index is rebuilt without it
+    middleware.refresh = True
+    root.join('app.3f2a9c1b.css').remove()
+    assert client.get('/app.3f2a9c1b.css').data == b'app'
+    assert '/app.3f2a9c1b.css' not in middleware.files
+
+def test_head(client):
+    """HEAD requests get the headers without the body."""
+    # When a static file's headers are requested
+    response = client.head('/images/logo.svg')
+
+    # Then no body is sent
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == '12'
+    assert response.data == b''
+
+def test_refresh(root):
+    """With refresh, changed and new files are picked up."""
+    # Given a middleware that refreshes its index
+    client = Client(StaticFilesMiddleware(not_static, str(root),
+                                          refresh=True), BaseResponse)
+    assert client.get('/images/logo.svg').data == b'<svg></svg>\n'
+
+    # When a file is changed and another one is added
+    logo = root.join('images', 'logo.svg')
+    logo.write('<svg><g></g></svg>\n')
+    os.utime(str(logo), (1, 1))
+    root.join('new.txt').write('new')
+
+    # Then they are served
+    assert client.get('/images/logo.svg').data == b'<svg><g></g></svg>\n'
+    assert client.get('/new.txt').data == b'new'
+
+    # And paths outside the root are not
+    assert client.get('/../etc/passwd').data == b'app'
+
+def test_compresses_responses():
+    """Responses are gzipped when the client accepts it."""
+    # When a page is requested with gzip
+    response = compressed(page_app(ETag='"page"'))
+
+    # Then it is compressed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == 'W/"page"'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data) == PAGE
+    assert len(response.data) < len(PAGE)
+
+def test_negotiates_the_encoding(monkeypatch):
+    """Encodings the client refuses (or doesn't ask for) aren't used."""
+    # When a page is requested without gzip
+    # Then it is not compressed, but still varies on Accept-Encoding
+    for accept_encoding in ('', 'identity', 'gzip;q=0, deflate'):
+        response = compressed(page_app(), accept_encoding)
+        assert 'Content-Encoding' not in response.headers
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert response.data == PAGE
+
+    # And brotli is only offered when it is installed
+    monkeypatch.setattr(middleware, 'brotli', None)
+    assert compressed(page_app(), 'br, gzip') \
+        .headers['Content-Encoding'] == 'gzip'
+
+def test_compresses_with_brotli():
+    """Responses are compressed with brotli when it is preferred."""
+    brotli = pytest.importorskip('brotli')
+
+    # When a page is requested with brotli
+    response = compressed(page_app(), 'gzip;q=0.5, br')
+
+    # Then it is compressed with brotli
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == PAGE
+
+def test_skips_responses_not_worth_compressing():
+    """Small, binary, encoded, no-transform and cookie setting responses are
+    untouched."""
+    # When responses that shouldn't be compressed are requested with gzip
+    # Then they are sent as they are
+    for app, vary in ((page_app([b'<p>small</p>']), 'Accept-Encoding'),
+                      (page_app(content_type='image/png'), None),
+                      (page_app(**{'Content-Encoding': 'br'}), None),
+                      (page_app(**{'Cache-Control': 'no-transform'}), None),
+                      (page_app(**{'Set-Cookie': 'session=1'}), None)):
+        response = compressed(app)
+        assert response.headers.get('Content-Encoding') in (None, 'br')
+        assert response.headers.get('Vary') == vary
+    assert compressed(page_app(), min_size=len(PAGE) + 1).data == PAGE
+    assert compressed(page_app(content_type='text/html'),
+                      mimetypes=['application/json']).data == PAGE
+
+def test_adds_to_vary():
+    """Accept-Encoding is added to the Vary header once."""
+    # When responses that already vary are compressed
+    # Then Accept-Encoding is added to their Vary header
+    assert compressed(page_app(Vary='Cookie')).headers['Vary'] == \
+        'Cookie, Accept-Encoding'
+    assert compressed(page_app(Vary='accept-encoding')).headers['Vary'] == \
+        'accept-encoding'
+
+def test_compresses_streamed_responses():
+    """Streamed bodies are compressed chunk by chunk."""
+    # Given a streamed page
+    produced = []
+
+    def stream():
+        for chunk in (PAGE, PAGE, b'</html>'):
+            produced.append(chunk)
+            yield chunk
+    app = CompressionMiddleware(page_app(stream))
+
+    # When it is requested with gzip
+    started = []
+    chunks = app({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                 lambda status, headers: started.append(dict(headers)))
+    first = next(chunks)
+
+    # Then each chunk is sent as soon as it is produced
+    assert started[0]['Content-Encoding'] == 'gzip'
+    assert len(produced) == 1
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(first) == PAGE
+    assert decompressor.decompress(b''.join(chunks)) == PAGE + b'</html>'
+    assert decompressor.eof
+
+def test_buffers_small_streamed_responses():
+    """A streamed body below the minimum size is sent uncompressed."""
+    # Given a short streamed page
+    def stream():
+        yield b'<p>'
+        yield b'small</p>'
+
+    # When it is requested with gzip
+    response = compressed(page_app(stream))
+
+    # Then it is not compressed
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Length'] == '12'
+    assert response.data == b'<p>small</p>'
+
+def test_closes_the_app_iterable():
+    """The app's iterable is closed whether or not it is compressed."""
+    # Given a streamed page that notices when it is closed
+    closed = []
+
+    def stream():
+        try:
+            yield PAGE
+        finally:
+            closed.append(True)
+
+    # When it is requested with and without gzip
+    compressed(page_app(stream))
+    compressed(page_app(stream), '')
+
+    # Then it is closed each time
+    assert closed == [True, True]
+
+def test_pages_with_a_csrf_token_are_not_compressed(app):
+    """Pages that render a CSRF token are marked no-transform."""
+    # Given pages with and without a form
+    client = app.test_client()
+
+    # When they are requested (each with its own g, as in production)
+    with app.app_context():
+        redirect = client.get('/')
+    with app.app_context():
+        login = client.get(url_for('auth.login'))
+
+    # Then only the form is marked no-transform
+    assert 'no-transform' in login.headers['Cache-Control']
+    assert 'no-transform' not in redirect.headers.get('Cache-Control', '')
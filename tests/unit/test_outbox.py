@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_outbox
+~~~~~~~~~~~~~~~~~
+
+Unit tests for the outbox worker.
+"""
+
+from time import time
+
+import pytest
+
+from app import models
+from app.mail import mail
+from app.models import Email, OutboxMessage
+from app.outbox import backoff, enqueue_mail, handler, process_batch, run_worker
+from tests.utilities.fixtures import app, db, session
+from tests.utilities.helpers import create_user
+
+
+failures = []
+
+
+@handler('test')
+def failing_handler(data):
+    if failures:
+        raise failures.pop()
+
+
+@handler('test_conflict')
+def conflicting_handler(data):
+    models.session.add(Email(email=data['email'], user_id=data['user_id'],
+                             check_duplicates=False))
+    models.session.flush()
+
+
+@pytest.fixture(scope='function')
+def failing(app):
+    app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+    yield failures
+    del failures[:]
+    app.config['OUTBOX_MAX_ATTEMPTS'] = 8
+
+
+def test_backoff_doubles_up_to_a_maximum():
+    """The wait between attempts doubles, but never passes the maximum."""
+    assert [backoff(n, 30, 200) for n in range(1, 6)] == \
+        [30, 60, 120, 200, 200]
+
+def test_mail_is_only_sent_by_the_worker(session):
+    """Queued mail is sent when the worker runs, and removed from the
+    outbox."""
+    with mail.record_messages() as outbox:
+        # Given a queued mail
+        enqueue_mail('Hello', sender='app@example.com',
+                     recipients=['jane@example.com'], text_body='Hello',
+                     html_body='<p>Hello</p>')
+        assert outbox == []
+
+        # When the worker runs
+        run_worker(once=True)
+
+        # Then expect it to have been sent
+        assert [msg.subject for msg in outbox] == ['Hello']
+        assert OutboxMessage.query.count() == 0
+
+def test_failed_messages_are_retried_later(session, failing):
+    """A message that fails is retried after a backoff."""
+    # Given a message that fails once
+    failing.append(RuntimeError('Unavailable'))
+    message = OutboxMessage.enqueue('test', {})
+
+    # When the worker runs
+    # Then expect it to be retried, but not right away
+    assert process_batch() == (0, 1, 0)
+    assert 'Unavailable' in message.last_error
+    assert message.available_at >= time() + 29
+    assert process_batch() == (0, 0, 0)
+
+    # And to be delivered on the next attempt
+    message.available_at = 0
+    session.commit()
+    assert process_batch() == (1, 0, 0)
+
+def test_messages_that_keep_failing_become_dead_letters(session, failing):
+    """A message is given up on after the maximum number of attempts."""
+    # Given a message that always fails
+    failing.extend([RuntimeError('Unavailable')] * 2)
+    message = OutboxMessage.enqueue('test', {})
+
+    # When it has been attempted twice
+    assert process_batch() == (0, 1, 0)
+    message.available_at = 0
+    session.commit()
+
+    # Then expect it to be a dead letter
+    assert process_batch() == (0, 0, 1)
+    assert message.status == OutboxMessage.DEAD
+    assert OutboxMessage.dead_letters().count() == 1
+
+def test_a_database_error_only_fails_its_own_message(session):
+    """A handler that fails on the database doesn't fail the rest of the
+    batch."""
+    # Given a mail and a message whose handler violates a unique index
+    user = create_user(session, email='jane@example.com')
+    enqueue_mail('Hello', sender='app@example.com',
+                 recipients=['jane@example.com'], text_body='Hello',
+                 html_body='<p>Hello</p>')
+    conflict = OutboxMessage.enqueue('test_conflict', {
+        'email': 'jane@example.com', 'user_id': user.id})
+    session.commit()
+
+    with mail.record_messages() as outbox:
+        # When the worker runs
+        stats = process_batch()
+
+    # Then expect the mail to be delivered and the conflict to be retried
+    assert stats == (1, 1, 0)
+    assert [msg.subject for msg in outbox] == ['Hello']
+    assert 'IntegrityError' in conflict.last_error
+    assert OutboxMessage.query.all() == [conflict]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_password_policy
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the password hash policy.
+"""
+
+import pytest
+from werkzeug.security import (
+    check_password_hash as check_werkzeug_hash,
+    generate_password_hash as generate_werkzeug_hash,
+)
+
+from app.password_policy import (
+    calibrate,
+    check_password_hash,
+    generate_password_hash,
+    HashPolicy,
+    SCRYPT_AVAILABLE,
+)
+
+
+def test_pbkdf2_hashes_are_compatible_with_werkzeug():
+    """PBKDF2 hashes can be checked by werkzeug and vice versa."""
+    policy = HashPolicy('pbkdf2:sha256', 2000)
+
+    password_hash = generate_password_hash('password123', policy)
+
+    assert password_hash.startswith('pbkdf2:sha256:2000$')
+    assert check_werkzeug_hash(password_hash, 'password123')
+    assert check_password_hash(generate_werkzeug_hash('password123'),
+                               'password123')
+    assert not check_password_hash(password_hash, 'password321')
+
+@pytest.mark.skipif(not SCRYPT_AVAILABLE, reason='scrypt is not available')
+def test_scrypt_hashes_can_be_checked():
+    """scrypt hashes record their parameters and can be checked."""
+    policy = HashPolicy('scrypt', 1024)
+
+    password_hash = generate_password_hash('password123', policy)
+
+    assert password_hash.startswith('scrypt:1024:8:1$')
+    assert check_password_hash(password_hash, 'password123')
+    assert not check_password_hash(password_hash, 'password321')
+
+def test_hashes_from_other_policies_need_rehashing():
+    """A hash made with a different method or cost is outdated."""
+    policy = HashPolicy('pbkdf2:sha256', 2000)
+
+    assert not policy.needs_rehash(generate_password_hash('password123', policy))
+    assert policy.needs_rehash(generate_werkzeug_hash('password123'))
+    assert policy.needs_rehash(generate_password_hash(
+        'password123', HashPolicy('pbkdf2:sha256', 1000)))
+
+def test_the_decoy_hash_uses_the_policy():
+    """The decoy hash is made at the policy's cost."""
+    policy = HashPolicy('pbkdf2:sha256', 2000)
+
+    assert not policy.needs_rehash(policy.decoy_hash)
+
+def test_invalid_policies_are_rejected():
+    """Unknown methods are rejected."""
+    with pytest.raises(ValueError):
+        HashPolicy('md5', 1000)
+
+def test_calibration_picks_a_cost_for_the_target_time():
+    """Calibration scales the cost to the target time."""
+    fast = calibrate('pbkdf2:sha256', 0.005)
+    slow = calibrate('pbkdf2:sha256', 0.05)
+
+    assert fast.cost >= 1000
+    assert slow.cost > fast.cost
+    assert calibrate('pbkdf2:sha256', 1, max_cost=5000).cost == 5000
+
+def test_hashes_fit_in_the_password_hash_column():
+    """Every allowed method's hashes fit in users.password_hash."""
+    from app.models import User
+    length = User.__table__.c.password_hash.type.length
+
+    for method, cheap, costly in (('pbkdf2:sha256', 1, 10000000),
+                                  ('pbkdf2:sha512', 1, 10000000),
+                                  ('scrypt', 2, 2 ** 20)):
+        if method == 'scrypt' and not SCRYPT_AVAILABLE:
+            continue
+        # Hash at a cheap cost, and count the digits of the costly one.
+        password_hash = generate_password_hash(
+            'password123', HashPolicy(method, cheap, salt_length=32))
+        extra = len(str(costly)) - len(str(cheap))
+
+        assert len(password_hash) + extra <= length
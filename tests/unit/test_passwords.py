@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_passwords
+~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the password hashing executor.
+"""
+
+import os
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from app.passwords import PasswordHasher, PasswordHasherBusy
+
+
+@pytest.fixture(scope='module')
+def pooled_hasher():
+    hasher = PasswordHasher(workers=1, queue_size=1, timeout=5)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_passwords_are_hashed_and_checked_inline():
+    """Without workers, passwords are hashed in the calling thread."""
+    hasher = PasswordHasher(workers=0)
+
+    password_hash = hasher.hash('password123')
+
+    assert hasher.check(password_hash, 'password123')
+    assert not hasher.check(password_hash, 'password321')
+    assert hasher.statistics()['hashes'] == 3
+
+def test_passwords_are_hashed_in_a_process_pool(pooled_hasher):
+    """With workers, passwords are hashed in a process pool and the time
+    spent waiting and hashing is recorded."""
+    password_hash = pooled_hasher.hash('password123')
+
+    assert pooled_hasher.check(password_hash, 'password123')
+    statistics = pooled_hasher.statistics()
+    assert statistics['hashes'] == 2
+    assert statistics['average_hash_time'] > 0
+    assert statistics['max_wait'] >= 0
+
+def test_a_full_queue_is_rejected():
+    """A hash that can't get a place in the queue in time is rejected."""
+    # Given a hasher whose only slot is taken
+    hasher = PasswordHasher(workers=0, queue_size=0, timeout=0.01)
+    hasher._slots.acquire()
+
+    # When another password is hashed
+    # Then it is rejected
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash('password123')
+    assert hasher.statistics()['rejected'] == 1
+
+def _die(*args):
+    os._exit(1)
+
+def _sleep(seconds):
+    sleep(seconds)
+
+def test_a_broken_pool_is_replaced():
+    """A pool whose worker died is replaced instead of failing every later
+    hash."""
+    # Given a hasher whose worker dies while hashing
+    hasher = PasswordHasher(workers=1, queue_size=1, timeout=5)
+    with pytest.raises(PasswordHasherBusy):
+        hasher._run(_die)
+
+    # When another password is hashed
+    # Then it is hashed in a new pool
+    assert hasher.check(hasher.hash('password123'), 'password123')
+    hasher.shutdown()
+
+def test_a_timed_out_hash_keeps_its_slot_until_it_finishes():
+    """A hash the caller stopped waiting for still counts against the queue
+    until it finishes."""
+    # Given a hasher with one slot, and a hash that outlasts the timeout
+    hasher = PasswordHasher(workers=1, queue_size=0, timeout=0.2)
+    with pytest.raises(PasswordHasherBusy):
+        hasher._run(_sleep, 1)
+
+    # When another password is hashed while the first is still running
+    # Then it is rejected
+    with pytest.raises(PasswordHasherBusy):
+        hasher._run(_sleep, 0)
+    assert hasher.statistics()['rejected'] == 2
+
+    # And once the first hash finishes, its slot is free again
+    sleep(1)
+    hasher._run(_sleep, 0)
+    assert hasher.statistics()['hashes'] == 1
+    hasher.shutdown()
+
+def test_statistics_are_counted_from_several_threads():
+    """Hashes recorded by concurrent requests are all counted."""
+    hasher = PasswordHasher(workers=0)
+
+    def record():
+        for _ in range(1000):
+            hasher._record(0.001, 0.001)
+    threads = [Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert hasher.statistics()['hashes'] == 8000
+    assert hasher.total_wait == pytest.approx(8.0)
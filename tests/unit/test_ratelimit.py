@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_ratelimit
+~~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the rate limiter.
+"""
+
+import pytest
+
+from app.ratelimit import (
+    Limit,
+    limiter,
+    MemoryStore,
+    RateLimiter,
+    RateLimitExceeded,
+    SQLiteStore,
+)
+from tests.utilities.fixtures import app, client, db, session
+from tests.utilities.helpers import assert_max_queries
+
+
+@pytest.fixture(scope='function')
+def enabled_limiter(app):
+    """Enables the app's limiter (with a fresh store) for a test."""
+    store, limiter.store = limiter.store, MemoryStore()
+    limiter.enabled = True
+    yield limiter
+    limiter.enabled = app.config['RATELIMIT_ENABLED']
+    limiter.store = store
+
+
+def test_limits_can_be_parsed():
+    """Limits are written as a count per period."""
+    assert Limit.parse('10/minute') == Limit(10, 60)
+    assert Limit.parse('3/hours').interval == 1200
+
+def test_a_burst_is_allowed_then_requests_are_spaced_out():
+    """A limit allows a burst of its count, then one request per interval."""
+    limiter = RateLimiter(MemoryStore())
+    limit = Limit.parse('3/minute')
+
+    # Given a burst of three requests
+    for _ in range(3):
+        limiter.hit('key', limit, now=1000)
+
+    # When a fourth is made
+    # Then it has to wait for the next interval
+    with pytest.raises(RateLimitExceeded) as error:
+        limiter.hit('key', limit, now=1000)
+    assert error.value.retry_after == 20
+
+    # But other keys are unaffected, and one request is allowed an interval
+    # later
+    limiter.hit('other key', limit, now=1000)
+    limiter.hit('key', limit, now=1020)
+    with pytest.raises(RateLimitExceeded):
+        limiter.hit('key', limit, now=1020)
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_a_store_is_shared_by_every_limiter(tmpdir, store):
+    """Limiters (in different workers) share the same state through the
+    store."""
+    if store == 'sqlite':
+        path = str(tmpdir.join('ratelimit.db'))
+        workers = [RateLimiter(SQLiteStore(path)),
+                   RateLimiter(SQLiteStore(path))]
+    else:
+        shared_store = MemoryStore()
+        workers = [RateLimiter(shared_store), RateLimiter(shared_store)]
+    limit = Limit.parse('2/minute')
+
+    workers[0].hit('key', limit, now=1000)
+    workers[1].hit('key', limit, now=1000)
+
+    with pytest.raises(RateLimitExceeded):
+        workers[0].hit('key', limit, now=1000)
+
+def test_old_keys_are_pruned(tmpdir):
+    """Keys whose bucket is full again are removed from the database."""
+    store = SQLiteStore(str(tmpdir.join('ratelimit.db')))
+    store.hit('key', Limit.parse('1/minute'), now=1000)
+
+    store.prune(now=1061)
+
+    assert store.hit('key', Limit.parse('1/minute'), now=1061) == 0
+    assert store.database.connection().execute(
+        'SELECT COUNT(*) FROM rate_limits').fetchone()[0] == 1
+
+def test_login_attempts_for_an_account_are_limited(app, session, client,
+                                                   enabled_limiter):
+    """Too many login attempts for one account are rejected before the
+    database is queried."""
+    # Given the attempts an account is allowed
+    login_limit = Limit.parse(app.config['RATELIMIT_AUTH_PER_ACCOUNT'])
+    for _ in range(login_limit.count):
+        client.login(email='jane@example.com', password='wrong')
+
+    # When another attempt is made
+    with assert_max_queries(0):
+        response = client.login(email='jane@example.com', password='wrong')
+
+    # Then it is rejected
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+    # But another account can still log in
+    response = client.login(email='john@example.com', password='wrong')
+    assert response.status_code == 200
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_sessions
+~~~~~~~~~~~~~~~~~~~
+
+Unit tests for the server-side session store.
+"""
+
+from flask import Flask, session
+from flask_login import login_user, LoginManager, logout_user, UserMixin
+import pytest
+
+from app import sessions
+from app.sessions import ServerSideSessionInterface
+
+
+class CountingStore(sessions.SQLiteSessionStore):
+    """A SQLite store that counts how often it is used."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.calls = []
+
+    def load(self, key):
+        self.calls.append('load')
+        return super().load(key)
+
+    def save(self, key, data, expires):
+        self.calls.append('save')
+        return super().save(key, data, expires)
+
+
+@pytest.fixture(scope='function')
+def session_app(tmpdir):
+    """A bare app using a server-side session store."""
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='secret',
+                      SESSION_STORE='tests.unit.test_sessions.CountingStore',
+                      SESSION_STORE_PATH=str(tmpdir.join('sessions.db')))
+    sessions.init_app(app)
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return 'ok'
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', 'none')
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        return 'ok'
+
+    @app.route('/static')
+    def static_page():
+        return 'static'
+
+    yield app
+
+
+class SessionUser(UserMixin):
+
+    def __init__(self, id):
+        self.id = id
+
+
+@pytest.fixture(scope='function')
+def login_app(session_app):
+    """The session app, with users logging in and out."""
+    app = session_app
+    login_manager = LoginManager(app)
+    login_manager.user_loader(SessionUser)
+
+    @app.route('/login')
+    def login():
+        login_user(SessionUser('1'))
+        return 'ok'
+
+    @app.route('/logout')
+    def logout():
+        logout_user()
+        return 'ok'
+
+    yield app
+
+
+def session_id(client):
+    return next(cookie.value for cookie in client.cookie_jar
+                if cookie.name == 'session')
+
+
+def store(app):
+    return app.session_interface.store
+
+
+def test_the_cookie_only_holds_an_opaque_session_id(session_app):
+    """The session data is kept on the server."""
+    client = session_app.test_client()
+
+    response = client.get('/set/secret-value')
+
+    cookie = response.headers['Set-Cookie']
+    assert 'secret-value' not in cookie
+    assert client.get('/get').data == b'secret-value'
+
+def test_requests_that_dont_use_the_session_dont_touch_the_store(session_app):
+    """Sessions are only loaded when used and only saved when modified."""
+    client = session_app.test_client()
+    client.get('/set/value')
+    store(session_app).calls.clear()
+
+    client.get('/static')
+    assert store(session_app).calls == []
+
+    response = client.get('/get')
+    assert store(session_app).calls == ['load']
+    assert 'Set-Cookie' not in response.headers
+
+def test_unknown_session_ids_are_replaced(session_app):
+    """A session id that isn't in the store is never reused."""
+    client = session_app.test_client()
+    client.set_cookie('localhost', 'session', 'planted')
+
+    response = client.get('/set/value')
+
+    assert 'session=planted' not in response.headers['Set-Cookie']
+    assert client.get('/get').data == b'value'
+
+def test_a_cleared_session_is_deleted(session_app):
+    """Clearing the session deletes it from the store and the cookie."""
+    client = session_app.test_client()
+    client.get('/set/value')
+
+    client.get('/clear')
+
+    assert client.get('/get').data == b'none'
+    assert store(session_app).database.connection().execute(
+        'SELECT COUNT(*) FROM sessions').fetchone()[0] == 0
+
+def test_stale_sessions_are_expired_in_bulk(session_app):
+    """Expired sessions are deleted all at once."""
+    client = session_app.test_client()
+    client.get('/set/value')
+    store(session_app).save('stale', '{}', 1000)
+
+    assert store(session_app).expire() == 1
+    assert client.get('/get').data == b'value'
+
+def test_the_session_id_changes_when_logging_in_and_out(login_app):
+    """Logging in or out moves the session to a new id, so a session id
+    planted before logging in can't be used afterwards."""
+    # Given a session started before logging in
+    client = login_app.test_client()
+    client.get('/set/value')
+    planted = session_id(client)
+
+    # When the user logs in
+    client.get('/login')
+
+    # Then expect a new session id with the same data, and the old one gone
+    logged_in = session_id(client)
+    assert logged_in != planted
+    assert client.get('/get').data == b'value'
+    attacker = login_app.test_client()
+    attacker.set_cookie('localhost', 'session', planted)
+    assert attacker.get('/get').data == b'none'
+
+    # And logging out moves the session again
+    client.get('/logout')
+    assert session_id(client) not in (planted, logged_in)
+    assert client.get('/get').data == b'value'
+
+def test_an_incomplete_store_cant_be_created(session_app):
+    """A store that doesn't implement the whole interface fails when it is
+    created, rather than on the first request that uses it."""
+    # Given a store without expire
+    class IncompleteStore(sessions.SessionStore):
+        def load(self, key):
+            return None
+
+        def save(self, key, data, expires):
+            pass
+
+        def delete(self, key):
+            pass
+
+    # When it is created
+    # Then expect a TypeError
+    with pytest.raises(TypeError):
+        IncompleteStore(session_app)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_smtp
+~~~~~~~~~~~~~~~
+
+Unit tests for the SMTP connection pool.
+"""
+
+from threading import Thread
+
+from flask_mail import Message
+import pytest
+
+from app import create_app
+from app.config import TestingConfig
+from app.mail import send_message, send_messages, smtp_pool
+from tests.utilities.smtp import LocalSMTPServer
+
+
+def message(n=0):
+    return Message('Message {}'.format(n), sender='app@example.com',
+                   recipients=['jane@example.com'], body='Hello')
+
+
+@pytest.fixture(scope='function')
+def server():
+    with LocalSMTPServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def smtp_app(server):
+    """Creates an app that sends mail to the local SMTP server."""
+    app = create_app(type('SMTPConfig', (TestingConfig,), {
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': server.port,
+        'MAIL_USE_TLS': False,
+        'MAIL_USERNAME': None,
+        'MAIL_SUPPRESS_SEND': False,
+    }))
+    with app.app_context():
+        yield app
+        smtp_pool.close()
+
+
+def test_connections_are_reused(smtp_app, server):
+    """Messages are sent over a pooled connection."""
+    for n in range(3):
+        send_message(message(n))
+
+    assert len(server.messages) == 3
+    assert server.connections == 1
+    assert smtp_pool.statistics()['idle'] == 1
+
+def test_a_batch_is_sent_over_one_connection(smtp_app, server):
+    """send_messages sends every message over a single connection."""
+    send_messages([message(n) for n in range(5)])
+
+    assert len(server.messages) == 5
+    assert server.connections == 1
+
+def test_a_dropped_connection_is_reopened(smtp_app, server):
+    """A connection closed by the server is replaced without losing the
+    message."""
+    send_message(message(1))
+    server.drop_connections()
+    send_message(message(2))
+
+    assert len(server.messages) == 2
+    assert server.connections == 2
+    assert smtp_pool.statistics()['reconnects'] == 1
+
+def test_idle_connections_are_not_reused(smtp_app, server):
+    """A connection idle for longer than the idle timeout is closed."""
+    smtp_pool.configure(size=2, idle_timeout=0)
+
+    send_message(message(1))
+    send_message(message(2))
+
+    assert len(server.messages) == 2
+    assert server.connections == 2
+    assert smtp_pool.statistics()['idle'] == 1
+
+def test_pooling_can_be_turned_off(smtp_app, server):
+    """With a pool size of 0 every message gets its own connection."""
+    smtp_pool.configure(size=0, idle_timeout=30)
+
+    send_message(message(1))
+    send_message(message(2))
+
+    assert len(server.messages) == 2
+    assert server.connections == 2
+    assert smtp_pool.statistics()['idle'] == 0
+
+def test_messages_sent_from_several_threads_are_counted(smtp_app, server):
+    """Every message and connection is counted when workers send at once."""
+    smtp_pool.configure(size=4, idle_timeout=30)
+
+    def send(n):
+        with smtp_app.app_context():
+            for _ in range(5):
+                send_message(message(n))
+    threads = [Thread(target=send, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statistics = smtp_pool.statistics()
+    assert len(server.messages) == statistics['sent'] == 20
+    assert server.connections == statistics['connects']
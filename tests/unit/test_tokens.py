@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_tokens
+~~~~~~~~~~~~~~~~~
+
+Unit tests for the signed token service.
+"""
+
+import jwt
+
+from app.tokens import TokenService
+
+
+def test_tokens_can_be_issued_and_verified():
+    """A token's claims are returned when it is verified for its purpose."""
+    service = TokenService(['key'])
+
+    token = service.issue('greeting', {'hello': 'world'}, expires_in=60)
+
+    assert service.verify(token, 'greeting')['hello'] == 'world'
+    assert service.verify(token, 'farewell') is None
+    assert service.verify(token + 'x', 'greeting') is None
+
+def test_expired_tokens_are_rejected():
+    """Expired tokens are rejected, even when they are cached."""
+    service = TokenService(['key'])
+    expired = service.issue('greeting', {}, expires_in=-1)
+    service.cache.set(expired, jwt.decode(expired, 'key', verify=False))
+
+    assert service.verify(expired, 'greeting') is None
+
+def test_tokens_signed_with_an_old_key_verify_after_rotation():
+    """Tokens signed with any of the keys are accepted."""
+    # Given a token signed with the old key (and one from before kids)
+    old_token = TokenService(['old key']).issue('greeting', {}, expires_in=60)
+    legacy_token = jwt.encode({'exp': 2 ** 32}, 'old key').decode('utf-8')
+
+    # When a new key is added
+    service = TokenService(['new key', 'old key'])
+
+    # Then all of the tokens still verify, and new tokens use the new key
+    assert service.verify(old_token, 'greeting') is not None
+    assert service.verify(legacy_token, 'greeting') is not None
+    assert jwt.get_unverified_header(service.issue('greeting', {}, 60))['kid'] \
+        == service.keys[0][0]
+
+    # But once the old key is dropped they don't
+    service = TokenService(['new key'])
+    assert service.verify(old_token, 'greeting') is None
+
+def test_verified_tokens_are_cached():
+    """Verifying the same token again doesn't decode it again."""
+    service = TokenService(['key'])
+    token = service.issue('greeting', {}, expires_in=60)
+
+    service.verify(token, 'greeting')
+    service.verify(token, 'greeting')
+
+    assert service.cache.stats['hits'] == 1
+
+def test_tokens_can_be_issued_in_bulk():
+    """Bulk issued tokens are ordinary JWTs."""
+    service = TokenService(['key'])
+
+    tokens = service.issue_many('greeting', [{'n': n} for n in range(3)],
+                                expires_in=60, single_use=True)
+
+    claims = [jwt.decode(token, 'key', algorithms=['HS256'])
+              for token in tokens]
+    assert [claim['n'] for claim in claims] == [0, 1, 2]
+    assert len({claim['jti'] for claim in claims}) == 3
+    assert service.verify(tokens[0], 'greeting')['n'] == 0
@@ -7,7 +7,9 @@ tests.utilities.helpers
 Helper functions for tests.
 """
 
-from app.models import User
+from contextlib import contextmanager
+
+from app.models import record_queries, User
 
 
 def create_user(session, first_name='Jane', last_name='Doe', password='password123',
@@ -18,3 +20,13 @@ def create_user(session, first_name='Jane', last_name='Doe', password='password1
     session.add(user)
     session.flush()
     return user
+
+
+@contextmanager
+def assert_max_queries(count):
+    """Asserts that the block runs no more than `count` SQL statements."""
+    with record_queries() as queries:
+        yield queries
+    assert len(queries) <= count, \
+        'Expected at most {} queries, but {} were run:\n{}'.format(
+            count, len(queries), '\n'.join(queries.statements))
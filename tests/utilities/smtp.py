@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.utilities.smtp
+~~~~~~~~~~~~~~~~~~~~
+
+A local SMTP server to send test mail to.
+"""
+
+import asyncore
+import smtpd
+from threading import Event, Thread
+from time import sleep
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """An SMTP server on localhost that keeps the messages it receives and
+    counts the connections made to it. `latency` seconds are added to every
+    new connection, standing in for a real server's TCP and TLS handshakes.
+
+        with LocalSMTPServer() as server:
+            ...
+            assert len(server.messages) == 1
+    """
+
+    def __init__(self, latency=0.0):
+        self._map = {}
+        super().__init__(('127.0.0.1', 0), None, map=self._map)
+        self.port = self.socket.getsockname()[1]
+        self.latency = latency
+        self.connections = 0
+        self.messages = []
+        self._channels = []
+        self._running = Event()
+        self._drop = Event()
+        self._dropped = Event()
+        self._thread = Thread(target=self._serve, daemon=True)
+
+    def __enter__(self):
+        self._running.set()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._running.clear()
+        self._thread.join()
+        for channel in self._channels:
+            channel.close()
+        self.close()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        sleep(self.latency)
+        self._channels.append(self.channel_class(self, conn, addr,
+                                                 map=self._map))
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def drop_connections(self):
+        """Closes every open connection, as a server does to idle clients."""
+        self._dropped.clear()
+        self._drop.set()
+        self._dropped.wait(5)
+
+    def _serve(self):
+        while self._running.is_set():
+            asyncore.loop(timeout=0.01, count=1, map=self._map)
+            if self._drop.is_set():
+                for channel in self._channels:
+                    channel.close()
+                self._channels = []
+                self._drop.clear()
+                self._dropped.set()